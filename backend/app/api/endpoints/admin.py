@@ -1,7 +1,9 @@
-from fastapi import APIRouter, HTTPException, Depends
+import json
+from fastapi import APIRouter, HTTPException, Depends, Response
 from typing import List
-from app.models.schemas import ModelConfig, IngestRequest
-from app.core.auth import get_current_user
+from app.models.schemas import ModelConfig, IngestRequest, RoutingPolicy, ProfilerArmRequest
+from app.core.auth import get_current_user, require_admin
+from app.core.config import settings
 
 router = APIRouter()
 
@@ -11,9 +13,15 @@ MODEL_CONFIGS: List[ModelConfig] = [
     ModelConfig(id="gpt-4", name="GPT-4", provider="openai", is_active=False),
     ModelConfig(id="claude-3-sonnet", name="Claude 3.5 Sonnet", provider="anthropic"),
     # Production Model via KServe
-    ModelConfig(id="/mnt/models/Qwen2.5-1.5B-Instruct", name="Qwen 2.5 1.5B (KServe)", provider="kubeflow", is_active=True),
+    ModelConfig(id="/mnt/models/Qwen2.5-1.5B-Instruct", name="Qwen 2.5 1.5B (KServe)", provider="kubeflow", is_active=True, context_token_budget=2048),
 ]
 
+def _invalidate_llm_clients(*model_ids: str):
+    # Imported lazily: llm_service imports MODEL_CONFIGS from this module.
+    from app.services.llm_service import llm_service
+    for model_id in set(model_ids):
+        llm_service.invalidate(model_id)
+
 @router.get("/models", response_model=List[ModelConfig])
 async def get_models(_: dict = Depends(get_current_user)):
     # TODO: Implement RBAC check here (e.g., if _.role != 'admin': raise 403)
@@ -31,6 +39,7 @@ async def create_model(config: ModelConfig, _: dict = Depends(get_current_user))
             m.is_active = False
             
     MODEL_CONFIGS.append(config)
+    _invalidate_llm_clients(config.id)
     return config
 
 @router.put("/models/{model_id}", response_model=ModelConfig)
@@ -46,9 +55,47 @@ async def update_model(model_id: str, config: ModelConfig, _: dict = Depends(get
                 for existing in MODEL_CONFIGS:
                     existing.is_active = False
             MODEL_CONFIGS[i] = config
+            _invalidate_llm_clients(model_id, config.id)
             return config
     raise HTTPException(status_code=404, detail="Model not found")
 
+@router.get("/routing", response_model=RoutingPolicy)
+async def get_routing_policy(_: dict = Depends(get_current_user)):
+    from app.services.llm_service import llm_service
+    return llm_service.router.policy
+
+@router.put("/routing", response_model=RoutingPolicy)
+async def update_routing_policy(policy: RoutingPolicy, _: dict = Depends(require_admin)):
+    """
+    Set the primary/secondary models and hedging limits for the default route.
+    A null primary follows the active model; a null secondary disables hedging and fallback.
+    """
+    known = {m.id for m in MODEL_CONFIGS}
+    for model_id in (policy.primary_model_id, policy.secondary_model_id):
+        if model_id is not None and model_id not in known:
+            raise HTTPException(status_code=400, detail=f"Unknown model ID: {model_id}")
+    from app.services.llm_service import llm_service
+    llm_service.router.set_policy(policy)
+    return policy
+
+@router.get("/routing/stats")
+async def get_routing_stats(_: dict = Depends(get_current_user)):
+    """Per-model latency quantiles, error rates and hedging counters."""
+    from app.services.llm_service import llm_service
+    return llm_service.router.stats()
+
+@router.get("/providers/stats")
+async def get_provider_stats(_: dict = Depends(get_current_user)):
+    """Circuit breaker, bulkhead and rate-limit state per LLM provider."""
+    from app.services.llm_service import llm_service
+    return llm_service.provider_stats()
+
+@router.get("/admission/stats")
+async def get_admission_stats(_: dict = Depends(get_current_user)):
+    """In-flight, queued, admitted and rejected chat requests."""
+    from app.api.endpoints.chat import chat_admission
+    return chat_admission.stats()
+
 @router.post("/ingest")
 async def trigger_ingestion(request: IngestRequest, current_user: dict = Depends(get_current_user)):
     """
@@ -56,10 +103,90 @@ async def trigger_ingestion(request: IngestRequest, current_user: dict = Depends
     This logic has been moved from the chat endpoint (public) to admin (secured).
     """
     from app.services.kfp_service import kfp_service
+    from app.services.rag_service import rag_service
     # TODO: Add RBAC admin check
     result = await kfp_service.trigger_ingestion(
         bucket=request.bucket,
         prefix=request.prefix,
         cleanup=request.cleanup
     )
+    if result.get("status") == "success":
+        # New corpus version: cached answers must not outlive it
+        rag_service.bump_generation()
     return result
+
+@router.get("/cache/stats")
+async def get_cache_stats(_: dict = Depends(get_current_user)):
+    """Hit-rate and size statistics for the backend caches."""
+    from app.services.answer_cache import answer_cache
+    from app.services.memory_service import conversation_memory
+    from app.services.rag_service import rag_service
+    return {
+        "answer_cache": answer_cache.stats(),
+        **rag_service.stats(),
+        "conversation_summaries": conversation_memory.stats()
+    }
+
+@router.get("/embeddings/stats")
+async def get_embedding_stats(_: dict = Depends(get_current_user)):
+    """Batch-size and queue-wait metrics for query-embedding micro-batching."""
+    from app.services.rag_service import rag_service
+    return rag_service.embedding_batcher.stats()
+
+@router.post("/profiles/arm")
+async def arm_profiler(request: ProfilerArmRequest, _: dict = Depends(require_admin)):
+    """
+    Profile the next `requests` requests, or keep requests slower than `min_latency_ms`
+    (at most `requests` of them, if set too). Re-arming replaces the previous settings.
+    """
+    from app.core.profiler import profiler
+    limit = settings.PROFILER_MAX_ARMED_SECONDS
+    try:
+        return profiler.arm(
+            requests=request.requests,
+            min_latency_ms=request.min_latency_ms,
+            interval_ms=request.interval_ms,
+            path_prefix=request.path_prefix,
+            expires_in_seconds=min(request.expires_in_seconds or limit, limit)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/profiles/disarm")
+async def disarm_profiler(_: dict = Depends(require_admin)):
+    from app.core.profiler import profiler
+    return profiler.disarm()
+
+@router.get("/profiles")
+async def list_profiles(_: dict = Depends(require_admin)):
+    """Profiler state and the stored captures, newest first."""
+    from app.core.profiler import profiler
+    return {
+        **profiler.state(),
+        "captures": [capture.summary() for capture in reversed(profiler.captures)]
+    }
+
+@router.get("/profiles/{capture_id}")
+async def download_profile(capture_id: int, format: str = "collapsed", _: dict = Depends(require_admin)):
+    """
+    A stored capture as collapsed stacks (flamegraph.pl, inferno, speedscope) or
+    speedscope JSON. Stacks start with "cpu" (running on the event loop) or "wait"
+    (suspended, e.g. on I/O).
+    """
+    from app.core.profiler import profiler
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be 'collapsed' or 'speedscope'")
+    capture = profiler.get(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Capture not found")
+    if format == "speedscope":
+        return Response(
+            json.dumps(capture.speedscope()),
+            media_type="application/json",
+            headers={"Content-Disposition": f'attachment; filename="profile-{capture_id}.speedscope.json"'}
+        )
+    return Response(
+        capture.collapsed(),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="profile-{capture_id}.collapsed.txt"'}
+    )
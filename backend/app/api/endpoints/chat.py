@@ -1,35 +1,86 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+import time
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import List, Dict, Any
-from app.services.llm_service import llm_service
-from app.services.rag_service import rag_service
+from app.services.llm_service import llm_service, LLM_ERROR_PREFIX
+from app.services.rag_service import rag_service, normalize_query
+from app.services.answer_cache import answer_cache, CachedAnswer
+from app.services.context_packer import pack_context, count_tokens, PackedContext
+from app.services.compressor import compress_citations
+from app.services.memory_service import conversation_memory, ConversationContext
+from app.core import metrics, profiler, timing
 from app.core.auth import get_current_user
 from app.core.config import settings
-from minio import Minio
+from app.core.singleflight import SingleFlight
+from app.core.admission import AdmissionController, AdmissionRejected, AdmissionTicket, priority_for_roles
 
 router = APIRouter()
 
-from typing import List, Dict, Any, Optional
+# Identical in-flight chat requests (same normalized message, model and context_window,
+# no conversation history) run the retrieval + generation pipeline once per process.
+chat_flight = SingleFlight()
+
+# Caps concurrent chat pipelines; excess requests queue by priority class (from the
+# verified token's roles, see AUTH_ROLE_MAP; lowest class without one)
+chat_admission = AdmissionController(settings.ADMISSION_MAX_IN_FLIGHT, settings.ADMISSION_MAX_QUEUE)
+
+_chat_in_flight = metrics.REQUESTS_IN_FLIGHT.labels("chat")
+_stream_in_flight = metrics.REQUESTS_IN_FLIGHT.labels("chat_stream")
+_files_in_flight = metrics.REQUESTS_IN_FLIGHT.labels("files")
+
+from typing import List, Dict, Any, Optional, NamedTuple, Tuple, AsyncIterator, Iterator
 # Removed uuid import as generation is now handled by frontend or history service
 
 from app.models.schemas import ChatRequest, ChatResponse, Citation
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+async def _admit(http_request: Request, current_user: dict) -> Optional[AdmissionTicket]:
     """
-    Chat endpoint.
-    1. Retrieve relevant context from Qdrant via RAG Service.
-    2. Augment prompt.
-    3. Generate response via LLM Service.
+    Wait for a chat slot before any retrieval work is done.
+    Raises 429 when the queue is full and 503 when the request's queue deadline
+    passes, both with Retry-After.
     """
-    # 0. Handle Session ID (pass-through from request)
-    session_id = request.session_id
+    if not settings.ADMISSION_ENABLED:
+        return None
+    with metrics.stage("admission"):
+        return await _acquire(http_request, current_user)
 
-    # 1. Retrieve Context
-    context_nodes = await rag_service.query(request.message, k=request.context_window)
-    
-    # Map context nodes to Citations
+async def _acquire(http_request: Request, current_user: dict) -> AdmissionTicket:
+    timeout = settings.ADMISSION_QUEUE_TIMEOUT_SECONDS
+    try:
+        # Clients may ask to give up sooner than the server default
+        timeout = min(timeout, max(0.0, float(http_request.headers.get("X-Request-Timeout", timeout))))
+    except ValueError:
+        pass
+    deadline = asyncio.get_running_loop().time() + timeout
+    try:
+        return await chat_admission.acquire(priority_for_roles(current_user.get("roles")), deadline)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=503 if e.expired else 429,
+            detail=f"Server busy: {e.reason}",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def _timing_enabled(http_request: Request) -> bool:
+    """Stage breakdown is on unless disabled globally or by the request ("X-Server-Timing: off")."""
+    if not settings.SERVER_TIMING_ENABLED:
+        return False
+    return http_request.headers.get("X-Server-Timing", "").lower() not in ("off", "0", "false")
+
+def _with_timings(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the request's stage timings and notes (e.g. candidate counts) when it is being timed."""
+    recorder = timing.current()
+    if recorder is not None:
+        metadata["timings_ms"] = recorder.timings_ms()
+        metadata.update(recorder.notes)
+    return metadata
+
+def _to_citations(context_nodes: List[Dict[str, Any]]) -> List[Citation]:
+    """Map RAG context nodes to Citations."""
     citations = []
     for node in context_nodes:
         metadata = node.get("metadata", {})
@@ -39,9 +90,13 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
             page=int(metadata.get("page_label", 0)) if metadata.get("page_label") else 0,
             score=node.get("score")
         ))
-    
-    # 2. Augment Prompt
-    context_text = "\n\n".join([c.text for c in citations])
+    return citations
+
+def _build_messages(
+    message: str, context_texts: List[str], conversation: Optional[ConversationContext] = None
+) -> List[Dict[str, str]]:
+    """Augment the user message with the retrieved context and the conversation so far."""
+    context_text = "\n\n".join(context_texts)
     system_prompt = (
          "You are an AI assistant for Vellum. "
          "Use the following context to answer the user's question. "
@@ -49,28 +104,308 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
          "Answer directly.\n\n"
          f"Context:\n{context_text}"
     )
+    if conversation and conversation.summary:
+        system_prompt += f"\n\nSummary of the earlier conversation:\n{conversation.summary}"
     
-    messages = [
+    return [
         {"role": "system", "content": system_prompt},
-        {"role": "user", "content": request.message}
+        *(conversation.turns if conversation else []),
+        {"role": "user", "content": message}
     ]
 
-    # 3. Generate Response
+class _AnswerLookup(NamedTuple):
+    embedding: List[float]
+    model_id: str
+    provider: str
+    generation: Any
+    cached: Optional[CachedAnswer]
+
+def _flight_key(
+    request: ChatRequest, conversation: ConversationContext, model_id: str
+) -> Tuple[str, str, int, bool, Optional[str]]:
+    # Answers that depend on a session's history are never shared with other sessions
+    return (
+        normalize_query(request.message),
+        model_id,
+        request.context_window,
+        _compression_enabled(request),
+        request.session_id if conversation else None
+    )
+
+def _compression_enabled(request: ChatRequest) -> bool:
+    return settings.COMPRESSION_ENABLED if request.compress is None else request.compress
+
+async def _lookup_answer(request: ChatRequest, conversation: ConversationContext) -> _AnswerLookup:
+    """Embed the query and look it up in the semantic answer cache (stand-alone questions only)."""
+    config = llm_service.resolve_config()
+    with metrics.stage("lookup", config.id, config.provider):
+        embedding = await rag_service.embed_query(request.message)
+        generation = await rag_service.collection_generation()
+        cached = None
+        if not conversation:
+            cached = answer_cache.lookup(
+                embedding, config.id, request.context_window, generation, compressed=_compression_enabled(request)
+            )
+    return _AnswerLookup(embedding, config.id, config.provider, generation, cached)
+
+def _store_answer(
+    request: ChatRequest,
+    conversation: ConversationContext,
+    lookup: _AnswerLookup,
+    response_text: str,
+    citations: List[Citation],
+    metadata: Dict[str, Any]
+):
+    # Never cache LLM failures, answers that depend on conversation history, or answers
+    # whose compression failed (their citations do not match the requested mode)
+    if conversation or response_text.startswith(LLM_ERROR_PREFIX):
+        return
+    if metadata.get("compression") == {"skipped": "error"}:
+        return
+    answer_cache.store(
+        lookup.embedding,
+        lookup.model_id,
+        request.context_window,
+        response_text,
+        [c.model_dump() for c in citations],
+        lookup.generation,
+        compressed=_compression_enabled(request)
+    )
+
+async def _build_prompt(
+    request: ChatRequest,
+    conversation: ConversationContext,
+    query_embedding: List[float],
+    citations: List[Citation]
+) -> Tuple[List[Dict[str, str]], PackedContext, Dict[str, Any]]:
+    """
+    Optionally compress the citations to their query-relevant sentences, pack them
+    into the serving model's context token budget and build the messages with the
+    session's bounded history.
+    """
+    texts = None
+    metadata: Dict[str, Any] = {}
+    if _compression_enabled(request) and query_embedding:
+        try:
+            compressed = await compress_citations(
+                query_embedding, citations, rag_service.embed_texts, ratio=settings.COMPRESSION_RATIO
+            )
+        except Exception as e:
+            # Compression is an optimization: answer from the uncompressed chunks instead.
+            # TEI failures are counted in embed_texts.
+            print(f"WARNING: Context compression failed, using uncompressed citations: {e}")
+            metadata["compression"] = {"skipped": "error"}
+        else:
+            citations, texts = compressed.citations, compressed.texts
+            metadata["compression"] = {
+                "sentences_total": compressed.sentences_total,
+                "sentences_kept": compressed.sentences_kept
+            }
+
+    packed = pack_context(citations, llm_service.resolve_config().context_token_budget, texts)
+    messages = _build_messages(request.message, packed.texts, conversation)
+    # Prompt length drives time-to-first-token, so report it
+    metadata.update(packed.metadata())
+    if conversation:
+        metadata["history"] = conversation.metadata()
+    metadata["prompt_tokens"] = sum(count_tokens(m["content"]) for m in messages)
+    return messages, packed, metadata
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    response: Response,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Chat endpoint.
+    1. Retrieve relevant context from Qdrant via RAG Service.
+    2. Augment prompt.
+    3. Generate response via LLM Service.
+    4. Record the turn in the session history.
+    Identical concurrent requests are coalesced and run the pipeline once.
+    Requests are admitted by priority when the pipeline is saturated (429/503 otherwise).
+    The stage breakdown is returned in a Server-Timing header and in
+    metadata["timings_ms"] (coalesced requests report the shared run's stages).
+    """
+    started = time.perf_counter()
+    with _chat_in_flight.track_inprogress(), timing.recording(_timing_enabled(http_request)) as recorder:
+        ticket = await _admit(http_request, current_user)
+        try:
+            # 0. Handle Session ID (pass-through from request) and load its bounded history
+            session_id = request.session_id
+            conversation = conversation_memory.context(session_id)
+
+            config = llm_service.resolve_config()
+            profiler.tag(model_id=config.id)
+            result = await chat_flight.do(
+                _flight_key(request, conversation, config.id), lambda: _answer(request, conversation)
+            )
+        finally:
+            if ticket is not None:
+                ticket.release()
+    elapsed = time.perf_counter() - started
+    metrics.observe_stage("chat_total", elapsed, config.id, config.provider)
+    if recorder is not None and result.metadata and "timings_ms" in result.metadata:
+        response.headers["Server-Timing"] = timing.server_timing(
+            {**result.metadata["timings_ms"], "total": elapsed * 1000.0}
+        )
+    conversation_memory.record(
+        session_id, request.message, result.response, [c.model_dump() for c in result.citations]
+    )
+    return result.model_copy(update={"session_id": session_id})
+
+async def _answer(request: ChatRequest, conversation: ConversationContext) -> ChatResponse:
+    # 1. Embed once and check the semantic answer cache
     # Note: We currently ignore request.model_id as the backend is configured centrally or via env.
     # Future work: Pass model_id to llm_service if dynamic switching is needed.
-    response_text = await llm_service.chat(messages)
+    lookup = await _lookup_answer(request, conversation)
+    if lookup.cached:
+        return ChatResponse(
+            response=lookup.cached.response,
+            citations=[Citation(**c) for c in lookup.cached.citations],
+            metadata=_with_timings({"cache": {"hit": True, "similarity": round(lookup.cached.similarity, 4)}})
+        )
+
+    # 2. Retrieve Context
+    with metrics.stage("retrieval", lookup.model_id, lookup.provider):
+        context_nodes = await rag_service.query(
+            request.message, k=request.context_window, embedding=lookup.embedding
+        )
     
-    return ChatResponse(
-        response=response_text, 
-        citations=citations, 
-        session_id=session_id
+    # 3. Augment Prompt (optionally compressed, token-budgeted, overlapping spans removed)
+    with metrics.stage("prompt_build", lookup.model_id, lookup.provider):
+        messages, packed, metadata = await _build_prompt(
+            request, conversation, lookup.embedding, _to_citations(context_nodes)
+        )
+    citations = packed.citations
+
+    # 4. Generate Response
+    with metrics.stage("generation", lookup.model_id, lookup.provider):
+        response_text = await llm_service.chat(messages)
+    _store_answer(request, conversation, lookup, response_text, citations, metadata)
+    
+    return ChatResponse(response=response_text, citations=citations, metadata=_with_timings(metadata))
+
+def _frame(payload: Dict[str, Any]) -> str:
+    """Serialize one NDJSON frame."""
+    return json.dumps(payload) + "\n"
+
+async def _answer_stream(request: ChatRequest, conversation: ConversationContext) -> AsyncIterator[Dict[str, Any]]:
+    """Streaming pipeline; yields frame payloads (session_id is added per caller)."""
+    lookup = await _lookup_answer(request, conversation)
+    if lookup.cached:
+        yield {"type": "citations", "citations": lookup.cached.citations}
+        yield {"type": "token", "content": lookup.cached.response}
+        yield {"type": "done", "response": lookup.cached.response}
+        return
+
+    with metrics.stage("retrieval", lookup.model_id, lookup.provider):
+        context_nodes = await rag_service.query(
+            request.message, k=request.context_window, embedding=lookup.embedding
+        )
+    with metrics.stage("prompt_build", lookup.model_id, lookup.provider):
+        messages, packed, metadata = await _build_prompt(
+            request, conversation, lookup.embedding, _to_citations(context_nodes)
+        )
+    citations = packed.citations
+    yield {"type": "citations", "citations": [c.model_dump() for c in citations]}
+
+    tokens = llm_service.stream_chat(messages)
+    parts = []
+    try:
+        async for delta in tokens:
+            parts.append(delta)
+            yield {"type": "token", "content": delta}
+    except Exception as e:
+        yield {"type": "error", "message": f"{LLM_ERROR_PREFIX} {str(e)}"}
+        return
+    finally:
+        await tokens.aclose()
+
+    response_text = "".join(parts)
+    _store_answer(request, conversation, lookup, response_text, citations, metadata)
+    yield {"type": "done", "response": response_text, "metadata": _with_timings(metadata)}
+
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    http_request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Streaming chat endpoint (NDJSON, one JSON object per line).
+
+    Frames, in order:
+    - {"type": "citations", "citations": [...], "session_id": ...} as soon as retrieval finishes
+    - {"type": "token", "content": "..."} for every generated text delta
+    - {"type": "done", "response": "<full text>", "metadata": {...}, "session_id": ...}
+      or {"type": "error", "message": "..."} if generation fails
+
+    Headers are sent before any work is done, so the stage breakdown (including
+    llm_ttft) is only in the done frame's metadata["timings_ms"].
+
+    Identical concurrent requests share one token stream. If every attached
+    client disconnects, the upstream LLM stream is closed so the model server
+    stops generating. Admission happens before the response starts, so a busy
+    server answers 429/503 instead of an empty stream.
+    """
+    started = time.perf_counter()
+    timed = _timing_enabled(http_request)
+    ticket = await _admit(http_request, current_user)
+    session_id = request.session_id
+    conversation = conversation_memory.context(session_id)
+    config = llm_service.resolve_config()
+    profiler.tag(model_id=config.id)
+
+    def release():
+        if ticket is not None:
+            ticket.release()
+
+    async def event_stream():
+        # Installed for the rest of the response; the pipeline tasks started below inherit it
+        if timed:
+            timing.start()
+        frames = chat_flight.stream(
+            _flight_key(request, conversation, config.id), lambda: _answer_stream(request, conversation)
+        )
+        citations = []
+        _stream_in_flight.inc()
+        try:
+            async for frame in frames:
+                if frame["type"] == "token" and await http_request.is_disconnected():
+                    return
+                if frame["type"] == "citations":
+                    citations = frame["citations"]
+                if frame["type"] == "done":
+                    conversation_memory.record(session_id, request.message, frame["response"], citations)
+                if frame["type"] in ("citations", "done"):
+                    frame = {**frame, "session_id": session_id}
+                yield _frame(frame)
+        finally:
+            await frames.aclose()
+            release()
+            _stream_in_flight.dec()
+            metrics.observe_stage("chat_stream_total", time.perf_counter() - started, config.id, config.provider)
+
+    # The background task also releases the slot if the body is never iterated
+    return StreamingResponse(
+        event_stream(), media_type="application/x-ndjson", background=BackgroundTask(release)
     )
 
+def _counted(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    with _files_in_flight.track_inprogress():
+        for chunk in chunks:
+            metrics.MINIO_PROXY_BYTES.inc(len(chunk))
+            yield chunk
+
 @router.get("/files/{filename:path}")
 async def get_file_proxy(filename: str):
     """
     Proxy request to MinIO to serve the file directly.
     """
+    from minio import Minio
     try:
         # Initialize MinIO client locally for the proxy
         # We use the internal kubeflow svc endpoint
@@ -86,7 +421,7 @@ async def get_file_proxy(filename: str):
         
         # Stream the response back to the user
         return StreamingResponse(
-            response.stream(32*1024),
+            _counted(response.stream(32*1024)),
             media_type="application/pdf",
             headers={"Content-Disposition": f"inline; filename={filename}"}
         )
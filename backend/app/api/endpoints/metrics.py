@@ -0,0 +1,103 @@
+from typing import Any, Iterator
+
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+router = APIRouter()
+
+CIRCUIT_STATES = ("closed", "half_open", "open")
+
+
+class ServiceStatsCollector(Collector):
+    """
+    Exports the counters the services already keep (admission, caches, reranks,
+    embedding batches, LLM routing and provider guards) at scrape time, so the request path
+    pays nothing for them. Stage latencies, tokens and errors are recorded on the
+    hot path (see app.core.metrics).
+    """
+
+    def describe(self) -> Iterator[Any]:
+        # Without describe() the registry would call collect() (and import the services) on register
+        return iter(())
+
+    def collect(self) -> Iterator[Any]:
+        # Imported lazily: these modules import the services at import time
+        from app.api.endpoints.chat import chat_admission
+        from app.services.answer_cache import answer_cache
+        from app.services.llm_service import llm_service
+        from app.services.rag_service import rag_service
+
+        admission = chat_admission.stats()
+        yield _gauge("vellum_admission_in_flight", "Admitted chat pipelines running", admission["in_flight"])
+        yield _gauge("vellum_admission_queued", "Chat requests waiting for admission", admission["queued"])
+        yield _counter("vellum_admission_admitted", "Admitted chat requests", admission["admitted"], "priority")
+        yield _counter("vellum_admission_rejected", "Rejected chat requests", admission["rejected"], "reason")
+
+        caches = {
+            "answer": answer_cache.stats(),
+            "embedding": rag_service.embedding_cache.stats(),
+            "retrieval": rag_service.retrieval_cache.stats(),
+            "rerank_score": rag_service.reranker.score_cache.stats()
+        }
+        for field in ("entries", "bytes"):
+            yield _gauge(f"vellum_cache_{field}", f"Cache {field}", {n: s[field] for n, s in caches.items()}, "cache")
+        for field in ("hits", "misses", "evictions"):
+            yield _counter(f"vellum_cache_{field}", f"Cache {field}", {n: s[field] for n, s in caches.items()}, "cache")
+
+        yield _counter("vellum_rerank_skipped", "Reranks skipped (retrieval order kept)",
+                       rag_service.reranker.skipped, "reason")
+
+        batcher = rag_service.embedding_batcher
+        yield _counter("vellum_embedding_batches", "Batched TEI query-embedding requests", batcher.batches)
+        yield _counter("vellum_embedding_batched_queries", "Queries embedded through the batcher", batcher.requests)
+
+        routing = llm_service.router.stats()
+        models = routing["models"]
+        yield _gauge("vellum_llm_model_healthy", "1 if the router considers the model healthy",
+                     {m: float(s["healthy"]) for m, s in models.items()}, "model")
+        yield _gauge("vellum_llm_model_error_rate", "Recent LLM error rate seen by the router",
+                     {m: s["error_rate"] for m, s in models.items()}, "model")
+        for field in ("hedged", "fallbacks", "secondary_wins"):
+            yield _counter(f"vellum_llm_{field}", f"LLM routing: {field.replace('_', ' ')}", routing[field])
+
+        providers = llm_service.provider_stats()["providers"]
+        circuit = GaugeMetricFamily(
+            "vellum_llm_circuit_state", "1 for the current circuit breaker state", labels=["provider", "state"]
+        )
+        for name, stats in providers.items():
+            for state in CIRCUIT_STATES:
+                circuit.add_metric([name, state], float(stats["circuit"]["state"] == state))
+        yield circuit
+        yield _gauge("vellum_llm_bulkhead_in_use", "LLM calls holding a provider slot",
+                     {n: s["bulkhead"]["in_use"] for n, s in providers.items()}, "provider")
+        yield _gauge("vellum_llm_bulkhead_waiting", "LLM calls waiting for a provider slot",
+                     {n: s["bulkhead"]["waiting"] for n, s in providers.items()}, "provider")
+
+
+def _family(cls, name: str, documentation: str, values: Any, label: str):
+    """One unlabeled sample, or one sample per key of `values` under `label`."""
+    if not isinstance(values, dict):
+        return cls(name, documentation, value=values)
+    family = cls(name, documentation, labels=[label])
+    for key, value in values.items():
+        family.add_metric([str(key)], value)
+    return family
+
+
+def _gauge(name: str, documentation: str, values: Any, label: str = "") -> GaugeMetricFamily:
+    return _family(GaugeMetricFamily, name, documentation, values, label)
+
+
+def _counter(name: str, documentation: str, values: Any, label: str = "") -> CounterMetricFamily:
+    return _family(CounterMetricFamily, name, documentation, values, label)
+
+
+REGISTRY.register(ServiceStatsCollector())
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
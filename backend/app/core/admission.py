@@ -0,0 +1,147 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Lower value = served first. Users without a verified role (see auth.roles_from_claims)
+# get the lowest class, so nobody can jump the queue with a claim they wrote themselves.
+PRIORITY_CLASSES = {"admin": 0, "interactive": 1, "batch": 2}
+DEFAULT_PRIORITY = "batch"
+
+
+def priority_for_roles(roles: Optional[Iterable[str]]) -> str:
+    """Best priority class among the user's roles."""
+    known = [role for role in roles or [] if role in PRIORITY_CLASSES]
+    if not known:
+        return DEFAULT_PRIORITY
+    return min(known, key=PRIORITY_CLASSES.__getitem__)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int, expired: bool = False):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+        self.expired = expired  # waited until the deadline (vs. turned away up front)
+
+
+class AdmissionTicket:
+    """One admitted request; release() is idempotent."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller.observe(time.monotonic() - self._started)
+            self._controller._release()
+
+    async def __aenter__(self) -> "AdmissionTicket":
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Max in-flight limit with a bounded priority queue in front of it.
+
+    Requests run immediately while fewer than `max_in_flight` are running;
+    otherwise they wait in a queue ordered by priority class, then arrival. A
+    request that is still queued at its deadline is dropped (no pipeline work is
+    done for it). When the queue is full, a new request displaces the newest
+    queued request of a strictly lower class, or is rejected itself. Rejections
+    carry a Retry-After estimate from the recent service time.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        # (priority value, arrival seq, priority class, future); cancelled futures are skipped lazily
+        self._queue: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self.queued = 0
+        self._service_time = 1.0  # EWMA seconds per request, for Retry-After
+        self.admitted: Dict[str, int] = {name: 0 for name in PRIORITY_CLASSES}
+        self.rejected: Dict[str, int] = {"queue_full": 0, "expired": 0, "shed": 0}
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog is likely served."""
+        backlog = (self.queued + 1) / max(1, self.max_in_flight)
+        return max(1, math.ceil(backlog * self._service_time))
+
+    def observe(self, seconds: float):
+        """Feed a request's service time (EWMA) into the Retry-After estimate."""
+        self._service_time = 0.8 * self._service_time + 0.2 * seconds
+
+    async def acquire(self, priority: str, deadline: float) -> AdmissionTicket:
+        """Wait for a slot until `deadline` (loop time); raises AdmissionRejected."""
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self.admitted[priority] += 1
+            return AdmissionTicket(self)
+
+        rank = PRIORITY_CLASSES[priority]
+        if self.queued >= self.max_queue and not self._shed(rank):
+            self.rejected["queue_full"] += 1
+            raise AdmissionRejected("queue full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (rank, next(self._seq), priority, future))
+        self.queued += 1
+        try:
+            async with asyncio.timeout_at(deadline):
+                await asyncio.shield(future)
+        except BaseException as e:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as we gave up: pass the slot on
+                self._release()
+            elif not future.done():
+                future.cancel()
+                self.queued -= 1
+            if isinstance(e, TimeoutError):
+                self.rejected["expired"] += 1
+                raise AdmissionRejected("deadline passed while queued", self.retry_after(), expired=True) from None
+            raise
+        self.admitted[priority] += 1
+        return AdmissionTicket(self)
+
+    def _shed(self, rank: int) -> bool:
+        """Reject the newest queued request of a lower class than `rank` to make room."""
+        victims = [entry for entry in self._queue if entry[0] > rank and not entry[3].done()]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda entry: (entry[0], entry[1]))
+        victim[3].set_exception(AdmissionRejected("displaced by a higher-priority request", self.retry_after()))
+        victim[3].exception()  # mark retrieved; the waiter re-raises it
+        self.queued -= 1
+        self.rejected["shed"] += 1
+        return True
+
+    def _release(self):
+        # Hand the slot straight to the best live waiter, if any
+        while self._queue:
+            _, _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                self.queued -= 1
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "service_time_ms": round(self._service_time * 1000.0, 1),
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected)
+        }
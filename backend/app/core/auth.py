@@ -1,11 +1,56 @@
+import time
+from typing import Any, Dict, List, Optional
+import httpx
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from jose import JWTError, jwt
 from app.core.config import settings
 
 # In a real Entra ID setup, this would point to the token endpoint
 # auto_error=False allows us to handle the missing token manually (or bypass it)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
+ENTRA_LOGIN_URL = "https://login.microsoftonline.com"
+# An unknown key id refetches the key set (rotation), but at most this often
+JWKS_MIN_REFRESH_SECONDS = 300.0
+
+# Cached Entra ID signing key set (JWKS)
+_jwks: Dict[str, Any] = {"keys": None, "fetched_at": 0.0}
+
+def _credentials_error(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def _signing_keys(kid: Optional[str] = None) -> Dict[str, Any]:
+    age = time.monotonic() - _jwks["fetched_at"]
+    keys = _jwks["keys"]
+    stale = keys is None or age >= settings.AUTH_JWKS_CACHE_SECONDS
+    rotated = kid is not None and keys is not None and age >= JWKS_MIN_REFRESH_SECONDS \
+        and kid not in {key.get("kid") for key in keys.get("keys", [])}
+    if stale or rotated:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.get(f"{ENTRA_LOGIN_URL}/{settings.AZURE_TENANT_ID}/discovery/v2.0/keys")
+            response.raise_for_status()
+        _jwks.update(keys=response.json(), fetched_at=time.monotonic())
+    return _jwks["keys"]
+
+async def verify_token(token: str) -> Dict[str, Any]:
+    """
+    Claims of an Entra ID access token, after checking its signature (RS256, tenant
+    JWKS), audience, issuer and expiry. Raises JWTError for any invalid token.
+    """
+    kid = jwt.get_unverified_header(token).get("kid")
+    return jwt.decode(
+        token,
+        await _signing_keys(kid),
+        algorithms=["RS256"],
+        audience=settings.AUTH_AUDIENCE or settings.AZURE_CLIENT_ID,
+        issuer=settings.AUTH_ISSUER or f"{ENTRA_LOGIN_URL}/{settings.AZURE_TENANT_ID}/v2.0",
+    )
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     Validates the separate access token from Entra ID.
@@ -15,10 +60,44 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         return {"token": "bypass-token", "user": "bypassed-user", "roles": ["admin"]}
         
     if not token:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    # TODO: Implement JWT validation using python-jose and JWKS
-    return {"token": token, "user": "test-user"}
+        raise _credentials_error()
+
+    if not (settings.AZURE_TENANT_ID and settings.AZURE_CLIENT_ID):
+        # No tenant to verify against: the token is accepted as before but grants no roles
+        return {"token": token, "user": "test-user", "roles": []}
+
+    try:
+        claims = await verify_token(token)
+    except JWTError:
+        raise _credentials_error()
+    except httpx.HTTPError as e:
+        print(f"WARNING: Could not fetch Entra ID signing keys: {e}")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Token validation unavailable")
+    return {
+        "token": token,
+        "user": claims.get("preferred_username") or claims.get("oid") or claims.get("sub"),
+        "roles": roles_from_claims(claims)
+    }
+
+def roles_from_claims(claims: Dict[str, Any]) -> List[str]:
+    """
+    Internal roles for verified token claims: Entra ID app roles ("roles" claim) and
+    group object ids ("groups" claim) listed in AUTH_ROLE_MAP. Anything unmapped,
+    including a literal "admin", grants nothing.
+    """
+    roles = []
+    for claim in ("roles", "groups"):
+        values = claims.get(claim) or []
+        if isinstance(values, str):
+            values = [values]
+        for value in values:
+            role = settings.AUTH_ROLE_MAP.get(value)
+            if role and role not in roles:
+                roles.append(role)
+    return roles
+
+async def require_admin(current_user: dict = Depends(get_current_user)):
+    """Like get_current_user, but only for users with the "admin" role."""
+    if "admin" not in current_user.get("roles", []):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required")
+    return current_user
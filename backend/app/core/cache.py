@@ -0,0 +1,131 @@
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+
+def approx_size(value: Any) -> int:
+    """
+    Rough memory footprint of a cached value in bytes.
+    Good enough for enforcing a memory cap; not an exact accounting.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(approx_size(k) + approx_size(v) for k, v in value.items()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(approx_size(v) for v in value) + 8 * len(value) + 56
+    if hasattr(value, "__dict__"):
+        return approx_size(vars(value))
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """
+    Bounded LRU cache with optional TTL and approximate memory cap.
+
+    Not thread-safe: meant to be used from the event loop only.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_bytes: int = 0,
+        ttl_seconds: float = 0,
+        sizeof: Callable[[Any], int] = approx_size,
+        on_remove: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        # Called with (key, value) whenever an entry leaves the cache (evicted, expired,
+        # replaced, popped or cleared), for callers that keep an index over the entries
+        self._on_remove = on_remove
+        # key -> (value, expires_at, size)
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._live(key) is not None
+
+    def _live(self, key: Hashable) -> Optional[Tuple[Any, float, int]]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] and item[1] < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return item
+
+    def _remove(self, key: Hashable):
+        value, _, size = self._data.pop(key)
+        self.bytes -= size
+        if self._on_remove:
+            self._on_remove(key, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._live(key)
+        if item is None:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key: Hashable, value: Any):
+        if key in self._data:
+            self._remove(key)
+        size = self._sizeof(value)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else 0.0
+        self._data[key] = (value, expires_at, size)
+        self.bytes += size
+        while self._data and (
+            len(self._data) > self.max_entries
+            or (self.max_bytes and self.bytes > self.max_bytes)
+        ):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        value = self._data[key][0]
+        self._remove(key)
+        return value
+
+    def clear(self):
+        if self._on_remove:
+            for key, (value, _, _) in self._data.items():
+                self._on_remove(key, value)
+        self._data.clear()
+        self.bytes = 0
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Snapshot of live entries (drops expired ones, does not touch LRU order)."""
+        return [(key, item[0]) for key in list(self._data) if (item := self._live(key)) is not None]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
@@ -1,3 +1,5 @@
+from typing import Dict
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -17,6 +19,25 @@ class Settings(BaseSettings):
     QDRANT_HOST: str = "qdrant.qdrant.svc.cluster.local"
     QDRANT_PORT: int = 6333
     QDRANT_COLLECTION: str = "vellum"
+    QDRANT_LOCATION: str = ""  # e.g. ":memory:" for local runs; overrides host/port
+    # Retrieval path: "llamaindex" (node objects), "qdrant" (direct client, payload fields only),
+    # "grouped" (Qdrant group-by file_name, falls back to "llamaindex" on error)
+    # "mmr" (vectorized NumPy MMR over a k * RAG_MMR_CANDIDATE_MULTIPLIER candidate pool)
+    # or "hybrid" (dense + BM25 sparse in one batched query, weighted reciprocal rank fusion)
+    RAG_RETRIEVAL_MODE: str = "llamaindex"
+    RAG_MMR_CANDIDATE_MULTIPLIER: int = 10
+    RAG_MMR_LAMBDA: float = 0.7
+    RAG_HYBRID_DENSE_WEIGHT: float = 1.0
+    RAG_HYBRID_SPARSE_WEIGHT: float = 1.0
+    RAG_HYBRID_RRF_K: int = 60  # rank offset; larger flattens the contribution of top ranks
+    # Quantized collections: re-rank candidates with the original vectors (rescore),
+    # fetching limit * oversampling candidates from the quantized index
+    QDRANT_SEARCH_RESCORE: bool = True
+    QDRANT_SEARCH_OVERSAMPLING: float = 2.0
+    # HNSW beam width at query time (0 = Qdrant default); higher raises recall and latency.
+    # QDRANT_SEARCH_EXACT bypasses the index (brute force), e.g. for recall baselines.
+    QDRANT_SEARCH_HNSW_EF: int = 0
+    QDRANT_SEARCH_EXACT: bool = False
     
     # MinIO
     MINIO_ENDPOINT: str = "minio-service.kubeflow.svc:9000"
@@ -27,9 +48,99 @@ class Settings(BaseSettings):
     # Embeddings
     EMBEDDING_MODEL_NAME: str = "BAAI/bge-small-en-v1.5"
     EMBEDDINGS_SERVICE_URL: str = "http://embeddings-service.kubeflow-user-example-com/v1"
+    # Query-embedding micro-batching (TEI accepts up to --max-client-batch-size texts per call)
+    EMBED_BATCH_ENABLED: bool = True
+    EMBED_BATCH_WINDOW_MS: float = 5.0
+    EMBED_BATCH_MAX_SIZE: int = 32
+    
+    # Collection generation (answer/retrieval cache invalidation)
+    COLLECTION_VERSION_CHECK_SECONDS: float = 30.0
+    
+    # RAG caches (query embeddings and retrieval results)
+    RAG_EMBEDDING_CACHE_MAX_ENTRIES: int = 10000
+    RAG_EMBEDDING_CACHE_TTL_SECONDS: float = 86400.0
+    RAG_RETRIEVAL_CACHE_MAX_ENTRIES: int = 5000
+    RAG_RETRIEVAL_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RAG_RETRIEVAL_CACHE_TTL_SECONDS: float = 900.0
+    
+    # Cross-encoder reranking (TEI /rerank); RERANK_CANDIDATES are retrieved, the top k kept
+    RERANK_ENABLED: bool = False
+    RERANKER_SERVICE_URL: str = "http://reranker-service.kubeflow-user-example-com"
+    RERANK_CANDIDATES: int = 20
+    RERANK_LATENCY_BUDGET_MS: float = 300.0  # slower calls are abandoned (retrieval order kept)
+    RERANK_MAX_IN_FLIGHT: int = 8  # more concurrent reranks than this are skipped
+    RERANK_SCORE_CACHE_MAX_ENTRIES: int = 100000
+    RERANK_SCORE_CACHE_TTL_SECONDS: float = 86400.0
+    
+    # Semantic answer cache
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.97
+    ANSWER_CACHE_TTL_SECONDS: float = 3600.0
+    ANSWER_CACHE_MAX_ENTRIES: int = 2000
+    ANSWER_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    
+    # Prompt context packing
+    TOKENIZER_ENCODING: str = "cl100k_base"
+    DEFAULT_CONTEXT_TOKEN_BUDGET: int = 3000  # used when ModelConfig.context_token_budget is unset
+    # Query-focused extractive compression of retrieved chunks
+    COMPRESSION_ENABLED: bool = False
+    COMPRESSION_RATIO: float = 0.5
+    
+    # Conversation memory (server-side sessions)
+    HISTORY_TOKEN_BUDGET: int = 1024  # recent turns sent verbatim; older turns are summarized
+    MEMORY_SUMMARY_MAX_TOKENS: int = 256
+    MEMORY_COMPACTION_CHUNK_TOKENS: int = 2048  # max turn tokens folded in per summarization call
+    MEMORY_MAX_SESSIONS: int = 10000
+    
+    # LLM client pool
+    LLM_CLIENT_POOL_SIZE: int = 16
+    LLM_HTTP_MAX_CONNECTIONS: int = 100
+    LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = 30.0
+    LLM_HTTP_TIMEOUT: float = 120.0
+    
+    # Per-provider resilience (rate limits are per model: ModelConfig.rpm_limit / tpm_limit)
+    LLM_REQUEST_TIMEOUT: float = 60.0  # whole chat call / first streamed token; ModelConfig.timeout_seconds overrides
+    LLM_STREAM_IDLE_TIMEOUT: float = 30.0  # max gap between streamed tokens
+    LLM_PROVIDER_MAX_CONCURRENCY: int = 32
+    LLM_PROVIDER_MAX_QUEUE: int = 64
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5  # consecutive failures before the circuit opens
+    LLM_BREAKER_RECOVERY_SECONDS: float = 30.0
+    
+    # Latency-aware model routing (policy itself is set through /admin/routing)
+    ROUTING_WINDOW_SIZE: int = 200  # latency / outcome samples kept per model
+    ROUTING_WINDOW_SECONDS: float = 300.0  # older samples are ignored, so skipped models get retried
+    
+    # Chat admission control
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_IN_FLIGHT: int = 32
+    ADMISSION_MAX_QUEUE: int = 128
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 15.0  # max queue wait; X-Request-Timeout may shorten it
+    
+    # Per-request stage breakdown (Server-Timing header, ChatResponse.metadata["timings_ms"]).
+    # A request can opt out with "X-Server-Timing: off".
+    SERVER_TIMING_ENABLED: bool = True
+    
+    # On-demand request profiler (armed through /admin/profiles)
+    PROFILER_MAX_CAPTURES: int = 20  # ring buffer of stored captures
+    PROFILER_MAX_ARMED_SECONDS: float = 600.0  # an armed profiler disarms itself after this long
+    
+    # Startup warm-up behind GET /ready. Failing steps are retried until the timeout;
+    # the pod is then marked ready anyway (degraded) rather than kept out forever.
+    WARMUP_ENABLED: bool = True
+    WARMUP_TIMEOUT_SECONDS: float = 120.0
+    WARMUP_RETRY_SECONDS: float = 2.0
+    WARMUP_LLM: bool = True  # one-token chat against the active model
     
     # Security
     BYPASS_AUTH: bool = True
+    # Token app roles / group object ids -> internal roles ("admin", "interactive", "batch"),
+    # e.g. {"Vellum.Admin": "admin"}. Only applied to tokens verified against the Entra ID
+    # signing keys (AZURE_TENANT_ID and AZURE_CLIENT_ID set); unmapped values grant nothing.
+    AUTH_ROLE_MAP: Dict[str, str] = {}
+    AUTH_AUDIENCE: str = ""  # default: AZURE_CLIENT_ID
+    AUTH_ISSUER: str = ""  # default: the tenant's v2.0 issuer
+    AUTH_JWKS_CACHE_SECONDS: float = 3600.0
     
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -0,0 +1,91 @@
+import time
+from typing import Dict, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram, disable_created_metrics
+
+from app.core import timing
+
+# *_created series add one sample per labeled child and nothing queries them
+disable_created_metrics()
+
+# Stage latencies span sub-millisecond cache hits to multi-second generations
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+STAGE_SECONDS = Histogram(
+    "vellum_stage_duration_seconds",
+    "Latency of one stage of the chat pipeline (chat, RAGService.query, LLMService.chat)",
+    ["stage", "model", "provider"],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "vellum_requests_in_flight", "Requests currently being served", ["endpoint"]
+)
+LLM_TOKENS = Counter(
+    "vellum_llm_tokens_total", "Tokens sent to and generated by the LLMs", ["model", "provider", "kind"]
+)
+DEPENDENCY_ERRORS = Counter(
+    "vellum_dependency_errors_total", "Failed calls to backing services", ["service", "operation"]
+)
+MINIO_PROXY_BYTES = Counter(
+    "vellum_minio_proxy_bytes_total", "Bytes streamed to clients by the MinIO file proxy"
+)
+
+# Label lookups cost more than the observation itself, so children are resolved once
+_stage_children: Dict[Tuple[str, str, str], object] = {}
+_token_children: Dict[Tuple[str, str, str], object] = {}
+
+
+def _stage_child(stage: str, model: str, provider: str):
+    key = (stage, model, provider)
+    child = _stage_children.get(key)
+    if child is None:
+        child = _stage_children[key] = STAGE_SECONDS.labels(stage, model, provider)
+    return child
+
+
+def observe_stage(stage: str, seconds: float, model: str = "", provider: str = ""):
+    """Record a stage duration measured by the caller (e.g. time to first token)."""
+    _stage_child(stage, model, provider).observe(seconds)
+    timing.record(stage, seconds)
+
+
+class StageTimer:
+    """
+    Context manager timing one stage into the histogram and the request's span
+    recorder (app.core.timing), if one is installed. Failed stages are recorded too.
+    """
+
+    __slots__ = ("_stage", "_child", "_started")
+
+    def __init__(self, stage: str, child):
+        self._stage = stage
+        self._child = child
+
+    def __enter__(self) -> "StageTimer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        elapsed = time.perf_counter() - self._started
+        self._child.observe(elapsed)
+        timing.record(self._stage, elapsed)
+        return False
+
+
+def stage(name: str, model: str = "", provider: str = "") -> StageTimer:
+    return StageTimer(name, _stage_child(name, model, provider))
+
+
+def record_tokens(model: str, provider: str, prompt: int, completion: int):
+    for kind, value in (("prompt", prompt), ("completion", completion)):
+        key = (model, provider, kind)
+        child = _token_children.get(key)
+        if child is None:
+            child = _token_children[key] = LLM_TOKENS.labels(model, provider, kind)
+        child.inc(value)
+
+
+def dependency_error(service: str, operation: str):
+    DEPENDENCY_ERRORS.labels(service, operation).inc()
@@ -0,0 +1,322 @@
+import os
+import sys
+import time
+import asyncio
+import datetime
+import itertools
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from types import CodeType, FrameType
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+_capture: ContextVar[Optional["Capture"]] = ContextVar("profile_capture", default=None)
+
+# Frame labels are shortened to the path below site-packages / the backend directory
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Capture:
+    """Samples of one request: stacks (root first) -> count."""
+
+    def __init__(self, capture_id: int, method: str, path: str, interval: float):
+        self.id = capture_id
+        self.tags: Dict[str, Any] = {"route": path, "method": method}
+        self.interval = interval
+        self.started_at = datetime.datetime.now(datetime.timezone.utc)
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        # The request's task and the tasks it spawned, oldest first
+        self.tasks: List[asyncio.Task] = []
+        self.token = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            **self.tags,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration * 1000.0, 1),
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000.0
+        }
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed stack format (flamegraph.pl, speedscope, inferno)."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self) -> Dict[str, Any]:
+        """speedscope "sampled" profile; each distinct stack once, weighted by its samples."""
+        frames: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            samples.append([frames.setdefault(label, len(frames)) for label in stack])
+            weights.append(round(count * self.interval * 1000.0, 3))
+        name = " ".join(f"{key}={value}" for key, value in self.tags.items())
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": label} for label in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights
+            }],
+            "name": f"capture {self.id}: {name}",
+            "exporter": "vellum"
+        }
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for individual requests, armed on demand.
+
+    While armed, a ProfilerMiddleware request gets a Capture and a daemon thread
+    samples every `interval`. When one of the request's tasks is running on the
+    event loop, the loop thread's stack (sys._current_frames) is recorded under
+    "cpu"; otherwise the await chain of its newest live task is recorded under
+    "wait" (where it is blocked on I/O). Tasks are attributed to a request through
+    a context variable that a loop task factory reads; the factory is only
+    installed while armed, so a disarmed profiler costs one attribute check per
+    request.
+
+    Arming captures the next `requests` requests, or, with `min_latency_ms`, keeps
+    only requests at least that slow (every request is sampled meanwhile); up to
+    `requests` of them when that is set too. Captures go into a bounded ring buffer.
+    """
+
+    def __init__(self, max_captures: int = 20):
+        self.captures: Deque[Capture] = deque(maxlen=max_captures)
+        self.armed = False
+        self.path_prefix = ""
+        self.interval = 0.01
+        self.remaining = 0
+        self.min_latency = 0.0
+        self.expires_at = 0.0
+        self._ids = itertools.count(1)
+        self._active: Dict[int, Capture] = {}
+        self._task_captures: Dict[asyncio.Task, Capture] = {}
+        self._loops: Dict[asyncio.AbstractEventLoop, Any] = {}  # loop -> previous task factory
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._labels: Dict[CodeType, str] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Arming ---
+
+    def arm(
+        self,
+        requests: int = 0,
+        min_latency_ms: float = 0.0,
+        interval_ms: float = 10.0,
+        path_prefix: str = "",
+        expires_in_seconds: Optional[float] = None
+    ) -> Dict[str, Any]:
+        if requests <= 0 and min_latency_ms <= 0:
+            raise ValueError("Set requests and/or min_latency_ms")
+        self.remaining = requests
+        self.min_latency = min_latency_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.path_prefix = path_prefix
+        self.expires_at = time.monotonic() + (expires_in_seconds or settings.PROFILER_MAX_ARMED_SECONDS)
+        with self._lock:
+            self.armed = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+                self._thread.start()
+        return self.state()
+
+    def disarm(self) -> Dict[str, Any]:
+        """Stop starting captures; captures in progress still finish."""
+        self.armed = False
+        self._uninstall_if_idle()
+        return self.state()
+
+    def _uninstall_if_idle(self):
+        """Restore the loops' task factories once no capture needs them (event loop thread)."""
+        if self.armed or self._active:
+            return
+        for loop, previous in list(self._loops.items()):
+            if loop.get_task_factory() == self._task_factory:
+                loop.set_task_factory(previous)
+        self._loops.clear()
+
+    def state(self) -> Dict[str, Any]:
+        return {
+            "armed": self.armed,
+            "remaining": self.remaining,
+            "min_latency_ms": self.min_latency * 1000.0,
+            "interval_ms": self.interval * 1000.0,
+            "path_prefix": self.path_prefix,
+            "expires_in_seconds": round(max(0.0, self.expires_at - time.monotonic()), 1) if self.armed else 0.0,
+            "in_progress": len(self._active),
+            "stored": len(self.captures)
+        }
+
+    def get(self, capture_id: int) -> Optional[Capture]:
+        return next((c for c in self.captures if c.id == capture_id), None)
+
+    # --- Request hooks (event loop thread) ---
+
+    def begin(self, method: str, path: str) -> Optional[Capture]:
+        if time.monotonic() >= self.expires_at:
+            self.disarm()
+            return None
+        if not path.startswith(self.path_prefix):
+            return None
+        if not self.min_latency:
+            # Fixed-count mode: the next `remaining` requests are captured
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.armed = False
+        loop = asyncio.get_running_loop()
+        if loop not in self._loops:
+            self._loops[loop] = loop.get_task_factory()
+            loop.set_task_factory(self._task_factory)
+        self._loop, self._loop_thread = loop, threading.get_ident()
+
+        capture = Capture(next(self._ids), method, path, self.interval)
+        capture.token = _capture.set(capture)
+        self._adopt(asyncio.current_task(), capture)
+        self._active[capture.id] = capture
+        return capture
+
+    def end(self, capture: Capture, endpoint: Optional[str] = None):
+        _capture.reset(capture.token)
+        self._active.pop(capture.id, None)
+        for task in capture.tasks:
+            self._task_captures.pop(task, None)
+        capture.tasks = []
+        capture.duration = time.perf_counter() - capture.started
+        if endpoint:
+            capture.tags["endpoint"] = endpoint
+        if capture.duration >= self.min_latency:
+            self.captures.append(capture)
+            if self.min_latency and self.remaining > 0:
+                self.remaining -= 1
+                if self.remaining == 0:
+                    self.armed = False
+        self._uninstall_if_idle()
+
+    def _adopt(self, task: Optional[asyncio.Task], capture: Capture):
+        if task is not None:
+            capture.tasks.append(task)
+            self._task_captures[task] = capture
+
+    def _task_factory(self, loop: asyncio.AbstractEventLoop, coro, **kwargs) -> asyncio.Task:
+        previous = self._loops.get(loop)
+        task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        capture = context.get(_capture) if context is not None else _capture.get()
+        if capture is not None and capture.id in self._active:
+            self._adopt(task, capture)
+        return task
+
+    # --- Sampling (profiler thread) ---
+
+    def _sample_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if self.armed and time.monotonic() >= self.expires_at:
+                    self.armed = False
+                    if self._loop is not None:
+                        self._loop.call_soon_threadsafe(self._uninstall_if_idle)
+                if not (self.armed or self._active):
+                    self._thread = None
+                    return
+            active = tuple(self._active.values())
+            if active:
+                try:
+                    self._sample(active)
+                except Exception:
+                    # Stacks change under us; a torn sample is dropped
+                    pass
+
+    def _sample(self, active: Tuple[Capture, ...]):
+        frame = sys._current_frames().get(self._loop_thread)
+        running = asyncio.current_task(self._loop)
+        owner = self._task_captures.get(running) if running is not None else None
+        for capture in active:
+            if capture is owner and frame is not None:
+                stack = ("cpu",) + self._frame_stack(frame)
+            else:
+                task = next((t for t in reversed(capture.tasks) if not t.done()), None)
+                if task is None:
+                    continue
+                stack = ("wait",) + self._await_stack(task)
+            capture.stacks[stack] += 1
+            capture.samples += 1
+
+    def _label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            path = code.co_filename
+            if "site-packages" + os.sep in path:
+                path = path.split("site-packages" + os.sep, 1)[1]
+            elif path.startswith(_BACKEND_DIR):
+                path = os.path.relpath(path, _BACKEND_DIR)
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{name} ({path}:{code.co_firstlineno})"
+        return label
+
+    def _frame_stack(self, frame: Optional[FrameType]) -> Tuple[str, ...]:
+        labels = []
+        while frame is not None:
+            labels.append(self._label(frame.f_code))
+            frame = frame.f_back
+        return tuple(reversed(labels))
+
+    def _await_stack(self, task: asyncio.Task) -> Tuple[str, ...]:
+        labels = []
+        coro = task.get_coro()
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            labels.append(self._label(frame.f_code))
+            coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+        return tuple(labels)
+
+
+class ProfilerMiddleware:
+    """ASGI middleware that runs armed requests under a profiler Capture."""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.armed or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        capture = self.profiler.begin(scope["method"], scope["path"])
+        if capture is None:
+            return await self.app(scope, receive, send)
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                capture.tags["status"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            # The matched route's name; its path may be relative to an included router's prefix
+            self.profiler.end(capture, getattr(scope.get("route"), "name", None))
+
+
+def tag(**tags: Any):
+    """Tag the current request's capture (e.g. model_id); a no-op unless it is being profiled."""
+    capture = _capture.get()
+    if capture is not None:
+        capture.tags.update(tags)
+
+
+profiler = SamplingProfiler(settings.PROFILER_MAX_CAPTURES)
@@ -0,0 +1,210 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+
+class ProviderUnavailableError(Exception):
+    """A call was rejected locally, before reaching the provider."""
+
+
+class CircuitOpenError(ProviderUnavailableError):
+    pass
+
+
+class BulkheadFullError(ProviderUnavailableError):
+    pass
+
+
+class RateLimitedError(ProviderUnavailableError):
+    pass
+
+
+def _now() -> float:
+    # Deadlines are loop times so they work with asyncio.timeout_at()
+    return asyncio.get_running_loop().time()
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` / 60 per second, holding at
+    most one minute of budget. acquire() waits for tokens but never past a deadline.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float, deadline: float):
+        # A single request larger than the whole bucket could never be admitted
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            wait = (amount - self.tokens) / self.rate
+            if _now() + wait > deadline:
+                self.rejected += 1
+                raise RateLimitedError(f"rate limit: {amount:.0f} tokens not available before the deadline")
+            await asyncio.sleep(wait)
+
+    def debit(self, amount: float):
+        """Charge usage known only after the call (e.g. completion tokens); may go negative."""
+        self._refill()
+        self.tokens -= amount
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {"per_minute": self.capacity, "available": round(self.tokens, 1), "rejected": self.rejected}
+
+
+class Bulkhead:
+    """Concurrency cap with a bounded wait queue."""
+
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_use = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self, deadline: float):
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise BulkheadFullError(f"bulkhead full: {self.in_use} running, {self.waiting} queued")
+        self.waiting += 1
+        try:
+            async with asyncio.timeout_at(deadline):
+                await self._semaphore.acquire()
+        except TimeoutError:
+            self.rejected += 1
+            raise BulkheadFullError("bulkhead: no slot before the deadline")
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+
+    def release(self):
+        self.in_use -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "rejected": self.rejected
+        }
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures. While open,
+    calls fail fast; after `recovery_seconds` one probe is let through (half-open).
+    A successful probe closes the circuit, a failed one re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, recovery_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpenError(f"circuit {self.state}: failing fast")
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def record_success(self):
+        self._probing = False
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def release(self):
+        """The call ended without an outcome (cancelled): let another probe through."""
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+
+class ProviderGuard:
+    """Bulkhead + circuit breaker for one provider; rate limits are passed per call."""
+
+    def __init__(self, max_concurrent: int, max_queue: int, failure_threshold: int, recovery_seconds: float):
+        self.bulkhead = Bulkhead(max_concurrent, max_queue)
+        self.breaker = CircuitBreaker(failure_threshold, recovery_seconds)
+        self.timeouts = 0
+
+    @asynccontextmanager
+    async def call(
+        self, deadline: float, limits: Optional[List[Tuple[TokenBucket, float]]] = None
+    ) -> AsyncIterator[None]:
+        """
+        Admit one call: fail fast if the circuit is open, wait for rate-limit
+        tokens and a bulkhead slot (never past `deadline`), then run the body.
+        Exceptions from the body count as provider failures; local rejections
+        (ProviderUnavailableError) do not.
+        """
+        self.breaker.before_call()
+        try:
+            for bucket, amount in limits or []:
+                await bucket.acquire(amount, deadline)
+            await self.bulkhead.acquire(deadline)
+        except BaseException:
+            self.breaker.release()
+            raise
+        try:
+            yield
+        except Exception as e:
+            if isinstance(e, TimeoutError):
+                self.timeouts += 1
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            self.bulkhead.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "circuit": self.breaker.stats(),
+            "bulkhead": self.bulkhead.stats(),
+            "timeouts": self.timeouts
+        }
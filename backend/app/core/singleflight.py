@@ -0,0 +1,128 @@
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _SharedStream:
+    """Fan-out of one async iterator to any number of subscribers (late joiners replay from the start)."""
+
+    def __init__(self, source: AsyncIterator[Any], on_abandon: Optional[Callable[[], None]] = None):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._source = source
+        self._on_abandon = on_abandon
+        self.task = asyncio.get_running_loop().create_task(self._produce())
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _produce(self):
+        try:
+            async for item in self._source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            await self._source.aclose()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.task.done():
+                # Last listener left (e.g. client disconnect): stop the upstream work.
+                # Unregister first, so callers arriving before it has stopped start afresh.
+                if self._on_abandon:
+                    self._on_abandon()
+                self.task.cancel()
+                await asyncio.wait({self.task})
+
+
+class SingleFlight:
+    """
+    Coalesce identical in-flight work.
+
+    While a call for `key` is running, further callers with the same key attach to
+    it instead of starting their own: do() shares the result, stream() shares the
+    item stream. The work is cancelled only when every attached caller has gone.
+    Keys are forgotten as soon as the work finishes, so this is not a cache.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._streams: Dict[Hashable, _SharedStream] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.get_running_loop().create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Unregister before cancelling: the done callback only runs on a later loop
+                # iteration, and a caller joining in between would get the CancelledError
+                self._forget(self._calls, key, call)
+                call.task.cancel()
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = _SharedStream(fn(), on_abandon=lambda: self._forget(self._streams, key, shared))
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _: self._forget(self._streams, key, shared))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        subscription = shared.subscribe()
+        try:
+            async for item in subscription:
+                yield item
+        finally:
+            await subscription.aclose()
+
+    @staticmethod
+    def _forget(registry: Dict[Hashable, Any], key: Hashable, entry: Any):
+        if registry.get(key) is entry:
+            del registry[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "followers": self.followers
+        }
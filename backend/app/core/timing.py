@@ -0,0 +1,73 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+
+class SpanRecorder:
+    """
+    Stage durations and notes for one request.
+
+    Installed in a context variable, so any code running in the request's context
+    (including tasks it spawns, which copy the context) records into it without
+    the recorder being passed around. Repeated stages add up.
+    """
+
+    __slots__ = ("started", "spans", "notes")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.notes: Dict[str, Any] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def timings_ms(self) -> Dict[str, float]:
+        return {stage: round(seconds * 1000.0, 3) for stage, seconds in self.spans.items()}
+
+
+_current: ContextVar[Optional[SpanRecorder]] = ContextVar("span_recorder", default=None)
+
+
+def current() -> Optional[SpanRecorder]:
+    return _current.get()
+
+
+def start() -> SpanRecorder:
+    """Install a new recorder for the rest of the current task (see also recording())."""
+    recorder = SpanRecorder()
+    _current.set(recorder)
+    return recorder
+
+
+@contextmanager
+def recording(enabled: bool = True) -> Iterator[Optional[SpanRecorder]]:
+    """Record spans inside the block; yields None (and records nothing) when disabled."""
+    if not enabled:
+        yield None
+        return
+    recorder = SpanRecorder()
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+def record(stage: str, seconds: float):
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.add(stage, seconds)
+
+
+def note(key: str, value: Any):
+    """Attach a per-request value (e.g. candidate counts) to the current recorder, if any."""
+    recorder = _current.get()
+    if recorder is not None:
+        recorder.notes[key] = value
+
+
+def server_timing(timings_ms: Dict[str, float]) -> str:
+    """Server-Timing header value, e.g. "embed;dur=12.5, search;dur=3.1"."""
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings_ms.items())
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 
 class Citation(BaseModel):
@@ -6,6 +6,8 @@ class Citation(BaseModel):
     page: int
     text: str
     score: Optional[float] = None
+    # [start, end) character offsets into `text` of the sentences sent to the LLM (when compressed)
+    spans: Optional[List[List[int]]] = None
 
 class ModelConfig(BaseModel):
     id: str
@@ -15,6 +17,21 @@ class ModelConfig(BaseModel):
     base_url: Optional[str] = None
     deployment_name: Optional[str] = None # For Azure
     is_active: bool = False
+    context_token_budget: Optional[int] = None # Max prompt tokens for retrieved context
+    rpm_limit: Optional[int] = Field(None, gt=0) # Requests per minute (client-side token bucket)
+    tpm_limit: Optional[int] = Field(None, gt=0) # Prompt + completion tokens per minute
+    timeout_seconds: Optional[float] = Field(None, gt=0) # Overrides LLM_REQUEST_TIMEOUT
+
+class RoutingPolicy(BaseModel):
+    primary_model_id: Optional[str] = None # If null, use default active
+    secondary_model_id: Optional[str] = None # Hedge / fallback target; null disables hedging
+    hedge_enabled: bool = True
+    max_hedge_rate: float = Field(0.1, ge=0.0, le=1.0) # Max fraction of recent requests that may be hedged
+    hedge_quantile: float = Field(0.95, gt=0.0, lt=1.0) # Hedge once the primary is slower than this TTFT quantile
+    min_hedge_delay_ms: float = Field(200.0, ge=0.0)
+    default_hedge_delay_ms: float = Field(3000.0, ge=0.0) # Until enough latency samples are collected
+    max_error_rate: float = Field(0.5, ge=0.0, le=1.0) # Above this (recent window) a model is skipped
+    min_samples: int = Field(10, ge=1)
 
 class ChatRequest(BaseModel):
     message: str
@@ -23,6 +40,7 @@ class ChatRequest(BaseModel):
     history: Optional[List[Dict[str, Any]]] = []
     session_id: Optional[str] = None
     context_window: int = 5
+    compress: Optional[bool] = None # Query-focused context compression; null uses the server default
 
 class ChatResponse(BaseModel):
     response: str
@@ -31,6 +49,13 @@ class ChatResponse(BaseModel):
     history: Optional[List[Dict[str, Any]]] = None
     session_id: Optional[str] = None
 
+class ProfilerArmRequest(BaseModel):
+    requests: int = Field(0, ge=0) # Capture the next N requests (or keep at most N slow ones)
+    min_latency_ms: float = Field(0.0, ge=0.0) # Keep only requests at least this slow
+    interval_ms: float = Field(10.0, ge=1.0, le=1000.0) # Sampling interval
+    path_prefix: str = "/api/v1/chat" # Only requests under this path are profiled
+    expires_in_seconds: Optional[float] = Field(None, gt=0) # Defaults to PROFILER_MAX_ARMED_SECONDS
+
 class IngestRequest(BaseModel):
     bucket: Optional[str] = None
     prefix: Optional[str] = ""
@@ -0,0 +1,204 @@
+import itertools
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.cache import LRUCache, approx_size
+from app.core.config import settings
+
+
+@dataclass
+class CachedAnswer:
+    embedding: np.ndarray  # L2-normalized query embedding
+    model_id: str
+    context_window: int
+    compressed: bool
+    response: str
+    citations: List[Dict[str, Any]]
+    similarity: float = 1.0
+
+
+def _entry_size(entry: CachedAnswer) -> int:
+    return entry.embedding.nbytes + len(entry.response) + approx_size(entry.citations) + 128
+
+
+class SemanticAnswerCache:
+    """
+    Semantic cache for full chat answers.
+
+    Entries are keyed by (query embedding, model_id, context_window, compression mode).
+    A lookup hits when a stored query for the same model/context_window/mode has cosine similarity
+    above the configured threshold. All entries are dropped when the collection
+    generation changes (i.e. a new ingestion run), so answers never outlive the
+    corpus they were generated from.
+
+    The normalized embeddings live in one matrix, a row per entry, kept in step with
+    the LRU (rows are filled on store and freed on eviction/expiry), so a lookup is a
+    single matrix-vector product instead of re-stacking every entry per request.
+    """
+
+    INITIAL_ROWS = 64
+
+    def __init__(self):
+        self.enabled = settings.ANSWER_CACHE_ENABLED
+        self.threshold = settings.ANSWER_CACHE_SIMILARITY_THRESHOLD
+        self._entries = LRUCache(
+            max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+            max_bytes=settings.ANSWER_CACHE_MAX_BYTES,
+            ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+            sizeof=_entry_size,
+            on_remove=self._release
+        )
+        self._ids = itertools.count()
+        # Embedding matrix (grown by doubling) and its bookkeeping: row -> entry key and
+        # (model_id, context_window, compressed) group id (-1 = free row), entry key -> row
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: List[Optional[Hashable]] = []
+        self._row_groups = np.empty(0, dtype=np.int64)
+        self._rows: Dict[Hashable, int] = {}
+        self._free_rows: List[int] = []
+        # Group ids of the (model_id, context_window, compressed) keys that have live
+        # entries; a group is dropped with its last entry, so client-chosen context
+        # windows never grow this past the number of entries
+        self._groups: Dict[Tuple[str, int, bool], int] = {}
+        self._group_sizes: Dict[Tuple[str, int, bool], int] = {}
+        self._group_ids = itertools.count()
+        self._generation: Any = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or not vector.size or not norm:
+            return None
+        return vector / norm
+
+    def _check_generation(self, generation: Any):
+        if generation != self._generation:
+            if self._generation is not None and len(self._entries):
+                self.invalidate()
+            self._generation = generation
+
+    def invalidate(self):
+        """Drop every cached answer."""
+        self._entries.clear()
+        self.invalidations += 1
+
+    def _add_row(self, key: Hashable, vector: np.ndarray, group_key: Tuple[str, int, bool]):
+        if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+            # First entry, or the embedding model changed: vectors of another size never match
+            if self._matrix is not None and len(self._entries):
+                self.invalidate()
+            self._matrix = np.zeros((self.INITIAL_ROWS, vector.shape[0]), dtype=np.float32)
+            self._row_keys = []
+            self._row_groups = np.full(self.INITIAL_ROWS, -1, dtype=np.int64)
+            self._rows.clear()
+            self._free_rows.clear()
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._row_keys)
+            self._row_keys.append(None)
+            if row == self._matrix.shape[0]:
+                self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+                self._row_groups = np.concatenate([self._row_groups, np.full(row, -1, dtype=np.int64)])
+        if group_key not in self._groups:
+            self._groups[group_key] = next(self._group_ids)
+        self._group_sizes[group_key] = self._group_sizes.get(group_key, 0) + 1
+        self._matrix[row] = vector
+        self._row_keys[row] = key
+        self._row_groups[row] = self._groups[group_key]
+        self._rows[key] = row
+
+    def _release(self, key: Hashable, entry: CachedAnswer):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        self._row_keys[row] = None
+        self._row_groups[row] = -1
+        self._free_rows.append(row)
+        group_key = (entry.model_id, entry.context_window, entry.compressed)
+        self._group_sizes[group_key] -= 1
+        if not self._group_sizes[group_key]:
+            del self._group_sizes[group_key]
+            del self._groups[group_key]
+
+    def lookup(
+        self,
+        embedding: Sequence[float],
+        model_id: str,
+        context_window: int,
+        generation: Any = None,
+        compressed: bool = False
+    ) -> Optional[CachedAnswer]:
+        if not self.enabled:
+            return None
+        self._check_generation(generation)
+        query = self._normalize(embedding)
+        if query is None:
+            return None
+
+        group = self._groups.get((model_id, context_window, compressed))
+        if group is not None and self._matrix is not None and self._matrix.shape[1] == query.shape[0]:
+            used = len(self._row_keys)
+            similarities = np.where(self._row_groups[:used] == group, self._matrix[:used] @ query, -np.inf)
+            while used:
+                best = int(np.argmax(similarities))
+                if similarities[best] < self.threshold:
+                    break
+                # get() refreshes the LRU position; an expired entry is dropped and its row freed
+                entry = self._entries.get(self._row_keys[best])
+                if entry is not None:
+                    self.hits += 1
+                    entry.similarity = float(similarities[best])
+                    return entry
+                similarities[best] = -np.inf
+
+        self.misses += 1
+        return None
+
+    def store(
+        self,
+        embedding: Sequence[float],
+        model_id: str,
+        context_window: int,
+        response: str,
+        citations: List[Dict[str, Any]],
+        generation: Any = None,
+        compressed: bool = False
+    ):
+        if not self.enabled:
+            return
+        self._check_generation(generation)
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        key = next(self._ids)
+        self._add_row(key, vector, (model_id, context_window, compressed))
+        self._entries.set(key, CachedAnswer(
+            embedding=vector,
+            model_id=model_id,
+            context_window=context_window,
+            compressed=compressed,
+            response=response,
+            citations=citations
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        stats = self._entries.stats()
+        stats.update({
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        })
+        return stats
+
+
+answer_cache = SemanticAnswerCache()
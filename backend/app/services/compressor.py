@@ -0,0 +1,83 @@
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List, Sequence, Tuple
+
+import numpy as np
+
+from app.models.schemas import Citation
+
+# A sentence runs up to terminal punctuation (plus closing quotes/brackets) or a blank line
+_SENTENCE = re.compile(r"[^\s].*?(?:[.!?]+[\"')\]]*(?=\s|$)|\n\s*\n|$)", re.S)
+# Very short fragments (page numbers, headings) are kept only if they score high anyway
+MIN_SENTENCE_CHARS = 3
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """Sentence spans as (start, end) character offsets into `text`."""
+    spans = []
+    for match in _SENTENCE.finditer(text):
+        start, end = match.start(), match.end()
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end - start >= MIN_SENTENCE_CHARS:
+            spans.append((start, end))
+    return spans
+
+
+@dataclass
+class CompressedContext:
+    citations: List[Citation] = field(default_factory=list)
+    # Prompt text per citation: the kept sentences, in document order
+    texts: List[str] = field(default_factory=list)
+    sentences_total: int = 0
+    sentences_kept: int = 0
+
+
+async def compress_citations(
+    query_embedding: Sequence[float],
+    citations: List[Citation],
+    embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+    ratio: float = 0.5,
+    min_sentences: int = 1
+) -> CompressedContext:
+    """
+    Query-focused extractive compression.
+
+    Every chunk is split into sentences, all sentences are embedded in one batched
+    call and scored by cosine similarity to the query. Each chunk keeps its top
+    `ratio` of sentences (at least `min_sentences`), in original order. The returned
+    citations keep their full source text and record the kept sentences as
+    character offsets in Citation.spans.
+    """
+    result = CompressedContext()
+    spans = [split_sentences(c.text) for c in citations]
+    sentences = [c.text[start:end] for c, chunk in zip(citations, spans) for start, end in chunk]
+    result.sentences_total = len(sentences)
+    if not sentences:
+        result.citations = list(citations)
+        result.texts = [c.text for c in citations]
+        return result
+
+    vectors = np.asarray(await embed_batch(sentences), dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+    norms[norms == 0] = 1.0
+    scores = (vectors @ query) / norms
+
+    offset = 0
+    for citation, chunk in zip(citations, spans):
+        chunk_scores = scores[offset:offset + len(chunk)]
+        offset += len(chunk)
+        if not chunk:
+            result.citations.append(citation)
+            result.texts.append(citation.text)
+            continue
+
+        keep = min(len(chunk), max(min_sentences, math.ceil(ratio * len(chunk))))
+        kept = sorted(np.argsort(-chunk_scores, kind="stable")[:keep].tolist())
+        kept_spans = [list(chunk[i]) for i in kept]
+        result.sentences_kept += len(kept_spans)
+        result.citations.append(citation.model_copy(update={"spans": kept_spans}))
+        result.texts.append(" ".join(citation.text[start:end] for start, end in kept_spans))
+    return result
@@ -0,0 +1,142 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+from app.models.schemas import Citation
+
+# Ingestion uses chunk_overlap=40 tokens (~160-250 chars); look a bit further to be safe
+MAX_OVERLAP_CHARS = 1024
+MIN_OVERLAP_CHARS = 32
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """tiktoken encoding, or None when it cannot be loaded (e.g. offline pod without a BPE cache)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(settings.TOKENIZER_ENCODING)
+    except Exception as e:
+        print(f"WARNING: tiktoken encoding unavailable, using a chars/4 estimate: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to at most `max_tokens` tokens."""
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def trim_history(history: List[Dict[str, Any]], token_budget: int) -> List[Dict[str, Any]]:
+    """The most recent messages of `history` that fit in `token_budget`, oldest first."""
+    kept: List[Dict[str, Any]] = []
+    used = 0
+    for message in reversed(history):
+        tokens = count_tokens(message.get("content") or "")
+        if used + tokens > token_budget:
+            break
+        used += tokens
+        kept.append(message)
+    kept.reverse()
+    return kept
+
+
+def _overlap(previous: str, text: str) -> int:
+    """Length of the longest suffix of `previous` that is a prefix of `text`."""
+    tail = previous[-MAX_OVERLAP_CHARS:]
+    probe = text[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = tail.find(probe)
+    while start != -1:
+        length = len(tail) - start
+        if text.startswith(tail[start:]):
+            return length
+        start = tail.find(probe, start + 1)
+    return 0
+
+
+@dataclass
+class PackedContext:
+    citations: List[Citation] = field(default_factory=list)
+    # Prompt text per kept citation (overlapping spans removed); Citation.text stays the source span
+    texts: List[str] = field(default_factory=list)
+    context_tokens: int = 0
+    token_budget: int = 0
+    dropped: int = 0
+    overlap_chars_removed: int = 0
+
+    def metadata(self) -> Dict[str, int]:
+        return {
+            "context_tokens": self.context_tokens,
+            "context_token_budget": self.token_budget,
+            "citations_dropped": self.dropped,
+            "overlap_chars_removed": self.overlap_chars_removed
+        }
+
+
+def pack_context(
+    citations: List[Citation],
+    token_budget: Optional[int] = None,
+    texts: Optional[List[str]] = None
+) -> PackedContext:
+    """
+    Pack citations into the prompt context, best score first, within a token budget.
+
+    Chunks from the same file that overlap (chunk_overlap at ingestion) have the
+    repeated span removed from the later chunk. Citations that do not fit the
+    remaining budget are dropped; smaller, lower-scored ones may still fit.
+    `texts` overrides the prompt text per citation (e.g. compressed chunks).
+    """
+    budget = token_budget or settings.DEFAULT_CONTEXT_TOKEN_BUDGET
+    packed = PackedContext(token_budget=budget)
+    texts = texts if texts is not None else [c.text for c in citations]
+    ranked = sorted(
+        zip(citations, texts),
+        key=lambda pair: pair[0].score if pair[0].score is not None else float("-inf"),
+        reverse=True
+    )
+
+    kept_by_source: Dict[str, List[str]] = {}
+    for citation, original in ranked:
+        text = original
+        for previous in kept_by_source.get(citation.source, []):
+            # Either chunk may come first in the document
+            if previous in text:
+                text = text.replace(previous, "", 1)
+                continue
+            trim = _overlap(previous, text)
+            if trim:
+                text = text[trim:]
+                continue
+            trim = _overlap(text, previous)
+            if trim:
+                text = text[:-trim]
+        text = text.strip()
+        if not text:
+            packed.dropped += 1
+            continue
+
+        tokens = count_tokens(text)
+        if packed.context_tokens + tokens > budget:
+            packed.dropped += 1
+            continue
+
+        packed.overlap_chars_removed += len(original.strip()) - len(text)
+        packed.context_tokens += tokens
+        packed.citations.append(citation)
+        packed.texts.append(text)
+        kept_by_source.setdefault(citation.source, []).append(original)
+    return packed
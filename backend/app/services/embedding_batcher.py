@@ -0,0 +1,110 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Upper bounds (inclusive) of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+class EmbeddingBatcher:
+    """
+    Dynamic micro-batching for query embeddings.
+
+    Concurrent embed() calls are collected for up to `window_ms` (or until
+    `max_batch_size` texts are queued) and sent to the embedding service as one
+    batched request. The vectors are then fanned back out to the waiting callers.
+    Identical texts within a batch are embedded once.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+        window_ms: float = 5.0,
+        max_batch_size: int = 32
+    ):
+        self._embed_batch = embed_batch
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        # (text, future, enqueued_at)
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+        # Metrics
+        self.requests = 0
+        self.batches = 0
+        self.batched_texts = 0
+        self.errors = 0
+        self._batch_size_counts = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self._batch_size_counts["+Inf"] = 0
+        self._queue_waits = deque(maxlen=1024)
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future, time.monotonic()))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        # Keep a reference so the task is not garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        now = time.monotonic()
+        for _, _, enqueued_at in batch:
+            self._queue_waits.append(now - enqueued_at)
+
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self._record_batch(len(texts))
+        try:
+            vectors = await self._embed_batch(texts)
+            by_text = dict(zip(texts, vectors))
+            for text, future, _ in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            self.errors += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def _record_batch(self, size: int):
+        self.batches += 1
+        self.batched_texts += size
+        for bucket in BATCH_SIZE_BUCKETS:
+            if size <= bucket:
+                self._batch_size_counts[bucket] += 1
+                return
+        self._batch_size_counts["+Inf"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._queue_waits)
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "mean_batch_size": round(self.batched_texts / self.batches, 2) if self.batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in self._batch_size_counts.items()},
+            "queue_wait_ms": {
+                "p50": round(waits[len(waits) // 2] * 1000.0, 3) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95) - 1] * 1000.0, 3) if waits else 0.0,
+                "max": round(waits[-1] * 1000.0, 3) if waits else 0.0
+            }
+        }
@@ -1,14 +1,183 @@
-from typing import List, Optional, Dict, Any
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple
+from collections import OrderedDict
 import os
-from llama_index.llms.openai import OpenAI
+import time
+import json
+import asyncio
+import hashlib
+import httpx
+from contextlib import asynccontextmanager
 # from llama_index.llms.anthropic import Anthropic
 from app.models.schemas import ModelConfig
 from app.api.endpoints.admin import MODEL_CONFIGS
+from app.core import metrics
+from app.core.config import settings
+from app.core.singleflight import SingleFlight
+from app.core.resilience import ProviderGuard, TokenBucket
+from app.services.context_packer import count_tokens, trim_history
+from app.services.model_router import ModelRouter
+
+LLM_ERROR_PREFIX = "Error communicating with LLM:"
 
 class LLMService:
     def __init__(self):
-        # We can cache clients if needed
-        pass
+        # Long-lived LLM clients keyed by the ModelConfig fields that affect the client.
+        # Reusing them keeps HTTP connections (and TLS sessions) alive between chats.
+        self._clients: "OrderedDict[Tuple, Any]" = OrderedDict()
+        # HTTP client pair per pooled client (OpenAI-compatible providers). Evicted clients'
+        # pairs are closed once no request holds a lease on the client (id(llm) -> count).
+        self._http: Dict[Tuple, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+        self._leases: Dict[int, int] = {}
+        self._retired: Dict[int, Tuple[httpx.Client, httpx.AsyncClient]] = {}
+        self._closing: set = set()
+        # Coalesces identical in-flight LLM calls (also covers generate_response)
+        self.flight = SingleFlight()
+        # Latency/error tracking, hedging and fallback between primary and secondary models
+        self.router = ModelRouter()
+        # Bulkhead + circuit breaker per provider, rpm/tpm token buckets per model
+        self._guards: Dict[str, ProviderGuard] = {}
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def _client_key(self, config: ModelConfig) -> Tuple:
+        return (config.provider, config.id, config.api_key, config.base_url, config.deployment_name)
+
+    def _http_clients(self, config: ModelConfig) -> Tuple[httpx.Client, httpx.AsyncClient]:
+        """Create keep-alive HTTP clients with bounded connection pools, owned by the pool entry."""
+        limits = httpx.Limits(
+            max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY
+        )
+        timeout = httpx.Timeout(settings.LLM_HTTP_TIMEOUT, connect=10.0)
+        clients = (
+            httpx.Client(limits=limits, timeout=timeout),
+            httpx.AsyncClient(limits=limits, timeout=timeout)
+        )
+        self._http[self._client_key(config)] = clients
+        return clients
+
+    def _close_http(self, clients: Tuple[httpx.Client, httpx.AsyncClient]):
+        """Close an HTTP client pair; the async client is closed in a background task."""
+        http_client, async_http_client = clients
+        http_client.close()
+        try:
+            task = asyncio.get_running_loop().create_task(async_http_client.aclose())
+        except RuntimeError:
+            asyncio.run(async_http_client.aclose())
+            return
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _evict(self, key: Tuple):
+        """Drop a pooled client; its HTTP clients close now or when its last lease ends."""
+        llm = self._clients.pop(key)
+        clients = self._http.pop(key, None)
+        if clients is None:
+            return
+        if self._leases.get(id(llm)):
+            self._retired[id(llm)] = clients
+        else:
+            self._close_http(clients)
+
+    @asynccontextmanager
+    async def _lease(self, config: ModelConfig):
+        """The pooled client for `config`, kept open until the block exits even if evicted."""
+        llm = await self._get_llm(config)
+        ref = id(llm)
+        self._leases[ref] = self._leases.get(ref, 0) + 1
+        try:
+            yield llm
+        finally:
+            self._leases[ref] -= 1
+            if not self._leases[ref]:
+                del self._leases[ref]
+                clients = self._retired.pop(ref, None)
+                if clients is not None:
+                    self._close_http(clients)
+
+    def invalidate(self, model_id: str) -> int:
+        """
+        Drop pooled clients for a model (called when its config changes).
+        Returns the number of evicted clients. In-flight requests keep their client until
+        they finish; its connections are closed after that.
+        """
+        stale = [key for key in self._clients if key[1] == model_id]
+        for key in stale:
+            self._evict(key)
+        return len(stale)
+
+    def _guard(self, config: ModelConfig) -> ProviderGuard:
+        guard = self._guards.get(config.provider)
+        if guard is None:
+            guard = self._guards[config.provider] = ProviderGuard(
+                settings.LLM_PROVIDER_MAX_CONCURRENCY,
+                settings.LLM_PROVIDER_MAX_QUEUE,
+                settings.LLM_BREAKER_FAILURE_THRESHOLD,
+                settings.LLM_BREAKER_RECOVERY_SECONDS
+            )
+        return guard
+
+    def _bucket(self, config: ModelConfig, kind: str) -> Optional[TokenBucket]:
+        per_minute = config.rpm_limit if kind == "rpm" else config.tpm_limit
+        if not per_minute:
+            return None
+        bucket = self._buckets.get((config.id, kind))
+        if bucket is None or bucket.capacity != per_minute:
+            bucket = self._buckets[(config.id, kind)] = TokenBucket(per_minute)
+        return bucket
+
+    def _rate_limits(self, config: ModelConfig, messages: List[Dict[str, str]]) -> List[Tuple[TokenBucket, float]]:
+        limits = []
+        rpm, tpm = self._bucket(config, "rpm"), self._bucket(config, "tpm")
+        if rpm:
+            limits.append((rpm, 1))
+        if tpm:
+            limits.append((tpm, sum(count_tokens(m.get("content") or "") for m in messages)))
+        return limits
+
+    def _record_usage(
+        self,
+        config: ModelConfig,
+        messages: List[Dict[str, str]],
+        text: str,
+        reported: Tuple[Optional[int], Optional[int]] = (None, None)
+    ):
+        """
+        Debit the completion from the tpm bucket and count prompt/completion tokens.
+        Server-reported usage is used when available; otherwise the text is tokenized.
+        """
+        prompt_tokens, completion_tokens = reported
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(m.get("content") or "") for m in messages)
+        if completion_tokens is None:
+            completion_tokens = count_tokens(text)
+        tpm = self._bucket(config, "tpm")
+        if tpm:
+            tpm.debit(completion_tokens)
+        metrics.record_tokens(config.id, config.provider, prompt_tokens, completion_tokens)
+
+    @staticmethod
+    def _reported_usage(response) -> Tuple[Optional[int], Optional[int]]:
+        """(prompt, completion) tokens from an OpenAI-style `usage` in the raw response, if any."""
+        raw = getattr(response, "raw", None)
+        usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+        if isinstance(usage, dict):
+            counts = (usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        else:
+            counts = (getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None))
+        # Some servers report zeros; those are counted locally instead
+        return tuple(c if isinstance(c, int) and c > 0 else None for c in counts)
+
+    def _timeout(self, config: ModelConfig) -> float:
+        return config.timeout_seconds or settings.LLM_REQUEST_TIMEOUT
+
+    def provider_stats(self) -> Dict[str, Any]:
+        return {
+            "providers": {name: guard.stats() for name, guard in self._guards.items()},
+            "rate_limits": {
+                f"{model_id}:{kind}": bucket.stats() for (model_id, kind), bucket in self._buckets.items()
+            }
+        }
 
     def _get_config(self, model_id: Optional[str]) -> ModelConfig:
         if not model_id:
@@ -23,15 +192,69 @@ class LLMService:
              raise ValueError(f"Model ID {model_id} not found")
         return config
 
+    def _route(self, model_id: Optional[str]) -> Tuple[ModelConfig, Optional[ModelConfig]]:
+        """(model to call, secondary for hedging/fallback). Explicit model ids are not routed."""
+        if model_id:
+            return self._get_config(model_id), None
+        return self.router.route(MODEL_CONFIGS, self._get_config(None))
+
+    def resolve_config(self, model_id: Optional[str] = None) -> ModelConfig:
+        """Resolve the model that will serve a request (the routed primary by default)."""
+        return self._route(model_id)[0]
+
+    def resolve_model_id(self, model_id: Optional[str] = None) -> str:
+        return self.resolve_config(model_id).id
+
+    async def warm_up(self) -> str:
+        """
+        Build the active model's client and send it a one-token chat, outside routing and
+        the provider guards, so the first request finds an open connection (and a loaded
+        model). Returns the model id.
+        """
+        config = self.resolve_config()
+        messages = self._to_chat_messages([{"role": "user", "content": "ping"}])
+        async with self._lease(config) as llm:
+            await asyncio.wait_for(llm.achat(messages, max_tokens=1), self._timeout(config))
+        return config.id
+
     async def _get_llm(self, config: ModelConfig):
+        key = self._client_key(config)
+        llm = self._clients.get(key)
+        if llm is not None:
+            self._clients.move_to_end(key)
+            return llm
+
+        try:
+            llm = self._build_llm(config)
+        except Exception:
+            clients = self._http.pop(key, None)
+            if clients is not None:
+                self._close_http(clients)
+            raise
+        self._clients[key] = llm
+        while len(self._clients) > settings.LLM_CLIENT_POOL_SIZE:
+            self._evict(next(iter(self._clients)))
+        return llm
+
+    def _build_llm(self, config: ModelConfig):
+        # Provider SDKs are imported on first use (the warm-up), not when the app is imported
         if config.provider == "openai":
+            from llama_index.llms.openai import OpenAI
             api_key = config.api_key or os.getenv("OPENAI_API_KEY")
             api_base = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
             if not api_key:
                 raise ValueError("Error: OpenAI API Key not configured.")
-            return OpenAI(model=config.id, api_key=api_key, api_base=api_base)
+            http_client, async_http_client = self._http_clients(config)
+            return OpenAI(
+                model=config.id,
+                api_key=api_key,
+                api_base=api_base,
+                http_client=http_client,
+                async_http_client=async_http_client
+            )
 
         elif config.provider == "kubeflow":
+            from llama_index.llms.openai_like import OpenAILike
             # KServe/LocalAI endpoint. We assume standard OpenAI-compatible protocol.
             # We use OpenAILike to bypass strict model name validation in LlamaIndex.
             api_base = config.base_url or os.getenv("LLM_SERVICE_URL")
@@ -43,13 +266,15 @@ class LLMService:
             
             api_key = config.api_key or "dummy" # Internal services usually don't need real keys
             
-            from llama_index.llms.openai_like import OpenAILike
+            http_client, async_http_client = self._http_clients(config)
             return OpenAILike(
                 model=config.id, 
                 api_key=api_key, 
                 api_base=api_base,
                 is_chat_model=True,
-                max_tokens=2048
+                max_tokens=2048,
+                http_client=http_client,
+                async_http_client=async_http_client
             )
 
         elif config.provider == "google":
@@ -71,37 +296,253 @@ class LLMService:
         else:
             raise ValueError(f"Provider {config.provider} not supported.")
 
+    def _to_chat_messages(self, messages: List[Dict[str, str]]):
+        """
+        Convert role/content dicts to LlamaIndex ChatMessage objects.
+        """
+        from llama_index.core.llms import ChatMessage, MessageRole
+
+        llama_messages = []
+        for msg in messages:
+            role_str = msg.get("role", "user")
+            content = msg.get("content", "")
+
+            role = MessageRole.USER
+            if role_str == "system":
+                role = MessageRole.SYSTEM
+            elif role_str == "assistant":
+                role = MessageRole.ASSISTANT
+            elif role_str == "tool":
+                role = MessageRole.TOOL
+
+            llama_messages.append(ChatMessage(role=role, content=content))
+        return llama_messages
+
+    def _flight_key(self, config: ModelConfig, messages: List[Dict[str, str]]) -> str:
+        payload = json.dumps([config.id, [(m.get("role"), m.get("content")) for m in messages]])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
     async def chat(self, messages: List[Dict[str, str]], model_id: Optional[str] = None) -> str:
         """
         Send a list of messages (dicts) to the LLM and get a response string.
+        Identical concurrent requests share one LLM call.
         """
-        from llama_index.core.llms import ChatMessage, MessageRole
-        
-        config = self._get_config(model_id)
+        primary, secondary = self._route(model_id)
+        return await self.flight.do(
+            self._flight_key(primary, messages), lambda: self._routed_chat(primary, secondary, messages)
+        )
+
+    async def _routed_chat(
+        self, primary: ModelConfig, secondary: Optional[ModelConfig], messages: List[Dict[str, str]]
+    ) -> str:
+        """
+        Call `primary`. If it has not answered within its hedge deadline (a latency
+        quantile, see ModelRouter) and the hedge budget allows, also call `secondary`
+        and take whichever answers first; the loser is cancelled. If the primary
+        fails, fall back on the secondary.
+        """
+        self.router.record_request()
+        primary_task = asyncio.create_task(self._timed_chat(primary, messages))
+        pending = {primary_task}
+        backup = None
         try:
-            llm = await self._get_llm(config)
-            
-            # Convert dicts to ChatMessage
-            llama_messages = []
-            for msg in messages:
-                role_str = msg.get("role", "user")
-                content = msg.get("content", "")
-                
-                role = MessageRole.USER
-                if role_str == "system":
-                    role = MessageRole.SYSTEM
-                elif role_str == "assistant":
-                    role = MessageRole.ASSISTANT
-                elif role_str == "tool":
-                    role = MessageRole.TOOL
-                    
-                llama_messages.append(ChatMessage(role=role, content=content))
-            
-            response = await llm.achat(llama_messages)
-            return str(response)
-            
+            if secondary is not None:
+                delay = self.router.hedge_delay(primary.id, "latency")
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                failed = bool(done) and primary_task.result().startswith(LLM_ERROR_PREFIX)
+                if failed or (not done and self.router.try_hedge()):
+                    if failed:
+                        self.router.fallbacks += 1
+                        pending.clear()
+                    backup = asyncio.create_task(self._timed_chat(secondary, messages))
+                    pending.add(backup)
+
+            result = primary_task.result() if not pending else ""
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if not result.startswith(LLM_ERROR_PREFIX):
+                        if task is backup:
+                            self.router.secondary_wins += 1
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _timed_chat(self, config: ModelConfig, messages: List[Dict[str, str]]) -> str:
+        started = time.monotonic()
+        try:
+            result = await self._chat(config, messages)
+        except asyncio.CancelledError:
+            self.router.record_cancelled(config.id, "latency", time.monotonic() - started)
+            raise
+        # Per attempt, so hedged and fallback calls are attributed to the model that ran them
+        metrics.observe_stage("llm_total", time.monotonic() - started, config.id, config.provider)
+        ok = not result.startswith(LLM_ERROR_PREFIX)
+        if ok:
+            self.router.record_latency(config.id, "latency", time.monotonic() - started)
+        self.router.record_outcome(config.id, ok)
+        return result
+
+    async def _chat(self, config: ModelConfig, messages: List[Dict[str, str]]) -> str:
+        try:
+            async with self._lease(config) as llm:
+                # One deadline covers rate-limit and bulkhead waits and the call itself
+                deadline = asyncio.get_running_loop().time() + self._timeout(config)
+                async with self._guard(config).call(deadline, self._rate_limits(config, messages)):
+                    async with asyncio.timeout_at(deadline):
+                        response = await llm.achat(self._to_chat_messages(messages))
+            text = str(response)
+            self._record_usage(config, messages, text, self._reported_usage(response))
+            return text
+
+        except TimeoutError:
+            return f"{LLM_ERROR_PREFIX} {config.provider} timed out after {self._timeout(config):g}s"
         except Exception as e:
-            return f"Error communicating with LLM: {str(e)}"
+            return f"{LLM_ERROR_PREFIX} {str(e)}"
+
+    async def stream_chat(
+        self, messages: List[Dict[str, str]], model_id: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream the LLM response token by token (text deltas).
+
+        Unlike chat(), errors are raised to the caller so the endpoint can emit
+        an error frame. Identical concurrent requests share one upstream stream.
+        Closing this generator (e.g. on client disconnect) closes the upstream HTTP
+        stream once no other caller is attached, which stops generation on the
+        model server.
+        """
+        primary, secondary = self._route(model_id)
+        stream = self.flight.stream(
+            self._flight_key(primary, messages), lambda: self._routed_stream(primary, secondary, messages)
+        )
+        try:
+            async for delta in stream:
+                yield delta
+        finally:
+            await stream.aclose()
+
+    async def _routed_stream(
+        self, primary: ModelConfig, secondary: Optional[ModelConfig], messages: List[Dict[str, str]]
+    ) -> AsyncIterator[str]:
+        """
+        Stream from `primary`, hedging to `secondary` when the first token misses the
+        primary's TTFT deadline (and the hedge budget allows), or falling back on it
+        when the primary fails before its first token. The first stream to produce a
+        token wins; the other is closed, which stops it on the model server.
+        """
+        self.router.record_request()
+        attempts: Dict[asyncio.Task, Tuple[ModelConfig, AsyncIterator[str], float]] = {}
+
+        def start(config: ModelConfig):
+            stream = self._stream_chat(config, messages)
+            attempts[asyncio.create_task(self._first_delta(stream))] = (config, stream, time.monotonic())
+
+        start(primary)
+        backup_started = False
+        delay = self.router.hedge_delay(primary.id, "ttft") if secondary is not None else None
+        winner, error = None, None
+        try:
+            # 1. Race for the first token
+            while winner is None and attempts:
+                done, _ = await asyncio.wait(set(attempts), timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # The primary missed its TTFT deadline
+                    delay = None
+                    if self.router.try_hedge():
+                        start(secondary)
+                        backup_started = True
+                    continue
+                for task in done:
+                    config, stream, started = attempts.pop(task)
+                    if task.exception() is not None or winner is not None:
+                        if task.exception() is not None:
+                            error = task.exception()
+                            self.router.record_outcome(config.id, False)
+                        await stream.aclose()
+                        continue
+                    ttft = time.monotonic() - started
+                    self.router.record_latency(config.id, "ttft", ttft)
+                    metrics.observe_stage("llm_ttft", ttft, config.id, config.provider)
+                    winner = (config, stream, task.result())
+                if winner is None and secondary is not None and not backup_started:
+                    # The primary failed before its first token
+                    self.router.fallbacks += 1
+                    delay = None
+                    start(secondary)
+                    backup_started = True
+            if winner is None:
+                raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+            if attempts:
+                await asyncio.wait(set(attempts))
+            for task, (config, stream, started) in attempts.items():
+                if task.cancelled():
+                    self.router.record_cancelled(config.id, "ttft", time.monotonic() - started)
+                elif task.exception() is not None:
+                    self.router.record_outcome(config.id, False)
+                await stream.aclose()
+
+        # 2. Relay the winning stream
+        config, stream, first = winner
+        if config is not primary:
+            self.router.secondary_wins += 1
+        try:
+            if first is not None:
+                yield first
+            async for delta in stream:
+                yield delta
+        except Exception:
+            self.router.record_outcome(config.id, False)
+            raise
+        else:
+            self.router.record_outcome(config.id, True)
+        finally:
+            await stream.aclose()
+
+    @staticmethod
+    async def _first_delta(stream: AsyncIterator[str]) -> Optional[str]:
+        """First item of `stream`, or None if it is empty."""
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def _stream_chat(self, config: ModelConfig, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        async with self._lease(config) as llm:
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            # The deadline bounds the time to the first token; later tokens get an idle timeout
+            deadline = loop.time() + self._timeout(config)
+            stream = None
+            parts = []
+            async with self._guard(config).call(deadline, self._rate_limits(config, messages)):
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        stream = await llm.astream_chat(self._to_chat_messages(messages))
+                    while True:
+                        token_deadline = deadline if not parts else loop.time() + settings.LLM_STREAM_IDLE_TIMEOUT
+                        async with asyncio.timeout_at(token_deadline):
+                            try:
+                                chunk = await stream.__anext__()
+                            except StopAsyncIteration:
+                                break
+                        if chunk.delta:
+                            parts.append(chunk.delta)
+                            yield chunk.delta
+                except TimeoutError:
+                    raise TimeoutError(f"{config.provider} stream timed out") from None
+                finally:
+                    # Propagate cancellation upstream instead of waiting for GC.
+                    if stream is not None:
+                        await stream.aclose()
+            metrics.observe_stage("llm_total", loop.time() - started, config.id, config.provider)
+            self._record_usage(config, messages, "".join(parts))
 
     async def generate_response(
         self, 
@@ -126,8 +567,8 @@ class LLMService:
         messages = [
             {"role": "system", "content": system_prompt},
         ]
-        # Append history (limited to last 5 pairs to save tokens)
-        for msg in history[-5:]:
+        # Append the most recent history that fits the token budget (turns can be long)
+        for msg in trim_history(history, settings.HISTORY_TOKEN_BUDGET):
              role = "user" if msg["role"] == "user" else "assistant"
              messages.append({"role": role, "content": msg["content"]})
         
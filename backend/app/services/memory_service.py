@@ -0,0 +1,163 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.services.context_packer import count_tokens, trim_history, truncate_tokens
+from app.services.history_service import history_service
+from app.services.llm_service import llm_service, LLM_ERROR_PREFIX
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Update the summary with the new turns below. Keep facts, names, numbers, decisions and "
+    "open questions the assistant may need later; drop pleasantries. "
+    "Reply with the updated summary only, in at most {max_words} words."
+)
+
+
+@dataclass
+class SessionSummary:
+    text: str = ""
+    covered: int = 0  # number of leading session messages folded into `text`
+
+
+@dataclass
+class ConversationContext:
+    summary: str = ""
+    # Most recent turns sent verbatim, as {"role", "content"} messages
+    turns: List[Dict[str, str]] = field(default_factory=list)
+    summarized_messages: int = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.summary or self.turns)
+
+    def metadata(self) -> Dict[str, int]:
+        return {
+            "summarized_messages": self.summarized_messages,
+            "recent_messages": len(self.turns),
+            "history_tokens": count_tokens(self.summary) + sum(count_tokens(t["content"]) for t in self.turns)
+        }
+
+
+class ConversationMemory:
+    """
+    Bounded server-side conversation memory.
+
+    Each prompt gets the session's rolling summary plus the most recent turns that
+    fit HISTORY_TOKEN_BUDGET, so prompt size stays flat however long a session runs.
+    Turns that fall out of the budget are folded into the summary by a background
+    task, incrementally: every LLM call sees the previous summary plus at most
+    MEMORY_COMPACTION_CHUNK_TOKENS of new turns, never the whole transcript.
+    Summaries are cached per session (LRU-bounded, in memory like history_service).
+    """
+
+    def __init__(self):
+        self.summaries = LRUCache(max_entries=settings.MEMORY_MAX_SESSIONS)
+        self._compactions: Dict[str, asyncio.Task] = {}
+        self.compactions = 0
+        self.failures = 0
+
+    def context(self, session_id: Optional[str]) -> ConversationContext:
+        """Summary + recent turns for the next prompt of `session_id`."""
+        if not session_id:
+            return ConversationContext()
+        messages = history_service.get_messages(session_id)
+        summary = self.summaries.get(session_id) or SessionSummary()
+        recent = trim_history(messages[summary.covered:], settings.HISTORY_TOKEN_BUDGET)
+        if len(messages) - len(recent) > summary.covered:
+            # Turns between the summary and the recent window are left out until compacted
+            self._schedule(session_id)
+        return ConversationContext(
+            summary=summary.text,
+            turns=[{"role": _role(m), "content": m["content"]} for m in recent],
+            summarized_messages=summary.covered
+        )
+
+    def record(self, session_id: Optional[str], message: str, response: str, citations: List[Dict[str, Any]]):
+        """Append a finished turn to the session and compact in the background if needed."""
+        if not session_id or response.startswith(LLM_ERROR_PREFIX):
+            return
+        history_service.add_message(session_id, "user", message)
+        history_service.add_message(session_id, "assistant", response, citations)
+        if self._overflow(session_id):
+            self._schedule(session_id)
+
+    def _overflow(self, session_id: str) -> int:
+        """End index of the messages that no longer fit the recent-turns budget."""
+        messages = history_service.get_messages(session_id)
+        summary = self.summaries.get(session_id) or SessionSummary()
+        return len(messages) - len(trim_history(messages[summary.covered:], settings.HISTORY_TOKEN_BUDGET))
+
+    def _schedule(self, session_id: str):
+        task = self._compactions.get(session_id)
+        if task is not None and not task.done():
+            # The running compaction re-checks the session before it finishes
+            return
+        self._compactions[session_id] = asyncio.get_running_loop().create_task(self._compact(session_id))
+
+    async def wait(self, session_id: str):
+        """Wait for a pending compaction of `session_id` (tests, shutdown)."""
+        task = self._compactions.get(session_id)
+        if task is not None:
+            await asyncio.wait({task})
+
+    async def _compact(self, session_id: str):
+        try:
+            while True:
+                summary = self.summaries.get(session_id) or SessionSummary()
+                target = self._overflow(session_id)
+                if target <= summary.covered:
+                    return
+                # 1. Take the next bounded chunk of turns after the summary (at least one)
+                pending = history_service.get_messages(session_id)[summary.covered:target]
+                chunk, used = [], 0
+                for message in pending:
+                    tokens = count_tokens(message["content"])
+                    if chunk and used + tokens > settings.MEMORY_COMPACTION_CHUNK_TOKENS:
+                        break
+                    chunk.append(message)
+                    used += tokens
+
+                # 2. Fold it into the previous summary
+                text = await self._summarize(summary.text, chunk)
+                if text is None:
+                    self.failures += 1
+                    return
+                self.summaries.set(session_id, SessionSummary(text, summary.covered + len(chunk)))
+                self.compactions += 1
+        except Exception as e:
+            self.failures += 1
+            print(f"WARNING: Conversation compaction failed for session {session_id}: {e}")
+        finally:
+            if self._compactions.get(session_id) is asyncio.current_task():
+                del self._compactions[session_id]
+
+    async def _summarize(self, previous: str, turns: List[Dict[str, Any]]) -> Optional[str]:
+        max_tokens = settings.MEMORY_SUMMARY_MAX_TOKENS
+        transcript = "\n".join(
+            f"{_role(m)}: {truncate_tokens(m['content'], settings.MEMORY_COMPACTION_CHUNK_TOKENS)}" for m in turns
+        )
+        messages = [
+            {"role": "system", "content": SUMMARY_PROMPT.format(max_words=max_tokens * 3 // 4)},
+            {"role": "user", "content": f"Current summary:\n{previous or '(empty)'}\n\nNew turns:\n{transcript}"}
+        ]
+        text = await llm_service.chat(messages)
+        if not text or text.startswith(LLM_ERROR_PREFIX):
+            return None
+        return truncate_tokens(text.strip(), max_tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self.summaries),
+            "compactions": self.compactions,
+            "failures": self.failures,
+            "in_progress": sum(1 for task in self._compactions.values() if not task.done())
+        }
+
+
+def _role(message: Dict[str, Any]) -> str:
+    return "user" if message.get("role") == "user" else "assistant"
+
+
+conversation_memory = ConversationMemory()
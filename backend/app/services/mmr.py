@@ -0,0 +1,59 @@
+from typing import Hashable, List, Optional, Sequence
+
+import numpy as np
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(
+    query_embedding: Sequence[float],
+    candidate_embeddings: Sequence[Sequence[float]],
+    k: int,
+    lambda_mult: float = 0.7,
+    groups: Optional[Sequence[Hashable]] = None
+) -> List[int]:
+    """
+    Greedy Maximal Marginal Relevance selection, vectorized with NumPy.
+
+    score(i) = lambda * sim(query, i) - (1 - lambda) * max_{j in selected} sim(i, j)
+
+    The candidate-by-candidate cosine matrix is computed in one matrix product and
+    the max-similarity-to-selected vector is updated incrementally after each pick,
+    so each step is O(n). If `groups` is given (e.g. file names), at most one
+    candidate per group is selected.
+
+    Returns indices into `candidate_embeddings`, in selection order.
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    if candidates.ndim != 2 or not len(candidates) or k <= 0:
+        return []
+
+    vectors = _normalize_rows(candidates)
+    query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    n = len(vectors)
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n, dtype=np.float32)
+    group_ids = None
+    if groups is not None:
+        index = {}
+        group_ids = np.array([index.setdefault(group, len(index)) for group in groups])
+
+    selected: List[int] = []
+    while len(selected) < k and available.any():
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+
+        available[best] = False
+        if group_ids is not None:
+            available &= group_ids != group_ids[best]
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
@@ -0,0 +1,157 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.models.schemas import ModelConfig, RoutingPolicy
+
+# Requests (and hedges) remembered for max_hedge_rate accounting
+HEDGE_WINDOW = 1000
+
+
+class ModelHealth:
+    """Rolling latency and outcome samples for one model."""
+
+    def __init__(self):
+        # (monotonic time, seconds) per kind: "ttft" for streams, "latency" for full responses
+        self.latencies: Dict[str, Deque[Tuple[float, float]]] = {
+            "ttft": deque(maxlen=settings.ROUTING_WINDOW_SIZE),
+            "latency": deque(maxlen=settings.ROUTING_WINDOW_SIZE)
+        }
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=settings.ROUTING_WINDOW_SIZE)
+        self.successes = 0
+        self.errors = 0
+        self.cancelled = 0
+
+    @staticmethod
+    def _recent(samples: Deque[Tuple[float, Any]]) -> List[Any]:
+        horizon = time.monotonic() - settings.ROUTING_WINDOW_SECONDS
+        return [value for at, value in samples if at >= horizon]
+
+    def quantile(self, kind: str, q: float, min_samples: int) -> Optional[float]:
+        values = sorted(self._recent(self.latencies[kind]))
+        if len(values) < min_samples:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def error_rate(self) -> Tuple[float, int]:
+        outcomes = self._recent(self.outcomes)
+        if not outcomes:
+            return 0.0, 0
+        return outcomes.count(False) / len(outcomes), len(outcomes)
+
+
+class ModelRouter:
+    """
+    Latency-aware routing between a primary and a secondary model.
+
+    The router only keeps statistics and makes decisions; LLMService runs the
+    requests. Per model it tracks rolling time-to-first-token (streams) and full
+    response latency (chat), plus success/error outcomes. Samples older than
+    ROUTING_WINDOW_SECONDS are ignored, so a model skipped for its error rate is
+    tried again once its bad samples age out.
+    """
+
+    def __init__(self):
+        self.policy = RoutingPolicy()
+        self._health: Dict[str, ModelHealth] = {}
+        self._requests: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self._hedges: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+        self.hedged = 0
+        self.hedges_denied = 0
+        self.fallbacks = 0
+        self.secondary_wins = 0
+
+    def set_policy(self, policy: RoutingPolicy):
+        self.policy = policy
+
+    def health(self, model_id: str) -> ModelHealth:
+        health = self._health.get(model_id)
+        if health is None:
+            health = self._health[model_id] = ModelHealth()
+        return health
+
+    def is_healthy(self, model_id: str) -> bool:
+        rate, samples = self.health(model_id).error_rate()
+        return samples < self.policy.min_samples or rate <= self.policy.max_error_rate
+
+    def route(self, configs: List[ModelConfig], active: ModelConfig) -> Tuple[ModelConfig, Optional[ModelConfig]]:
+        """(model to call, model to hedge to / fall back on or None) under the current policy."""
+        by_id = {c.id: c for c in configs}
+        primary = by_id.get(self.policy.primary_model_id) or active
+        secondary = by_id.get(self.policy.secondary_model_id)
+        if secondary is None or secondary.id == primary.id:
+            return primary, None
+        if not self.is_healthy(primary.id) and self.is_healthy(secondary.id):
+            # Skip the unhealthy primary entirely
+            return secondary, None
+        if not self.is_healthy(secondary.id):
+            return primary, None
+        return primary, secondary
+
+    def hedge_delay(self, model_id: str, kind: str) -> Optional[float]:
+        """Seconds to wait on `model_id` before hedging, or None when hedging is off."""
+        policy = self.policy
+        if not policy.hedge_enabled or policy.max_hedge_rate <= 0:
+            return None
+        observed = self.health(model_id).quantile(kind, policy.hedge_quantile, policy.min_samples)
+        delay_ms = policy.default_hedge_delay_ms if observed is None else observed * 1000.0
+        return max(delay_ms, policy.min_hedge_delay_ms) / 1000.0
+
+    def record_request(self):
+        self._requests.append(time.monotonic())
+
+    def try_hedge(self) -> bool:
+        """Take a hedge from the budget: at most max_hedge_rate of recent requests."""
+        horizon = time.monotonic() - settings.ROUTING_WINDOW_SECONDS
+        requests = sum(1 for at in self._requests if at >= horizon)
+        hedges = sum(1 for at in self._hedges if at >= horizon)
+        if hedges >= self.policy.max_hedge_rate * requests:
+            self.hedges_denied += 1
+            return False
+        self._hedges.append(time.monotonic())
+        self.hedged += 1
+        return True
+
+    def record_latency(self, model_id: str, kind: str, seconds: float):
+        self.health(model_id).latencies[kind].append((time.monotonic(), seconds))
+
+    def record_outcome(self, model_id: str, ok: bool):
+        health = self.health(model_id)
+        health.outcomes.append((time.monotonic(), ok))
+        if ok:
+            health.successes += 1
+        else:
+            health.errors += 1
+
+    def record_cancelled(self, model_id: str, kind: str, seconds: float):
+        """A losing request was cancelled; its elapsed time is a lower bound on its latency."""
+        health = self.health(model_id)
+        health.cancelled += 1
+        health.latencies[kind].append((time.monotonic(), seconds))
+
+    def stats(self) -> Dict[str, Any]:
+        models = {}
+        for model_id, health in self._health.items():
+            error_rate, samples = health.error_rate()
+            models[model_id] = {
+                "healthy": self.is_healthy(model_id),
+                "error_rate": round(error_rate, 4),
+                "outcome_samples": samples,
+                "successes": health.successes,
+                "errors": health.errors,
+                "cancelled": health.cancelled,
+                **{
+                    f"{kind}_p95_ms": round(value * 1000.0, 1) if value is not None else None
+                    for kind in health.latencies
+                    for value in [health.quantile(kind, 0.95, 1)]
+                }
+            }
+        return {
+            "policy": self.policy.model_dump(),
+            "hedged": self.hedged,
+            "hedges_denied": self.hedges_denied,
+            "fallbacks": self.fallbacks,
+            "secondary_wins": self.secondary_wins,
+            "models": models
+        }
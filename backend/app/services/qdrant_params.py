@@ -0,0 +1,105 @@
+from typing import List, Optional
+
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Datatype,
+    Distance,
+    HnswConfigDiff,
+    QuantizationConfig,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    SetPayload,
+    SetPayloadOperation,
+    VectorParams,
+)
+
+from app.core.config import settings
+
+# Collection storage options shared by ingestion, the backend and the benchmarks
+QUANTIZATION_MODES = ("none", "int8", "binary")
+VECTOR_DATATYPES = ("float32", "float16")
+# Collection metadata key ingestion sets when a run completes (Unix time); part of the
+# backend's collection generation, so caches are dropped after every re-ingest
+INGESTION_MARKER = "ingested_at"
+
+
+def vector_params(size: int, datatype: str = "float32", on_disk: bool = False) -> VectorParams:
+    """
+    Dense vector config. `on_disk` keeps the original vectors memory-mapped
+    (with quantization, only the quantized copy stays in RAM).
+    """
+    if datatype not in VECTOR_DATATYPES:
+        raise ValueError(f"Unknown vector datatype '{datatype}', expected one of {VECTOR_DATATYPES}")
+    return VectorParams(
+        size=size,
+        distance=Distance.COSINE,
+        datatype=Datatype.FLOAT16 if datatype == "float16" else None,
+        on_disk=on_disk or None
+    )
+
+
+def quantization_config(mode: str) -> Optional[QuantizationConfig]:
+    """
+    "int8": scalar quantization (4x smaller than float32, clipped at the 0.99 quantile).
+    "binary": 1 bit per dimension (32x smaller); needs rescoring to keep recall.
+    The quantized vectors are always kept in RAM.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}', expected one of {QUANTIZATION_MODES}")
+    if mode == "int8":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def hnsw_config(
+    m: Optional[int] = None, ef_construct: Optional[int] = None, full_scan_threshold: Optional[int] = None
+) -> Optional[HnswConfigDiff]:
+    """
+    HNSW build parameters; None (or 0) keeps Qdrant's default for that field.
+    `full_scan_threshold` is in KB of vectors: smaller (filtered) result sets are
+    searched exhaustively instead of through the graph.
+    """
+    if not (m or ef_construct or full_scan_threshold):
+        return None
+    return HnswConfigDiff(m=m or None, ef_construct=ef_construct or None, full_scan_threshold=full_scan_threshold or None)
+
+
+def search_params(
+    rescore: Optional[bool] = None,
+    oversampling: Optional[float] = None,
+    hnsw_ef: Optional[int] = None,
+    exact: Optional[bool] = None
+) -> SearchParams:
+    """
+    Query-time parameters for RAGService (defaults from Settings). Quantization
+    options are ignored by Qdrant for collections without quantization; hnsw_ef
+    0 means Qdrant's default (ef_construct).
+    """
+    hnsw_ef = settings.QDRANT_SEARCH_HNSW_EF if hnsw_ef is None else hnsw_ef
+    return SearchParams(
+        hnsw_ef=hnsw_ef or None,
+        exact=settings.QDRANT_SEARCH_EXACT if exact is None else exact,
+        quantization=QuantizationSearchParams(
+            rescore=settings.QDRANT_SEARCH_RESCORE if rescore is None else rescore,
+            oversampling=settings.QDRANT_SEARCH_OVERSAMPLING if oversampling is None else oversampling
+        )
+    )
+
+
+def text_payload_updates(nodes) -> List[SetPayloadOperation]:
+    """
+    Flat "text" payload per ingested chunk (point id = node id), for batch_update_points
+    after the vector store add. RAGService reads it instead of parsing _node_content.
+    """
+    return [
+        SetPayloadOperation(set_payload=SetPayload(payload={"text": node.get_content()}, points=[node.node_id]))
+        for node in nodes
+    ]
@@ -1,13 +1,39 @@
 import os
-from llama_index.core import VectorStoreIndex, StorageContext, Settings
+import json
+import time
+import asyncio
+import hashlib
+import numpy as np
+from llama_index.core import Settings
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_index.embeddings.openai import OpenAIEmbedding
 import qdrant_client
+from qdrant_client.http.models import QueryRequest, SparseVector
 from app.core.config import settings
+from app.core import metrics, timing
+from app.core.cache import LRUCache
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.mmr import mmr_select
+from app.services.qdrant_params import INGESTION_MARKER, search_params
+from app.services.reranker import Reranker
+from app.services.sparse_encoder import BM25SparseEncoder, SPARSE_VECTOR_NAME
 
 from llama_index.core.postprocessor.types import BaseNodePostprocessor
 from llama_index.core.schema import NodeWithScore, QueryBundle
-from typing import List, Optional
+from llama_index.core.vector_stores.types import VectorStoreQuery, VectorStoreQueryMode
+from typing import Any, Dict, List, Optional, Tuple
+
+# Metadata fields chat.py reads from a context node
+DIRECT_METADATA_FIELDS = ["file_name", "page_label"]
+# Ingestion writes the chunk text as a flat "text" payload field, so the direct paths
+# never fetch or parse the serialized LlamaIndex node (_node_content)
+DIRECT_PAYLOAD_FIELDS = DIRECT_METADATA_FIELDS + ["text"]
+LEGACY_TEXT_FIELD = "_node_content"
+
+def normalize_query(query_text: str) -> str:
+    """Canonical form of a query for cache/coalescing keys."""
+    # bge-small-en is uncased, so case and whitespace do not change the embedding
+    return " ".join(query_text.lower().split())
 
 class UniqueFilePostprocessor(BaseNodePostprocessor):
     """Keep only the first node for each unique file_name."""
@@ -28,20 +54,15 @@ class UniqueFilePostprocessor(BaseNodePostprocessor):
 
 class RAGService:
     def __init__(self):
-        self.client = qdrant_client.QdrantClient(
-            host=settings.QDRANT_HOST,
-            port=settings.QDRANT_PORT
-        )
-        self.aclient = qdrant_client.AsyncQdrantClient(
-            host=settings.QDRANT_HOST,
-            port=settings.QDRANT_PORT
-        )
-        self.vector_store = QdrantVectorStore(
-            client=self.client,
-            aclient=self.aclient,
-            collection_name=settings.QDRANT_COLLECTION
-        )
-        self.storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
+        # QDRANT_LOCATION (e.g. ":memory:") overrides host/port for local runs and benchmarks
+        if settings.QDRANT_LOCATION:
+            client_args = {"location": settings.QDRANT_LOCATION}
+        else:
+            client_args = {"host": settings.QDRANT_HOST, "port": settings.QDRANT_PORT}
+        self.client = qdrant_client.QdrantClient(**client_args)
+        self.aclient = qdrant_client.AsyncQdrantClient(**client_args)
+        # Built on first use (or by connect()): QdrantVectorStore checks the collection over the network
+        self._vector_store: Optional[QdrantVectorStore] = None
 
         # Configure Embedding Model (Remote TEI Service)
         # We use OpenAIEmbedding client to talk to our self-hosted Text Embeddings Inference service
@@ -50,40 +71,424 @@ class RAGService:
             model_name=settings.EMBEDDING_MODEL_NAME,
             api_base=settings.EMBEDDINGS_SERVICE_URL,
             api_key="EMPTY",
-            embed_batch_size=30
+            # TEI accepts up to --max-client-batch-size (128) texts per request
+            embed_batch_size=128
         )
 
-    async def query(self, query_text: str, k: int = 5):
+        # Concurrent query embeddings are coalesced into batched TEI requests
+        self.embedding_batcher = EmbeddingBatcher(
+            self.embed_texts,
+            window_ms=settings.EMBED_BATCH_WINDOW_MS,
+            max_batch_size=settings.EMBED_BATCH_MAX_SIZE
+        )
+
+        # Built once and reused: the query path only needs the vector store and the
+        # (stateless) postprocessor. k and MMR settings are passed per call.
+        self.postprocessor = UniqueFilePostprocessor()
+
+        # Optional cross-encoder stage over a larger candidate pool (RERANK_ENABLED)
+        self.reranker = Reranker()
+        # In-process BM25 query encoder for RAG_RETRIEVAL_MODE=hybrid (same one ingestion uses)
+        self.sparse_encoder = BM25SparseEncoder()
+
+        # Collection generation: bumped locally when an ingestion run is triggered and
+        # refreshed from the collection's point count and the completion marker ingestion
+        # writes to the collection metadata, so finished runs are picked up even when
+        # they keep the point count.
+        self._local_generation = 0
+        self._points_count: Optional[int] = None
+        self._ingested_at: Any = None
+        self._generation_checked_at = 0.0
+        # Hybrid mode: whether the collection has the BM25 sparse vector, as of the
+        # generation it was learned in (from the collection info or a failed search).
+        # Collections without it go straight to dense-only until the generation changes.
+        self._sparse_supported: Optional[bool] = None
+        self._sparse_generation: Optional[Tuple[int, Optional[int], Any]] = None
+
+        # Tier 1: (normalized query, embedding model) -> query embedding
+        self.embedding_cache = LRUCache(
+            max_entries=settings.RAG_EMBEDDING_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.RAG_EMBEDDING_CACHE_TTL_SECONDS
+        )
+        # Tier 2: (embedding hash, k, collection generation) -> formatted context list
+        self.retrieval_cache = LRUCache(
+            max_entries=settings.RAG_RETRIEVAL_CACHE_MAX_ENTRIES,
+            max_bytes=settings.RAG_RETRIEVAL_CACHE_MAX_BYTES,
+            ttl_seconds=settings.RAG_RETRIEVAL_CACHE_TTL_SECONDS
+        )
+
+    @property
+    def vector_store(self) -> QdrantVectorStore:
+        if self._vector_store is None:
+            self._vector_store = QdrantVectorStore(
+                client=self.client,
+                aclient=self.aclient,
+                collection_name=settings.QDRANT_COLLECTION
+            )
+        return self._vector_store
+
+    async def connect(self) -> Optional[int]:
+        """Build the vector store and read the collection info (first Qdrant round trips)."""
+        await asyncio.to_thread(lambda: self.vector_store)
+        self._read_collection_info(await self.aclient.get_collection(settings.QDRANT_COLLECTION))
+        self._generation_checked_at = time.monotonic()
+        return self._points_count
+
+    def _read_collection_info(self, info):
+        self._points_count = info.points_count
+        metadata = getattr(info.config, "metadata", None)  # qdrant-client < 1.16 has no metadata
+        if metadata is None or isinstance(metadata, dict):
+            self._ingested_at = (metadata or {}).get(INGESTION_MARKER)
+        sparse_vectors = info.config.params.sparse_vectors
+        if sparse_vectors is None or isinstance(sparse_vectors, dict):
+            self._set_sparse_supported(SPARSE_VECTOR_NAME in (sparse_vectors or {}))
+
+    def _set_sparse_supported(self, supported: bool):
+        self._sparse_supported = supported
+        self._sparse_generation = self._generation()
+
+    def _hybrid_available(self) -> bool:
+        """False once the current collection generation is known to lack the sparse vector."""
+        if self._sparse_generation != self._generation():
+            return True
+        return bool(self._sparse_supported)
+
+    async def warm_search(self, query_text: str) -> int:
+        """
+        Embed and search once on the configured retrieval path, bypassing the caches.
+        Returns the number of hits.
+        """
+        embedding = (await self.embed_texts([query_text]))[0]
+        return len(await self._search(query_text, embedding, 1, settings.RAG_RETRIEVAL_MODE))
+
+    def bump_generation(self):
+        """Mark the collection as changed (e.g. an ingestion run was triggered)."""
+        self._local_generation += 1
+
+    def _generation(self) -> Tuple[int, Optional[int], Any]:
+        return (self._local_generation, self._points_count, self._ingested_at)
+
+    async def collection_generation(self) -> Tuple[int, Optional[int], Any]:
+        """
+        Version marker for the collection contents, used to invalidate caches.
+        Qdrant is asked at most every COLLECTION_VERSION_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        if now - self._generation_checked_at >= settings.COLLECTION_VERSION_CHECK_SECONDS:
+            self._generation_checked_at = now
+            try:
+                self._read_collection_info(await self.aclient.get_collection(settings.QDRANT_COLLECTION))
+            except Exception as e:
+                metrics.dependency_error("qdrant", "get_collection")
+                print(f"WARNING: Could not read collection version: {e}")
+        return self._generation()
+
+    @staticmethod
+    def _embedding_hash(embedding: List[float]) -> str:
+        return hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "embedding_cache": self.embedding_cache.stats(),
+            "retrieval_cache": self.retrieval_cache.stats(),
+            "reranker": self.reranker.stats()
+        }
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed passages in as few TEI requests as possible (uncached)."""
+        try:
+            return await Settings.embed_model.aget_text_embedding_batch(texts)
+        except Exception:
+            metrics.dependency_error("tei", "embed_batch")
+            raise
+
+    async def embed_query(self, query_text: str) -> List[float]:
+        """
+        Embed a query with the remote embedding service (cached per normalized query).
+        """
+        key = (normalize_query(query_text), settings.EMBEDDING_MODEL_NAME)
+        with metrics.stage("embed", settings.EMBEDDING_MODEL_NAME, "tei"):
+            embedding = self.embedding_cache.get(key)
+            if embedding is None:
+                if settings.EMBED_BATCH_ENABLED:
+                    # TEI failures are counted in embed_texts
+                    embedding = await self.embedding_batcher.embed(query_text)
+                else:
+                    try:
+                        embedding = await Settings.embed_model.aget_query_embedding(query_text)
+                    except Exception:
+                        metrics.dependency_error("tei", "embed_query")
+                        raise
+                if embedding:
+                    self.embedding_cache.set(key, embedding)
+        return embedding
+
+    async def query(self, query_text: str, k: int = 5, embedding: Optional[List[float]] = None):
         """
         Query the RAG system using the remote embedding service and Qdrant.
+        Pass a precomputed query embedding to skip the embedding call.
+        With RERANK_ENABLED, RERANK_CANDIDATES nodes are retrieved and the best k
+        by cross-encoder score are returned.
         """
-        index = VectorStoreIndex.from_vector_store(
-            self.vector_store,
-            storage_context=self.storage_context,
-            embed_model=Settings.embed_model
-        )
+        if not embedding:
+            embedding = await self.embed_query(query_text)
+
+        with metrics.stage("search", settings.EMBEDDING_MODEL_NAME, "qdrant"):
+            candidates = await self._candidates(query_text, embedding, k)
+        rerank = settings.RERANK_ENABLED and len(candidates) > 1
+        with metrics.stage("postprocess", "", "tei" if rerank else "local"):
+            if rerank:
+                context = await self.reranker.rerank(query_text, normalize_query(query_text), candidates, k)
+            else:
+                context = candidates[:k]
+        timing.note("candidates", {"retrieved": len(candidates), "returned": len(context)})
+        return context
+
+    async def _candidates(self, query_text: str, embedding: List[float], k: int) -> List[Dict[str, Any]]:
+        """Retrieval (cached per embedding), before the optional rerank stage."""
+        if settings.RERANK_ENABLED:
+            k = max(k, settings.RERANK_CANDIDATES)
+
+        cache_key = None
+        if embedding:
+            generation = await self.collection_generation()
+            cache_key = (self._embedding_hash(embedding), k, generation)
+            cached = self.retrieval_cache.get(cache_key)
+            if cached is not None:
+                return [dict(node) for node in cached]
+
+        mode = settings.RAG_RETRIEVAL_MODE
+        try:
+            context = await self._search(query_text, embedding, k, mode)
+        except Exception:
+            metrics.dependency_error("qdrant", mode)
+            raise
+
+        if cache_key is not None:
+            self.retrieval_cache.set(cache_key, [dict(node) for node in context])
+            
+        return context
+
+    async def _search(self, query_text: str, embedding: List[float], k: int, mode: str) -> List[Dict[str, Any]]:
+        """Dispatch on RAG_RETRIEVAL_MODE; grouped and hybrid fall back on simpler searches."""
+        if mode == "grouped":
+            try:
+                return await self._retrieve_grouped(embedding, k)
+            except Exception as e:
+                # e.g. older Qdrant or a collection without the file_name index
+                metrics.dependency_error("qdrant", mode)
+                print(f"WARNING: Grouped retrieval failed, falling back to LlamaIndex path: {e}")
+                return await self._retrieve(query_text, embedding, k)
+        elif mode == "mmr":
+            return await self._retrieve_mmr(embedding, k)
+        elif mode == "hybrid":
+            if self._hybrid_available():
+                try:
+                    return await self._retrieve_hybrid(query_text, embedding, k)
+                except Exception as e:
+                    # e.g. a collection ingested before the sparse vector was added
+                    metrics.dependency_error("qdrant", mode)
+                    print(f"WARNING: Hybrid retrieval failed, using dense-only until the collection changes: {e}")
+                    self._set_sparse_supported(False)
+            return await self._retrieve_direct(embedding, k)
+        elif mode == "qdrant":
+            return await self._retrieve_direct(embedding, k)
+        return await self._retrieve(query_text, embedding, k)
+
+    async def _retrieve(
+        self,
+        query_text: str,
+        embedding: List[float],
+        k: int,
+        mode: VectorStoreQueryMode = VectorStoreQueryMode.MMR,
+        mmr_threshold: float = 0.7
+    ) -> List[Dict[str, Any]]:
+        """
+        LlamaIndex retrieval against the persistent vector store.
+        Equivalent to index.as_retriever(...).aretrieve(...) without rebuilding
+        the index and retriever (and without sharing per-call state between requests).
+        """
+        # 1. Over-fetch for Source Diversity using MMR (Maximal Marginal Relevance)
+        result = await self.vector_store.aquery(VectorStoreQuery(
+            query_embedding=embedding,
+            query_str=query_text,
+            similarity_top_k=k * 4,
+            mode=mode,
+            mmr_threshold=mmr_threshold
+        ), search_params=search_params())
+        similarities = result.similarities or [None] * len(result.nodes)
+        nodes = [NodeWithScore(node=node, score=score) for node, score in zip(result.nodes, similarities)]
 
-        # 1. Configure retriever for Source Diversity using MMR (Maximal Marginal Relevance)
-        retriever = index.as_retriever(
-            similarity_top_k=k * 4, 
-            vector_store_query_mode="mmr",
-            mmr_threshold=0.7
-        )
-        nodes = await retriever.aretrieve(query_text)
-        
         # 2. Apply Postprocessor for Unique Files
-        postprocessor = UniqueFilePostprocessor()
-        filtered_nodes = postprocessor.postprocess_nodes(nodes)
-        
+        filtered_nodes = self.postprocessor.postprocess_nodes(nodes)
+
         # 3. Format results (limit to k)
         context = []
         for node in filtered_nodes[:k]:
             context.append({
+                "id": node.node.node_id,
                 "text": node.node.get_text(),
                 "metadata": node.node.metadata,
                 "score": node.score
             })
-            
         return context
 
+    async def _retrieve_direct(self, embedding: List[float], k: int) -> List[Dict[str, Any]]:
+        """
+        Direct AsyncQdrantClient retrieval that skips LlamaIndex node deserialization.
+        Only the payload fields chat.py uses are fetched, and no node objects are built.
+        """
+        response = await self.aclient.query_points(
+            collection_name=settings.QDRANT_COLLECTION,
+            query=embedding,
+            limit=k * 4,
+            search_params=search_params(),
+            with_payload=DIRECT_PAYLOAD_FIELDS
+        )
+
+        context = []
+        seen_files = set()
+        for point in response.points:
+            payload = point.payload or {}
+            file_name = payload.get("file_name")
+            if file_name in seen_files:
+                continue
+            seen_files.add(file_name)
+            context.append(_point_to_context(point))
+            if len(context) == k:
+                break
+        return await self._fill_legacy_text(context)
+
+    async def _retrieve_grouped(self, embedding: List[float], k: int) -> List[Dict[str, Any]]:
+        """
+        Server-side source diversity: Qdrant groups hits by file_name and returns the
+        best chunk of the top k files in one round trip (no k*4 over-fetch).
+        Relies on the file_name keyword payload index created at ingestion.
+        """
+        response = await self.aclient.query_points_groups(
+            collection_name=settings.QDRANT_COLLECTION,
+            query=embedding,
+            group_by="file_name",
+            group_size=1,
+            limit=k,
+            search_params=search_params(),
+            with_payload=DIRECT_PAYLOAD_FIELDS
+        )
+        return await self._fill_legacy_text(
+            [_point_to_context(group.hits[0]) for group in response.groups if group.hits]
+        )
+
+    async def _retrieve_mmr(self, embedding: List[float], k: int) -> List[Dict[str, Any]]:
+        """
+        Fetch a large candidate pool with vectors in one Qdrant call, then run
+        vectorized MMR with the unique-file constraint locally (see mmr.py).
+        """
+        response = await self.aclient.query_points(
+            collection_name=settings.QDRANT_COLLECTION,
+            query=embedding,
+            limit=k * settings.RAG_MMR_CANDIDATE_MULTIPLIER,
+            search_params=search_params(),
+            with_payload=DIRECT_PAYLOAD_FIELDS,
+            with_vectors=True
+        )
+        points = [p for p in response.points if p.vector is not None]
+        if not points:
+            return []
+
+        vectors = [_dense_vector(p.vector) for p in points]
+        file_names = [(p.payload or {}).get("file_name") for p in points]
+        selected = mmr_select(embedding, vectors, k, lambda_mult=settings.RAG_MMR_LAMBDA, groups=file_names)
+        return await self._fill_legacy_text([_point_to_context(points[i]) for i in selected])
+
+    async def _retrieve_hybrid(self, query_text: str, embedding: List[float], k: int) -> List[Dict[str, Any]]:
+        """
+        Dense and BM25 sparse searches in one batched Qdrant request, fused with
+        weighted reciprocal rank fusion; one chunk per file.
+        """
+        limit = k * 4
+        requests = [QueryRequest(query=embedding, limit=limit, params=search_params(), with_payload=DIRECT_PAYLOAD_FIELDS)]
+        weights = [settings.RAG_HYBRID_DENSE_WEIGHT]
+        indices, values = self.sparse_encoder.encode_query(query_text)
+        if indices:
+            requests.append(QueryRequest(
+                query=SparseVector(indices=indices, values=values),
+                using=SPARSE_VECTOR_NAME,
+                limit=limit,
+                with_payload=DIRECT_PAYLOAD_FIELDS
+            ))
+            weights.append(settings.RAG_HYBRID_SPARSE_WEIGHT)
+
+        responses = await self.aclient.query_batch_points(
+            collection_name=settings.QDRANT_COLLECTION, requests=requests
+        )
+        fused = weighted_rrf([r.points for r in responses], weights, settings.RAG_HYBRID_RRF_K)
+
+        context = []
+        seen_files = set()
+        for point, score in fused:
+            file_name = (point.payload or {}).get("file_name")
+            if file_name in seen_files:
+                continue
+            seen_files.add(file_name)
+            context.append({**_point_to_context(point), "score": score})
+            if len(context) == k:
+                break
+        return await self._fill_legacy_text(context)
+
+    async def _fill_legacy_text(self, context: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Text for hits from collections ingested before the flat "text" payload: one
+        extra round trip for just the returned hits, reading their serialized node.
+        """
+        missing = [node for node in context if node["text"] is None]
+        if not missing:
+            return context
+        points = await self.aclient.retrieve(
+            collection_name=settings.QDRANT_COLLECTION,
+            ids=[int(node["id"]) if node["id"].isdigit() else node["id"] for node in missing],
+            with_payload=[LEGACY_TEXT_FIELD]
+        )
+        texts = {str(point.id): _node_text(point.payload or {}) for point in points}
+        for node in missing:
+            node["text"] = texts.get(node["id"], "")
+        return context
+
+def weighted_rrf(rankings: List[List[Any]], weights: List[float], rrf_k: int = 60) -> List[Tuple[Any, float]]:
+    """
+    Weighted reciprocal rank fusion: score(p) = sum_i w_i / (rrf_k + rank_i(p)),
+    rank starting at 1. Returns (point, score) best first; points match on id.
+    """
+    scores: Dict[Any, float] = {}
+    points: Dict[Any, Any] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, point in enumerate(ranking, start=1):
+            scores[point.id] = scores.get(point.id, 0.0) + weight / (rrf_k + rank)
+            points.setdefault(point.id, point)
+    return sorted(((points[pid], score) for pid, score in scores.items()), key=lambda pair: -pair[1])
+
+def _dense_vector(vector) -> List[float]:
+    # Named-vector collections return {name: vector}; ours uses the default (unnamed) vector
+    if isinstance(vector, dict):
+        return vector.get("", next(iter(vector.values())))
+    return vector
+
+def _point_to_context(point) -> Dict[str, Any]:
+    payload = point.payload or {}
+    return {
+        "id": str(point.id),
+        "text": payload.get("text"),
+        "metadata": {key: payload[key] for key in DIRECT_METADATA_FIELDS if key in payload},
+        "score": point.score
+    }
+
+def _node_text(payload: Dict[str, Any]) -> str:
+    """
+    Chunk text from the serialized LlamaIndex node. We read that one field instead
+    of rebuilding the whole node (relationships, metadata templates, validation).
+    """
+    node_content = payload.get(LEGACY_TEXT_FIELD)
+    if not node_content:
+        return ""
+    return json.loads(node_content).get("text", "")
+
 rag_service = RAGService()
@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import httpx
+
+from app.core import metrics
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+
+def _node_key(node: Dict[str, Any]) -> str:
+    """Point id, or a hash of the text for nodes without one."""
+    return node.get("id") or hashlib.sha1(node["text"].encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """
+    Cross-encoder reranking against a TEI-compatible /rerank endpoint.
+
+    All candidates missing from the score cache are scored in one request. Scores
+    are cached per (query hash, point id), so repeated and overlapping queries only
+    pay for new passages. Reranking is best effort: when RERANK_MAX_IN_FLIGHT calls
+    are already running, or the call does not finish within RERANK_LATENCY_BUDGET_MS,
+    the retrieval order is kept instead.
+    """
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            base_url=settings.RERANKER_SERVICE_URL,
+            timeout=httpx.Timeout(10.0, connect=2.0),
+            limits=httpx.Limits(max_connections=settings.RERANK_MAX_IN_FLIGHT * 2)
+        )
+        self.score_cache = LRUCache(
+            max_entries=settings.RERANK_SCORE_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.RERANK_SCORE_CACHE_TTL_SECONDS
+        )
+        self.in_flight = 0
+        self.calls = 0
+        self.skipped: Dict[str, int] = {"load": 0, "budget": 0, "error": 0}
+        self._latencies: Deque[float] = deque(maxlen=1000)
+
+    async def rerank(
+        self, query_text: str, query_key: str, context: List[Dict[str, Any]], k: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Top `k` nodes by cross-encoder score (retrieval order if reranking is skipped).
+        `query_key` is the canonical query used for the score cache.
+        """
+        query_hash = hashlib.sha1(query_key.encode("utf-8")).hexdigest()
+        scores: List[Optional[float]] = [self.score_cache.get((query_hash, _node_key(n))) for n in context]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            if self.in_flight >= settings.RERANK_MAX_IN_FLIGHT:
+                self.skipped["load"] += 1
+                return context[:k]
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                async with asyncio.timeout(settings.RERANK_LATENCY_BUDGET_MS / 1000.0):
+                    fresh = await self._score(query_text, [context[i]["text"] for i in missing])
+            except TimeoutError:
+                self.skipped["budget"] += 1
+                return context[:k]
+            except Exception as e:
+                self.skipped["error"] += 1
+                metrics.dependency_error("tei", "rerank")
+                print(f"WARNING: Rerank failed, keeping retrieval order: {e}")
+                return context[:k]
+            finally:
+                self.in_flight -= 1
+            self._latencies.append(time.perf_counter() - started)
+            for i, score in zip(missing, fresh):
+                scores[i] = score
+                self.score_cache.set((query_hash, _node_key(context[i])), score)
+
+        order = sorted(range(len(context)), key=lambda i: scores[i], reverse=True)[:k]
+        return [{**context[i], "retrieval_score": context[i].get("score"), "score": scores[i]} for i in order]
+
+    async def _score(self, query_text: str, texts: List[str]) -> List[float]:
+        """One batched /rerank call; scores in input order."""
+        self.calls += 1
+        response = await self.client.post(
+            "/rerank", json={"query": query_text, "texts": texts, "truncate": True}
+        )
+        response.raise_for_status()
+        scores = [0.0] * len(texts)
+        for item in response.json():
+            scores[item["index"]] = float(item["score"])
+        return scores
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "calls": self.calls,
+            "in_flight": self.in_flight,
+            "skipped": dict(self.skipped),
+            "latency_ms": {
+                "p50": round(latencies[len(latencies) // 2] * 1000.0, 3) if latencies else 0.0,
+                "p95": round(latencies[int(len(latencies) * 0.95) - 1] * 1000.0, 3) if latencies else 0.0
+            },
+            "score_cache": self.score_cache.stats()
+        }
@@ -0,0 +1,86 @@
+import hashlib
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+# Named sparse vector in the Qdrant collection
+SPARSE_VECTOR_NAME = "text-sparse-bm25"
+
+# Words, numbers and compounds like "covlm-rl", "gpt-4o" or "v1.5"
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers herself him himself his how i if in into is it its itself just me more most
+my myself no nor not now of off on once only or other our ours ourselves out over own same she should
+so some such than that the their theirs them themselves then there these they this those through to
+too under until up very was we were what when where which while who whom why will with would you your
+yours yourself yourselves
+""".split())
+
+SparseVector = Tuple[List[int], List[float]]
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased terms without stopwords. Compounds are kept whole and also split,
+    so "COVLM-RL" matches both "covlm-rl" and "covlm".
+    """
+    terms = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        parts = re.split(r"[-_.]", token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(p for p in parts if p not in STOPWORDS and (len(p) > 1 or p.isdigit()))
+    return terms
+
+
+def term_id(term: str) -> int:
+    """Stable 31-bit id for a term (same in every process, unlike hash())."""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=4).digest(), "big") & 0x7FFFFFFF
+
+
+def _to_sparse(weights: Dict[int, float]) -> SparseVector:
+    indices = sorted(weights)
+    return indices, [weights[i] for i in indices]
+
+
+class BM25SparseEncoder:
+    """
+    BM25-style sparse vectors for hybrid retrieval.
+
+    Pure Python (no model download, GPU or network), so the same encoder runs in
+    the ingestion job and in the backend. Documents get BM25 term-frequency
+    weights; IDF is applied by Qdrant at query time (sparse vector with
+    Modifier.IDF), so no corpus statistics are needed and the vectors stay valid
+    as the collection grows. Queries get weight 1 per distinct term.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, avg_doc_length: float = 256.0):
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = avg_doc_length
+
+    def encode_document(self, text: str) -> SparseVector:
+        terms = tokenize(text)
+        norm = self.k1 * (1 - self.b + self.b * len(terms) / self.avg_doc_length)
+        weights: Dict[int, float] = {}
+        for term, tf in Counter(terms).items():
+            index = term_id(term)
+            # Hash collisions just add up
+            weights[index] = weights.get(index, 0.0) + tf * (self.k1 + 1) / (tf + norm)
+        return _to_sparse(weights)
+
+    def encode_query(self, text: str) -> SparseVector:
+        return _to_sparse({term_id(term): 1.0 for term in tokenize(text)})
+
+    # Batch signatures match LlamaIndex's sparse_doc_fn / sparse_query_fn
+    def encode_documents(self, texts: List[str]) -> Tuple[List[List[int]], List[List[float]]]:
+        vectors = [self.encode_document(t) for t in texts]
+        return [v[0] for v in vectors], [v[1] for v in vectors]
+
+    def encode_queries(self, texts: List[str]) -> Tuple[List[List[int]], List[List[float]]]:
+        vectors = [self.encode_query(t) for t in texts]
+        return [v[0] for v in vectors], [v[1] for v in vectors]
@@ -0,0 +1,115 @@
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import settings
+
+WARMUP_QUERY = "warm-up"
+
+
+class WarmUpService:
+    """
+    Startup warm-up that gates the /ready probe.
+
+    Run once from the app lifespan: connects to Qdrant and builds the vector store,
+    embeds and searches once through TEI and the configured retrieval path, loads
+    the tokenizer, and sends the active LLM (and the reranker, if enabled) a dummy
+    call. Independent steps run concurrently; a failing step is retried every
+    WARMUP_RETRY_SECONDS until WARMUP_TIMEOUT_SECONDS. /health stays a liveness
+    check, so slow dependencies never get the pod restarted.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.imports_ms: Dict[str, float] = {}
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.warmup_ms: Optional[float] = None
+
+    def record_import(self, name: str, seconds: float):
+        self.imports_ms[name] = round(seconds * 1000.0, 1)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "imports_ms": self.imports_ms,
+            "warmup_ms": self.warmup_ms,
+            "steps": self.steps
+        }
+
+    async def run(self):
+        started = time.perf_counter()
+        if settings.WARMUP_ENABLED:
+            deadline = time.monotonic() + settings.WARMUP_TIMEOUT_SECONDS
+            await asyncio.gather(
+                self._retrieval(deadline),
+                self._step("tokenizer", self._tokenizer, deadline),
+                self._step("llm", self._llm, deadline) if settings.WARMUP_LLM else asyncio.sleep(0),
+                self._step("reranker", self._reranker, deadline) if settings.RERANK_ENABLED else asyncio.sleep(0)
+            )
+        self.warmup_ms = round((time.perf_counter() - started) * 1000.0, 1)
+        self.ready = True
+        failed = [name for name, step in self.steps.items() if not step["ok"]]
+        if failed:
+            print(f"WARNING: Warm-up finished in {self.warmup_ms}ms with failed steps: {', '.join(failed)}")
+        else:
+            timings = {name: step["ms"] for name, step in self.steps.items()}
+            print(f"Warm-up finished in {self.warmup_ms}ms (imports {self.imports_ms}, steps {timings})")
+
+    async def _retrieval(self, deadline: float):
+        # The search needs both Qdrant and TEI, so it runs after them
+        connected, embedded = await asyncio.gather(
+            self._step("qdrant", self._qdrant, deadline),
+            self._step("tei", self._tei, deadline)
+        )
+        if connected and embedded:
+            await self._step("search", self._search, deadline)
+
+    async def _step(self, name: str, warm: Callable[[], Awaitable[Any]], deadline: float) -> bool:
+        """Run `warm` until it succeeds or the deadline passes; records time, attempts and result."""
+        step: Dict[str, Any] = {"ok": False, "attempts": 0}
+        self.steps[name] = step
+        started = time.perf_counter()
+        while True:
+            step["attempts"] += 1
+            try:
+                detail = await asyncio.wait_for(warm(), max(0.0, deadline - time.monotonic()))
+                step.update(ok=True, error=None)
+                if detail is not None:
+                    step["detail"] = detail
+                break
+            except Exception as e:
+                step["error"] = f"{type(e).__name__}: {e}"
+            if time.monotonic() + settings.WARMUP_RETRY_SECONDS >= deadline:
+                break
+            await asyncio.sleep(settings.WARMUP_RETRY_SECONDS)
+        step["ms"] = round((time.perf_counter() - started) * 1000.0, 1)
+        return step["ok"]
+
+    # --- Steps (services are imported lazily so main.py can import this module first) ---
+
+    async def _qdrant(self):
+        from app.services.rag_service import rag_service
+        return {"points": await rag_service.connect()}
+
+    async def _tei(self):
+        from app.services.rag_service import rag_service
+        await rag_service.embed_texts([WARMUP_QUERY])
+
+    async def _search(self):
+        from app.services.rag_service import rag_service
+        return {"mode": settings.RAG_RETRIEVAL_MODE, "hits": await rag_service.warm_search(WARMUP_QUERY)}
+
+    async def _tokenizer(self):
+        from app.services.context_packer import count_tokens
+        await asyncio.to_thread(count_tokens, WARMUP_QUERY)
+
+    async def _llm(self):
+        from app.services.llm_service import llm_service
+        return {"model": await llm_service.warm_up()}
+
+    async def _reranker(self):
+        from app.services.rag_service import rag_service
+        await rag_service.reranker._score(WARMUP_QUERY, [WARMUP_QUERY])
+
+
+warmup_service = WarmUpService()
@@ -0,0 +1,69 @@
+"""
+Benchmark: MMR re-ranking latency by candidate pool size.
+
+Compares LlamaIndex's pure-Python get_top_k_mmr_embeddings against the vectorized
+NumPy mmr_select used by RAGService (RAG_RETRIEVAL_MODE=mmr), with and without the
+unique-file constraint. Vectors are random 384-d (bge-small) embeddings.
+
+Usage (from backend/):
+    python benchmarks/bench_mmr.py --k 5 --pools 20 50 100 200 500
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from llama_index.core.indices.query.embedding_utils import get_top_k_mmr_embeddings
+
+from app.services.mmr import mmr_select
+
+DIM = 384
+
+
+def timed(fn, repeats: int) -> float:
+    """Median wall time in milliseconds."""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--pools", type=int, nargs="+", default=[20, 50, 100, 200, 500])
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--lambda_mult", type=float, default=0.7)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    print(f"k={args.k}, dim={DIM}, median of {args.repeats} runs")
+    print(f"{'pool':>6}{'llamaindex ms':>16}{'numpy ms':>12}{'numpy+files ms':>17}{'speedup':>10}")
+    for pool in args.pools:
+        query = rng.standard_normal(DIM).astype(np.float32)
+        candidates = rng.standard_normal((pool, DIM)).astype(np.float32)
+        files = [f"doc_{i % args.files}.pdf" for i in range(pool)]
+        query_list, candidate_lists = query.tolist(), candidates.tolist()
+
+        # Repeats are reduced for the slow path on large pools to keep the run short
+        slow_repeats = max(3, args.repeats // (1 + pool // 100))
+        llama_ms = timed(lambda: get_top_k_mmr_embeddings(
+            query_list, candidate_lists, similarity_top_k=args.k, mmr_threshold=args.lambda_mult
+        ), slow_repeats)
+        numpy_ms = timed(lambda: mmr_select(query_list, candidate_lists, args.k, args.lambda_mult), args.repeats)
+        grouped_ms = timed(lambda: mmr_select(
+            query_list, candidate_lists, args.k, args.lambda_mult, groups=files
+        ), args.repeats)
+        print(f"{pool:>6}{llama_ms:>16.3f}{numpy_ms:>12.3f}{grouped_ms:>17.3f}{llama_ms / numpy_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
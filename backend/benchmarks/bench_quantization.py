@@ -0,0 +1,184 @@
+"""
+Benchmark: Qdrant storage modes (float16, int8/binary quantization, on-disk) against
+a float32 baseline on the bundled source documents.
+
+The documents in data/source_documents are chunked like ingestion (SentenceSplitter)
+and embedded once with the TEI service; every storage mode then gets its own
+temporary collection with the same points. Queries are the opening words of
+randomly sampled chunks. For each mode it reports:
+  - est. RAM: vectors + quantized vectors + HNSW links + payload kept in memory,
+    computed from the collection config and point count
+  - p50/p99 query latency with the RAGService search params (rescore, oversampling)
+  - recall@k against exact float32 search
+
+Needs a Qdrant server (local/in-memory mode ignores quantization), the embedding
+service (EMBEDDINGS_SERVICE_URL) and pypdf. With port-forwards active (connect.sh):
+
+Usage (from backend/):
+    EMBEDDINGS_SERVICE_URL=http://localhost:8082/v1 \\
+        python benchmarks/bench_quantization.py --qdrant_url http://localhost:6333 --k 5
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("QDRANT_LOCATION", ":memory:")
+
+import qdrant_client
+from qdrant_client.http.models import PointStruct, SearchParams, CollectionStatus
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.node_parser import SentenceSplitter
+
+from app.services.rag_service import rag_service
+from app.services.qdrant_params import quantization_config, search_params, vector_params
+
+DIM = 384
+HNSW_M = 16  # Qdrant default
+DOCS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "source_documents")
+
+# name -> (datatype, quantization, on-disk vectors, on-disk payload, rescore)
+MODES = {
+    "float32": ("float32", "none", False, False, True),
+    "float16": ("float16", "none", False, False, True),
+    "int8": ("float32", "int8", False, False, True),
+    "int8-norescore": ("float32", "int8", False, False, False),
+    "int8-ondisk": ("float32", "int8", True, True, True),
+    "binary": ("float32", "binary", False, False, True),
+    "binary-ondisk": ("float32", "binary", True, True, True),
+}
+
+
+def estimated_ram_bytes(points: int, payload_bytes: int, datatype: str, quantization: str,
+                        on_disk: bool, on_disk_payload: bool) -> int:
+    ram = points * HNSW_M * 2 * 4  # layer-0 links, 4 bytes each
+    if not on_disk:
+        ram += points * DIM * (2 if datatype == "float16" else 4)
+    if quantization == "int8":
+        ram += points * DIM
+    elif quantization == "binary":
+        ram += points * DIM // 8
+    if not on_disk_payload:
+        ram += payload_bytes
+    return ram
+
+
+def load_chunks(chunk_size: int, max_chunks: int):
+    documents = SimpleDirectoryReader(DOCS_DIR).load_data()
+    nodes = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=20).get_nodes_from_documents(documents)
+    chunks = [(n.metadata.get("file_name"), n.get_content()) for n in nodes if n.get_content().strip()]
+    return chunks[:max_chunks] if max_chunks > 0 else chunks
+
+
+def create(client, name: str, mode: str, points):
+    datatype, quantization, on_disk, on_disk_payload, _ = MODES[mode]
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config=vector_params(DIM, datatype=datatype, on_disk=on_disk),
+        quantization_config=quantization_config(quantization),
+        on_disk_payload=on_disk_payload
+    )
+    for start in range(0, len(points), 256):
+        client.upsert(collection_name=name, points=points[start:start + 256], wait=True)
+    # Wait for the optimizer to finish indexing/quantizing before timing queries
+    while client.get_collection(name).status != CollectionStatus.GREEN:
+        time.sleep(0.5)
+
+
+def run_queries(client, name: str, queries, k: int, params: SearchParams):
+    latencies, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        response = client.query_points(collection_name=name, query=query, limit=k, search_params=params)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        results.append([p.id for p in response.points])
+    latencies.sort()
+    return results, latencies[len(latencies) // 2], latencies[max(0, int(len(latencies) * 0.99) - 1)]
+
+
+def recall(results, truth, k: int) -> float:
+    return sum(len(set(r) & set(t)) for r, t in zip(results, truth)) / (k * len(truth))
+
+
+async def embed(texts, batch_size: int = 128):
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        embeddings.extend(await rag_service.embed_texts(texts[start:start + batch_size]))
+    return embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qdrant_url", type=str, default="http://localhost:6333")
+    parser.add_argument("--modes", type=str, nargs="+", default=list(MODES), choices=list(MODES))
+    parser.add_argument("--chunk_size", type=int, default=512)
+    parser.add_argument("--max_chunks", type=int, default=0, help="0 = all chunks")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query_words", type=int, default=12)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--oversampling", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark collections")
+    parser.add_argument("--output", type=str, default="", help="Also write results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    chunks = load_chunks(args.chunk_size, args.max_chunks)
+    sampled = rng.sample(chunks, min(args.queries, len(chunks)))
+    query_texts = [" ".join(text.split()[:args.query_words]) for _, text in sampled]
+    print(f"Embedding {len(chunks)} chunks and {len(query_texts)} queries...")
+    vectors = asyncio.run(embed([text for _, text in chunks]))
+    queries = asyncio.run(embed(query_texts))
+
+    points = [
+        PointStruct(id=i, vector=vector, payload={"file_name": file_name, "text": text})
+        for i, ((file_name, text), vector) in enumerate(zip(chunks, vectors))
+    ]
+    payload_bytes = sum(len(json.dumps(p.payload).encode("utf-8")) for p in points)
+
+    client = qdrant_client.QdrantClient(url=args.qdrant_url, timeout=60)
+    baseline = "bench_quant_float32"
+    create(client, baseline, "float32", points)
+    truth, _, _ = run_queries(client, baseline, queries, args.k, SearchParams(exact=True))
+
+    rows = []
+    for mode in args.modes:
+        datatype, quantization, on_disk, on_disk_payload, rescore = MODES[mode]
+        name = f"bench_quant_{mode.replace('-', '_')}"
+        if name != baseline:
+            create(client, name, mode, points)
+        params = search_params(rescore=rescore, oversampling=args.oversampling)
+        results, p50, p99 = run_queries(client, name, queries, args.k, params)
+        rows.append({
+            "mode": mode,
+            "ram_mb": estimated_ram_bytes(
+                len(points), payload_bytes, datatype, quantization, on_disk, on_disk_payload
+            ) / 2**20,
+            "p50_ms": p50,
+            "p99_ms": p99,
+            "recall": recall(results, truth, args.k)
+        })
+        if name != baseline and not args.keep:
+            client.delete_collection(name)
+    if not args.keep:
+        client.delete_collection(baseline)
+
+    base_ram = estimated_ram_bytes(len(points), payload_bytes, "float32", "none", False, False) / 2**20
+    print(f"{len(points)} chunks, {len(queries)} queries, k={args.k}, oversampling={args.oversampling}")
+    print(f"{'mode':<16}{'est. RAM MB':>13}{'vs f32':>9}{'p50 ms':>10}{'p99 ms':>10}{f'recall@{args.k}':>11}")
+    for row in rows:
+        print(f"{row['mode']:<16}{row['ram_mb']:>13.2f}{row['ram_mb'] / base_ram:>8.0%} "
+              f"{row['p50_ms']:>9.2f}{row['p99_ms']:>10.2f}{row['recall']:>11.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"chunks": len(points), "queries": len(queries), "k": args.k, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Micro-benchmark: per-query overhead of the RAGService retrieval paths.
+
+Compares, against an in-memory Qdrant collection (no network, no TEI):
+  - baseline: VectorStoreIndex + retriever + postprocessor rebuilt on every query (old code path)
+  - llamaindex: persistent vector store / postprocessor, k and MMR passed per call
+  - qdrant: direct AsyncQdrantClient query, payload fields only (RAG_RETRIEVAL_MODE=qdrant)
+
+Usage (from backend/):
+    python benchmarks/bench_retrieval_overhead.py --points 2000 --queries 300 --k 5
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("QDRANT_LOCATION", ":memory:")
+
+from llama_index.core import VectorStoreIndex, StorageContext
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode, QueryBundle
+
+from app.services.rag_service import rag_service, UniqueFilePostprocessor
+
+DIM = 384
+
+
+def _random_vector(rng: random.Random):
+    return [rng.uniform(-1.0, 1.0) for _ in range(DIM)]
+
+
+async def seed(points: int, files: int, rng: random.Random):
+    nodes = [
+        TextNode(
+            text=" ".join(f"token{rng.randint(0, 5000)}" for _ in range(120)),
+            metadata={"file_name": f"doc_{i % files}.pdf", "page_label": str(i % 30 + 1)},
+            embedding=_random_vector(rng)
+        )
+        for i in range(points)
+    ]
+    await rag_service.vector_store.async_add(nodes)
+
+
+async def baseline(query_text, embedding, k):
+    # The pre-change RAGService.query body (minus the embedding call)
+    index = VectorStoreIndex.from_vector_store(
+        rag_service.vector_store,
+        storage_context=StorageContext.from_defaults(vector_store=rag_service.vector_store),
+        embed_model=MockEmbedding(embed_dim=DIM)
+    )
+    retriever = index.as_retriever(similarity_top_k=k * 4, vector_store_query_mode="mmr", mmr_threshold=0.7)
+    nodes = await retriever.aretrieve(QueryBundle(query_str=query_text, embedding=embedding))
+    filtered = UniqueFilePostprocessor().postprocess_nodes(nodes)
+    return [{"text": n.node.get_text(), "metadata": n.node.metadata, "score": n.score} for n in filtered[:k]]
+
+
+async def persistent(query_text, embedding, k):
+    return await rag_service._retrieve(query_text, embedding, k)
+
+
+async def direct(query_text, embedding, k):
+    return await rag_service._retrieve_direct(embedding, k)
+
+
+async def measure(name, fn, queries, k):
+    # Warm-up
+    for q in queries[:10]:
+        await fn("query", q, k)
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        await fn("query", q, k)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return {
+        "path": name,
+        "mean_us": statistics.fmean(samples),
+        "p50_us": samples[len(samples) // 2],
+        "p99_us": samples[int(len(samples) * 0.99) - 1],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=2000)
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    await seed(args.points, args.files, rng)
+    queries = [_random_vector(rng) for _ in range(args.queries)]
+
+    results = [
+        await measure("baseline (rebuild per query)", baseline, queries, args.k),
+        await measure("llamaindex (persistent)", persistent, queries, args.k),
+        await measure("qdrant (direct)", direct, queries, args.k),
+    ]
+
+    # The in-memory search itself dominates absolute numbers; the deltas are the overhead.
+    base = results[0]["mean_us"]
+    print(f"{args.points} points, {args.queries} queries, k={args.k}")
+    print(f"{'path':<32}{'mean us':>12}{'p50 us':>12}{'p99 us':>12}{'vs baseline':>14}")
+    for r in results:
+        print(f"{r['path']:<32}{r['mean_us']:>12.1f}{r['p50_us']:>12.1f}{r['p99_us']:>12.1f}{r['mean_us'] - base:>+14.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+"""
+Sweep: HNSW build (m, ef_construct) and search (hnsw_ef) parameters against exact search.
+
+Every (m, ef_construct) pair gets its own temporary collection with the same points;
+each is queried with every hnsw_ef value through the RAGService search params. Recall@k
+is measured against exact (brute-force) search, and the table marks the Pareto
+frontier: settings for which no other setting has recall at least as high with
+p50 and p99 latency at least as low.
+
+The fixed query set is the opening words of randomly sampled chunks of the bundled
+source documents (see bench_quantization.py); --cache stores the embeddings so
+reruns need neither the embedding service nor pypdf. --synthetic N uses N random
+vectors instead (no documents at all), for trying larger collections.
+
+Needs a local Qdrant server (in-memory mode always searches exactly), e.g.
+    docker run -p 6333:6333 qdrant/qdrant
+
+Usage (from backend/):
+    EMBEDDINGS_SERVICE_URL=http://localhost:8082/v1 \\
+        python benchmarks/sweep_hnsw.py --cache /tmp/vellum_embeddings.npz \\
+        --m 8 16 32 --ef_construct 64 128 --hnsw_ef 16 32 64 128 --k 5
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("QDRANT_LOCATION", ":memory:")
+
+import qdrant_client
+from qdrant_client.http.models import CollectionStatus, OptimizersConfigDiff, PointStruct, SearchParams
+
+from app.services.qdrant_params import hnsw_config, search_params, vector_params
+from bench_quantization import DIM, embed, load_chunks, recall, run_queries
+
+
+def corpus(args):
+    """(point vectors, query vectors) as float32 arrays."""
+    rng = random.Random(args.seed)
+    if args.synthetic:
+        gen = np.random.default_rng(args.seed)
+        return gen.standard_normal((args.synthetic, DIM)), gen.standard_normal((args.queries, DIM))
+    if args.cache and os.path.exists(args.cache):
+        cached = np.load(args.cache)
+        return cached["vectors"], cached["queries"]
+
+    chunks = load_chunks(args.chunk_size, 0)
+    sampled = rng.sample(chunks, min(args.queries, len(chunks)))
+    query_texts = [" ".join(text.split()[:args.query_words]) for _, text in sampled]
+    print(f"Embedding {len(chunks)} chunks and {len(query_texts)} queries...")
+    vectors = np.asarray(asyncio.run(embed([text for _, text in chunks])), dtype=np.float32)
+    queries = np.asarray(asyncio.run(embed(query_texts)), dtype=np.float32)
+    if args.cache:
+        np.savez(args.cache, vectors=vectors, queries=queries)
+    return vectors, queries
+
+
+def build(client, name: str, vectors, m: int, ef_construct: int):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+    client.create_collection(
+        collection_name=name,
+        vectors_config=vector_params(DIM),
+        hnsw_config=hnsw_config(m, ef_construct),
+        # Index even small collections (Qdrant's default threshold would keep ours a plain segment)
+        optimizers_config=OptimizersConfigDiff(indexing_threshold=1)
+    )
+    points = [PointStruct(id=i, vector=v.tolist()) for i, v in enumerate(vectors)]
+    for start in range(0, len(points), 256):
+        client.upsert(collection_name=name, points=points[start:start + 256], wait=True)
+    while client.get_collection(name).status != CollectionStatus.GREEN:
+        time.sleep(0.5)
+
+
+def pareto(rows):
+    """Mark rows not dominated on (recall up, p50 down, p99 down)."""
+    for row in rows:
+        row["pareto"] = not any(
+            other["recall"] >= row["recall"] and other["p50_ms"] <= row["p50_ms"] and other["p99_ms"] <= row["p99_ms"]
+            and (other["recall"], -other["p50_ms"], -other["p99_ms"]) != (row["recall"], -row["p50_ms"], -row["p99_ms"])
+            for other in rows
+        )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--qdrant_url", type=str, default="http://localhost:6333")
+    parser.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef_construct", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--hnsw_ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--query_words", type=int, default=12)
+    parser.add_argument("--chunk_size", type=int, default=512)
+    parser.add_argument("--synthetic", type=int, default=0, help="Use N random vectors instead of the documents")
+    parser.add_argument("--cache", type=str, default="", help="npz file to store/reuse the embeddings")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the query set per setting")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--frontier_only", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="Keep the sweep collections")
+    args = parser.parse_args()
+
+    vectors, queries = corpus(args)
+    query_lists = [q.tolist() for q in queries] * args.repeats
+    client = qdrant_client.QdrantClient(url=args.qdrant_url, timeout=60)
+
+    rows, truth = [], None
+    for m in args.m:
+        for ef_construct in args.ef_construct:
+            name = f"sweep_hnsw_m{m}_ef{ef_construct}"
+            print(f"Building {name} ({len(vectors)} points)...")
+            build(client, name, vectors, m, ef_construct)
+            if truth is None:
+                truth, p50, p99 = run_queries(client, name, query_lists, args.k, SearchParams(exact=True))
+                rows.append({"setting": "exact", "p50_ms": p50, "p99_ms": p99, "recall": 1.0})
+            for ef in args.hnsw_ef:
+                results, p50, p99 = run_queries(client, name, query_lists, args.k, search_params(hnsw_ef=ef, exact=False))
+                rows.append({
+                    "setting": f"m={m} ef_construct={ef_construct} hnsw_ef={ef}",
+                    "p50_ms": p50,
+                    "p99_ms": p99,
+                    "recall": recall(results, truth, args.k)
+                })
+            if not args.keep:
+                client.delete_collection(name)
+
+    rows = pareto(rows)
+    shown = [r for r in rows if r["pareto"]] if args.frontier_only else rows
+    print(f"{len(vectors)} points, {len(queries)} queries x {args.repeats}, k={args.k}  (* = Pareto frontier)")
+    print(f"{'setting':<40}{'p50 ms':>10}{'p99 ms':>10}{f'recall@{args.k}':>11}")
+    for row in sorted(shown, key=lambda r: (-r["recall"], r["p50_ms"])):
+        marker = "*" if row["pareto"] else " "
+        print(f"{marker} {row['setting']:<38}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['recall']:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Runs the FastAPI app from main.py against the load-test stand-ins.
+
+Qdrant is in-memory (QDRANT_LOCATION=:memory:) and seeded, in this process, from
+data/source_documents: documents are chunked like ingestion and embedded through the
+fake embedding server. The fake LLM is registered as the active model. Any other
+backend setting can be passed through the environment (e.g. RAG_RETRIEVAL_MODE=qdrant).
+
+PDFs need llama-index-readers-file and pypdf; without them only the text documents
+are used. --replicas copies the corpus under distinct file names for a larger collection.
+
+Usage (from backend/):
+    python -m loadtest.backend --port 18000 \\
+        --embeddings_url http://127.0.0.1:18082/v1 --llm_url http://127.0.0.1:18083/v1
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+DOCS_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "source_documents")
+LOADTEST_MODEL_ID = "loadtest-llm"
+
+
+def load_documents(docs_dir: str):
+    from llama_index.core import SimpleDirectoryReader
+    try:
+        import llama_index.readers.file  # noqa: F401  (PDF parsing)
+        import pypdf  # noqa: F401
+        exclude = None
+    except ImportError:
+        # Without the file readers SimpleDirectoryReader would index raw PDF bytes
+        print("WARNING: llama-index-readers-file / pypdf not installed; seeding from non-PDF documents only")
+        exclude = ["*.pdf"]
+    return SimpleDirectoryReader(docs_dir, exclude=exclude).load_data()
+
+
+async def seed(docs_dir: str, chunk_size: int, replicas: int) -> int:
+    from llama_index.core.node_parser import SentenceSplitter
+    from llama_index.core.schema import TextNode
+    from app.core.config import settings
+    from app.services.qdrant_params import text_payload_updates
+    from app.services.rag_service import rag_service
+
+    nodes = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=20).get_nodes_from_documents(
+        load_documents(docs_dir)
+    )
+    texts = [node.get_content() for node in nodes]
+    embeddings = []
+    for start in range(0, len(texts), 128):
+        embeddings.extend(await rag_service.embed_texts(texts[start:start + 128]))
+
+    seeded = [
+        TextNode(
+            text=text,
+            metadata={
+                **node.metadata,
+                "file_name": node.metadata.get("file_name") if replica == 0
+                else f"replica{replica}/{node.metadata.get('file_name')}"
+            },
+            embedding=embedding
+        )
+        for replica in range(replicas)
+        for node, text, embedding in zip(nodes, texts, embeddings)
+    ]
+    for start in range(0, len(seeded), 512):
+        batch = seeded[start:start + 512]
+        await rag_service.vector_store.async_add(batch)
+        # Flat "text" payload, as written by ingestion
+        await rag_service.aclient.batch_update_points(
+            collection_name=settings.QDRANT_COLLECTION, update_operations=text_payload_updates(batch)
+        )
+    return len(seeded)
+
+
+def register_llm(llm_url: str):
+    from app.api.endpoints.admin import MODEL_CONFIGS
+    from app.models.schemas import ModelConfig
+
+    for config in MODEL_CONFIGS:
+        config.is_active = False
+    MODEL_CONFIGS.append(ModelConfig(
+        id=LOADTEST_MODEL_ID, name="Load-test LLM", provider="kubeflow", base_url=llm_url, is_active=True
+    ))
+
+
+async def serve(args):
+    import uvicorn
+
+    os.environ["QDRANT_LOCATION"] = ":memory:"
+    os.environ["EMBEDDINGS_SERVICE_URL"] = args.embeddings_url
+    os.environ.setdefault("BYPASS_AUTH", "True")
+
+    from main import app
+
+    register_llm(args.llm_url)
+    started = time.perf_counter()
+    points = await seed(args.docs_dir, args.chunk_size, args.replicas)
+    print(f"Seeded {points} chunks in {time.perf_counter() - started:.1f}s")
+
+    config = uvicorn.Config(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+    await uvicorn.Server(config).serve()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--embeddings_url", type=str, default="http://127.0.0.1:18082/v1")
+    parser.add_argument("--llm_url", type=str, default="http://127.0.0.1:18083/v1")
+    parser.add_argument("--docs_dir", type=str, default=DOCS_DIR)
+    parser.add_argument("--chunk_size", type=int, default=512)
+    parser.add_argument("--replicas", type=int, default=1)
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,157 @@
+"""
+OpenAI-compatible stand-ins for the embedding service (TEI) and the LLM.
+
+- POST /v1/embeddings: deterministic hashed bag-of-words vectors (texts sharing words
+  get similar vectors, so retrieval over the seeded collection behaves sensibly),
+  after a configurable latency.
+- POST /v1/chat/completions: a fixed-length answer, streamed (SSE) at a configurable
+  token rate after a configurable time-to-first-token, or returned whole.
+
+Usage (from backend/):
+    python -m loadtest.fakes --embed_port 18082 --llm_port 18083 --llm_tokens_per_second 50
+"""
+import re
+import time
+import json
+import uuid
+import base64
+import asyncio
+import hashlib
+import argparse
+from typing import List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+_WORD = re.compile(r"\w+")
+
+
+def hashed_embedding(text: str, dim: int) -> np.ndarray:
+    """Unit-norm signed feature hashing of the lowercased words of `text`."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in _WORD.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+def create_embedding_app(latency_ms: float, per_text_ms: float, dim: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts: List[str] = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep((latency_ms + per_text_ms * len(texts)) / 1000.0)
+        data = []
+        for i, text in enumerate(texts):
+            vector = hashed_embedding(text, dim)
+            # The OpenAI SDK asks for base64 unless told otherwise
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        }
+
+    return app
+
+
+def create_llm_app(ttft_ms: float, tokens_per_second: float, response_tokens: int) -> FastAPI:
+    app = FastAPI()
+    interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-llm")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        tokens = [f"token{i} " for i in range(response_tokens)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(ttft_ms / 1000.0 + interval * response_tokens)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": response_tokens, "total_tokens": response_tokens}
+            }
+
+        def chunk(delta, finish_reason=None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            await asyncio.sleep(ttft_ms / 1000.0)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(interval)
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+async def serve(args):
+    servers = [
+        uvicorn.Server(uvicorn.Config(
+            create_embedding_app(args.embed_latency_ms, args.embed_per_text_ms, args.embed_dim),
+            host=args.host, port=args.embed_port, log_level="warning"
+        )),
+        uvicorn.Server(uvicorn.Config(
+            create_llm_app(args.llm_ttft_ms, args.llm_tokens_per_second, args.llm_tokens),
+            host=args.host, port=args.llm_port, log_level="warning"
+        ))
+    ]
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--embed_port", type=int, default=18082)
+    parser.add_argument("--embed_latency_ms", type=float, default=5.0)
+    parser.add_argument("--embed_per_text_ms", type=float, default=0.5)
+    parser.add_argument("--embed_dim", type=int, default=384)
+    parser.add_argument("--llm_port", type=int, default=18083)
+    parser.add_argument("--llm_ttft_ms", type=float, default=200.0)
+    parser.add_argument("--llm_tokens_per_second", type=float, default=50.0)
+    parser.add_argument("--llm_tokens", type=int, default=64)
+    asyncio.run(serve(parser.parse_args()))
@@ -0,0 +1,261 @@
+"""
+Load test: drives /chat (or /chat/stream) at a fixed concurrency and reports RPS,
+latency percentiles and time-to-first-token.
+
+Starts the stand-ins (loadtest.fakes) and the backend (loadtest.backend) as
+subprocesses, waits until they are healthy, runs a closed loop of `--concurrency`
+workers for `--duration` seconds (or `--requests` requests) after a warm-up, and
+writes the results to a JSON file. --base_url drives an already running backend
+instead (nothing is started).
+
+Queries cycle through the golden-set queries (kubeflow/pipelines/ingestion/scripts/
+golden_set.jsonl) or --queries_file (JSONL with "query", or plain text lines). The
+semantic answer cache is disabled unless --answer_cache is given, so every request
+exercises the full pipeline; identical concurrent requests are still coalesced.
+
+Usage (from backend/):
+    python -m loadtest.run --concurrency 32 --duration 30 --stream \\
+        --llm_tokens_per_second 50 --embed_latency_ms 5 --output loadtest-results.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import datetime
+import statistics
+import subprocess
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_QUERIES = os.path.join(
+    BACKEND_DIR, "..", "kubeflow", "pipelines", "ingestion", "scripts", "golden_set.jsonl"
+)
+
+
+def load_queries(path: str) -> List[str]:
+    queries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+    return {
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "mean": round(statistics.fmean(values), 2),
+        "max": round(values[-1], 2)
+    }
+
+
+class Stats:
+    def __init__(self):
+        self.latencies_ms: List[float] = []
+        self.ttft_ms: List[float] = []
+        self.outcomes: Counter = Counter()
+
+    def record(self, outcome: str, latency_ms: float, ttft_ms: Optional[float] = None):
+        self.outcomes[outcome] += 1
+        if outcome == "ok":
+            self.latencies_ms.append(latency_ms)
+            if ttft_ms is not None:
+                self.ttft_ms.append(ttft_ms)
+
+
+async def chat_once(client: httpx.AsyncClient, message: str, stream: bool, stats: Stats):
+    body = {"message": message}
+    started = time.perf_counter()
+    try:
+        if not stream:
+            response = await client.post("/api/v1/chat", json=body)
+            outcome = "ok" if response.status_code == 200 else f"http_{response.status_code}"
+            stats.record(outcome, (time.perf_counter() - started) * 1000.0)
+            return
+
+        ttft = None
+        outcome = "incomplete"
+        async with client.stream("POST", "/api/v1/chat/stream", json=body) as response:
+            if response.status_code != 200:
+                await response.aread()
+                stats.record(f"http_{response.status_code}", (time.perf_counter() - started) * 1000.0)
+                return
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                frame = json.loads(line)
+                if frame["type"] == "token" and ttft is None:
+                    ttft = (time.perf_counter() - started) * 1000.0
+                elif frame["type"] == "done":
+                    outcome = "ok"
+                elif frame["type"] == "error":
+                    outcome = "stream_error"
+        stats.record(outcome, (time.perf_counter() - started) * 1000.0, ttft)
+    except httpx.HTTPError as e:
+        stats.record(type(e).__name__, (time.perf_counter() - started) * 1000.0)
+
+
+async def drive(args, base_url: str, queries: List[str]) -> Dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        warmup = Stats()
+        await asyncio.gather(*(
+            chat_once(client, queries[i % len(queries)], args.stream, warmup) for i in range(args.warmup)
+        ))
+
+        stats = Stats()
+        counter = iter(range(sys.maxsize))
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            while True:
+                i = next(counter)
+                if (args.requests and i >= args.requests) or (not args.requests and time.perf_counter() >= deadline):
+                    return
+                await chat_once(client, queries[i % len(queries)], args.stream, stats)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    completed = sum(stats.outcomes.values())
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "requests": completed,
+        "outcomes": dict(stats.outcomes),
+        "rps": round(stats.outcomes["ok"] / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(1 - stats.outcomes["ok"] / completed, 4) if completed else 0.0,
+        "latency_ms": percentiles(stats.latencies_ms),
+        "ttft_ms": percentiles(stats.ttft_ms) if args.stream else None,
+        "warmup_outcomes": dict(warmup.outcomes)
+    }
+
+
+def wait_healthy(url: str, procs: List[subprocess.Popen], timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for proc in procs:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{' '.join(proc.args)} exited with code {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise TimeoutError(f"{url} not healthy after {timeout:.0f}s")
+
+
+def start_stack(args) -> List[subprocess.Popen]:
+    host = "127.0.0.1"
+    fakes = subprocess.Popen([
+        sys.executable, "-m", "loadtest.fakes",
+        "--host", host,
+        "--embed_port", str(args.embed_port),
+        "--embed_latency_ms", str(args.embed_latency_ms),
+        "--llm_port", str(args.llm_port),
+        "--llm_ttft_ms", str(args.llm_ttft_ms),
+        "--llm_tokens_per_second", str(args.llm_tokens_per_second),
+        "--llm_tokens", str(args.llm_tokens)
+    ], cwd=BACKEND_DIR)
+    procs = [fakes]
+    wait_healthy(f"http://{host}:{args.embed_port}/health", procs, 30)
+    wait_healthy(f"http://{host}:{args.llm_port}/health", procs, 30)
+
+    env = {**os.environ, "ANSWER_CACHE_ENABLED": str(args.answer_cache)}
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    backend = subprocess.Popen([
+        sys.executable, "-m", "loadtest.backend",
+        "--host", host,
+        "--port", str(args.port),
+        "--embeddings_url", f"http://{host}:{args.embed_port}/v1",
+        "--llm_url", f"http://{host}:{args.llm_port}/v1",
+        "--replicas", str(args.replicas)
+    ], cwd=BACKEND_DIR, env=env)
+    procs.append(backend)
+    # /ready flips once the backend has finished its warm-up
+    wait_healthy(f"http://{host}:{args.port}/ready", procs, args.startup_timeout)
+    return procs
+
+
+def stop_stack(procs: List[subprocess.Popen]):
+    for proc in reversed(procs):
+        if proc.poll() is None:
+            proc.terminate()
+    for proc in reversed(procs):
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds (ignored with --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="Total requests instead of a duration")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--stream", action="store_true", help="Use /chat/stream (measures time-to-first-token)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--queries_file", type=str, default=DEFAULT_QUERIES)
+    parser.add_argument("--output", type=str, default="", help="Results JSON (default: loadtest-<timestamp>.json)")
+    parser.add_argument("--base_url", type=str, default="", help="Drive a running backend instead of starting one")
+    # Stand-ins and backend
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--embed_port", type=int, default=18082)
+    parser.add_argument("--embed_latency_ms", type=float, default=5.0)
+    parser.add_argument("--llm_port", type=int, default=18083)
+    parser.add_argument("--llm_ttft_ms", type=float, default=200.0)
+    parser.add_argument("--llm_tokens_per_second", type=float, default=50.0)
+    parser.add_argument("--llm_tokens", type=int, default=64)
+    parser.add_argument("--replicas", type=int, default=1, help="Copies of the seeded corpus")
+    parser.add_argument("--answer_cache", action="store_true", help="Keep the semantic answer cache enabled")
+    parser.add_argument("--env", type=str, nargs="*", default=[], help="Extra backend settings, KEY=VALUE")
+    parser.add_argument("--startup_timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries_file)
+    procs = [] if args.base_url else start_stack(args)
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    try:
+        results = asyncio.run(drive(args, base_url, queries))
+    finally:
+        stop_stack(procs)
+
+    report = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results
+    }
+    output = args.output or f"loadtest-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency, ttft = results["latency_ms"], results["ttft_ms"]
+    print(f"{results['requests']} requests in {results['elapsed_s']}s at concurrency {args.concurrency}: "
+          f"{results['rps']} RPS, outcomes {results['outcomes']}")
+    print(f"latency ms  p50={latency['p50']} p95={latency['p95']} p99={latency['p99']}")
+    if ttft:
+        print(f"TTFT ms     p50={ttft['p50']} p95={ttft['p95']} p99={ttft['p99']}")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,26 @@
-from fastapi import FastAPI
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 from app.core.config import settings
+from app.core.profiler import ProfilerMiddleware, profiler
+from app.services.warmup import warmup_service
 
 load_dotenv()
 
-app = FastAPI(title="Vellum Chatbot API", description="Backend for Vellum Enterprise Chatbot")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up runs in the background so /health answers (and the pod stays live) meanwhile
+    warmup = asyncio.create_task(warmup_service.run())
+    yield
+    warmup.cancel()
+
+app = FastAPI(title="Vellum Chatbot API", description="Backend for Vellum Enterprise Chatbot", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,11 +31,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets the frontend read the per-request stage breakdown
+    expose_headers=["Server-Timing"],
 )
+# Sampling profiler for /admin/profiles; passes requests straight through unless armed
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
 
 from app.api.api import api_router
+from app.api.endpoints import metrics
+
+warmup_service.record_import("app", time.perf_counter() - _import_started)
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+# Prometheus scrape endpoint at the conventional root path (unauthenticated, like /health)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
@@ -30,3 +53,10 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """Readiness probe: 503 until the startup warm-up has finished. Reports import and warm-up timings."""
+    if not warmup_service.ready:
+        response.status_code = 503
+    return warmup_service.status()
@@ -1,5 +1,6 @@
+import json
 import pytest
-from unittest.mock import patch, MagicMock, AsyncMock
+from unittest.mock import patch, MagicMock, AsyncMock, ANY
 from fastapi.testclient import TestClient
 from main import app
 from app.api.endpoints.admin import MODEL_CONFIGS
@@ -16,6 +17,18 @@ def test_health_check():
     assert response.status_code == 200
     assert response.json() == {"status": "healthy"}
 
+def test_ready_waits_for_warmup():
+    from app.services.warmup import warmup_service
+    # The lifespan (and so the warm-up) only runs when the client is used as a context manager
+    response = client.get("/ready")
+    assert response.status_code == 503
+    assert response.json()["imports_ms"]["app"] > 0
+    # /health does not wait for it
+    assert client.get("/health").status_code == 200
+
+    with patch.object(warmup_service, "ready", True):
+        assert client.get("/ready").status_code == 200
+
 @patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
 @patch("app.api.endpoints.chat.llm_service.chat", new_callable=AsyncMock)
 @patch("app.services.history_service.history_service.get_messages")
@@ -37,9 +50,268 @@ def test_chat_endpoint(mock_get_msgs, mock_chat, mock_query):
     assert data["response"] == "Test response"
     assert len(data["citations"]) == 1
     assert data["session_id"] is None # Should NOT generate a new one if not provided
+    assert data["metadata"]["context_tokens"] > 0
     
     mock_chat.assert_called_once()
-    mock_query.assert_called_with("Hello", k=3)
+    mock_query.assert_called_with("Hello", k=3, embedding=ANY)
+
+@patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service.stream_chat")
+def test_chat_stream_endpoint(mock_stream, mock_query):
+    mock_query.return_value = [{"text": "context", "metadata": {"file_name": "test.pdf", "page_label": "1"}, "score": 0.9}]
+
+    async def fake_stream(messages, model_id=None):
+        for token in ["Hello", " world"]:
+            yield token
+    mock_stream.side_effect = fake_stream
+
+    response = client.post("/api/v1/chat/stream", json={"message": "Hello", "session_id": "s1"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    frames = [json.loads(line) for line in response.text.splitlines()]
+    # Citations first, then tokens, then a final frame with the full text
+    assert frames[0]["type"] == "citations"
+    assert frames[0]["citations"][0]["source"] == "test.pdf"
+    assert [f["content"] for f in frames if f["type"] == "token"] == ["Hello", " world"]
+    done = frames[-1]
+    assert (done["type"], done["response"], done["session_id"]) == ("done", "Hello world", "s1")
+    assert done["metadata"]["prompt_tokens"] > 0
+
+@patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service.chat", new_callable=AsyncMock)
+def test_chat_session_history(mock_chat, mock_query):
+    from app.services.history_service import CONVERSATIONS
+    mock_query.return_value = []
+    mock_chat.return_value = "Second answer"
+    CONVERSATIONS.pop("hist-1", None)
+
+    client.post("/api/v1/chat", json={"message": "First question", "session_id": "hist-1"})
+    data = client.post("/api/v1/chat", json={"message": "Follow-up", "session_id": "hist-1"}).json()
+
+    # The second prompt carries the first turn, loaded from the server-side session
+    messages = mock_chat.call_args.args[0]
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+    assert messages[1]["content"] == "First question"
+    assert data["metadata"]["history"]["recent_messages"] == 2
+    assert len(CONVERSATIONS["hist-1"]["messages"]) == 4
+    CONVERSATIONS.pop("hist-1", None)
+
+@patch("app.api.endpoints.chat.rag_service.collection_generation", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.rag_service.embed_query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service.chat", new_callable=AsyncMock)
+def test_chat_answer_cache(mock_chat, mock_query, mock_embed, mock_generation):
+    from app.services.answer_cache import answer_cache
+    answer_cache.invalidate()
+    mock_generation.return_value = (0, 10)
+    mock_query.return_value = [{"text": "context", "metadata": {"file_name": "test.pdf", "page_label": "1"}, "score": 0.9}]
+    mock_chat.return_value = "Cached answer"
+
+    # Second query is a near-duplicate of the first
+    mock_embed.side_effect = [[1.0, 0.0, 0.0], [0.999, 0.01, 0.0]]
+    first = client.post("/api/v1/chat", json={"message": "What is RAG?"})
+    second = client.post("/api/v1/chat", json={"message": "what is rag"})
+
+    assert first.json()["response"] == second.json()["response"] == "Cached answer"
+    assert second.json()["metadata"]["cache"]["hit"] is True
+    assert second.json()["citations"][0]["source"] == "test.pdf"
+    mock_chat.assert_called_once()
+
+    # A new collection generation invalidates the cached answer
+    mock_generation.return_value = (1, 42)
+    mock_embed.side_effect = [[1.0, 0.0, 0.0]]
+    client.post("/api/v1/chat", json={"message": "What is RAG?"})
+    assert mock_chat.call_count == 2
+    answer_cache.invalidate()
+
+@patch("app.api.endpoints.chat.rag_service.collection_generation", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.rag_service.embed_query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service.chat", new_callable=AsyncMock)
+def test_chat_answer_cache_separates_compression_modes(mock_chat, mock_query, mock_embed, mock_generation):
+    from app.services.answer_cache import answer_cache
+    answer_cache.invalidate()
+    mock_generation.return_value = (0, 10)
+    mock_query.return_value = [{"text": "context", "metadata": {"file_name": "test.pdf"}, "score": 0.9}]
+    mock_chat.return_value = "Answer"
+    mock_embed.return_value = [1.0, 0.0, 0.0]
+
+    with patch("app.api.endpoints.chat.compress_citations", AsyncMock(side_effect=RuntimeError("TEI down"))):
+        plain = client.post("/api/v1/chat", json={"message": "What is RAG?", "compress": False})
+        # A compressed request never gets the uncompressed answer, and a failed
+        # compression is not cached as a compressed one
+        failed = client.post("/api/v1/chat", json={"message": "What is RAG?", "compress": True})
+        retried = client.post("/api/v1/chat", json={"message": "What is RAG?", "compress": True})
+    again = client.post("/api/v1/chat", json={"message": "What is RAG?", "compress": False})
+
+    assert "cache" not in plain.json()["metadata"]
+    assert failed.json()["metadata"]["compression"] == {"skipped": "error"}
+    assert "cache" not in retried.json()["metadata"]
+    assert again.json()["metadata"]["cache"]["hit"] is True
+    assert mock_chat.call_count == 3
+    answer_cache.invalidate()
+
+@patch("app.api.endpoints.chat.rag_service.embed_query", new_callable=AsyncMock)
+def test_chat_admission_rejects_when_saturated(mock_embed):
+    from app.core.admission import AdmissionController
+
+    with patch("app.api.endpoints.chat.chat_admission", AdmissionController(max_in_flight=0, max_queue=0)):
+        response = client.post("/api/v1/chat", json={"message": "Hello"})
+        stream = client.post("/api/v1/chat/stream", json={"message": "Hello"})
+
+    assert response.status_code == stream.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Rejected before any retrieval work
+    mock_embed.assert_not_called()
+
+def test_chat_admission_priority_from_token_claims():
+    from jose import jwt
+    from app.core.admission import AdmissionRejected
+
+    acquire = AsyncMock(side_effect=AdmissionRejected("Server busy", retry_after=1))
+    forged = jwt.encode({"roles": ["admin"]}, "secret")
+
+    async def verify(token):
+        if token != "verified":
+            raise jwt.JWTError("Signature verification failed")
+        return {"roles": ["Vellum.User"]}
+
+    with patch("app.core.config.settings.BYPASS_AUTH", False), \
+         patch("app.core.config.settings.AUTH_ROLE_MAP", {"admin": "admin", "Vellum.User": "interactive"}), \
+         patch("app.api.endpoints.chat.chat_admission.acquire", acquire):
+        # No tenant configured: unverified claims never raise the priority
+        client.post("/api/v1/chat", json={"message": "Hello"}, headers={"Authorization": f"Bearer {forged}"})
+        with patch("app.core.config.settings.AZURE_TENANT_ID", "tenant"), \
+             patch("app.core.config.settings.AZURE_CLIENT_ID", "client"), \
+             patch("app.core.auth.verify_token", verify):
+            client.post("/api/v1/chat", json={"message": "Hello"}, headers={"Authorization": "Bearer verified"})
+            rejected = client.post("/api/v1/chat", json={"message": "Hello"}, headers={"Authorization": f"Bearer {forged}"})
+
+    assert [call.args[0] for call in acquire.await_args_list] == ["batch", "interactive"]
+    assert rejected.status_code == 401
+
+@patch("app.api.endpoints.chat.rag_service.embed_query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service.chat", new_callable=AsyncMock)
+def test_chat_compression_failure_falls_back(mock_chat, mock_query, mock_embed):
+    from app.core.metrics import DEPENDENCY_ERRORS
+    mock_embed.return_value = [1.0, 0.0]
+    mock_query.return_value = [{"text": "First sentence. Second sentence.", "metadata": {"file_name": "a.pdf"}, "score": 0.9}]
+    mock_chat.return_value = "Uncompressed answer"
+    errors = DEPENDENCY_ERRORS.labels("tei", "embed_batch")
+    before = errors._value.get()
+
+    fake_settings = MagicMock()
+    fake_settings.embed_model.aget_text_embedding_batch = AsyncMock(side_effect=ConnectionError("TEI down"))
+    with patch("app.services.rag_service.Settings", fake_settings):
+        response = client.post("/api/v1/chat", json={"message": "Compress this", "compress": True})
+
+    assert response.status_code == 200
+    assert response.json()["metadata"]["compression"] == {"skipped": "error"}
+    # The full chunk text reached the prompt
+    assert "First sentence. Second sentence." in mock_chat.call_args.args[0][0]["content"]
+    assert errors._value.get() == before + 1
+
+@patch("app.api.endpoints.chat.rag_service._candidates", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service._chat", new_callable=AsyncMock)
+def test_chat_server_timing(mock_llm, mock_candidates):
+    mock_candidates.return_value = [
+        {"text": f"context {i}", "metadata": {"file_name": f"doc{i}.pdf"}, "score": 0.9 - i / 10} for i in range(3)
+    ]
+    mock_llm.return_value = "Timed response"
+
+    response = client.post("/api/v1/chat", json={"message": "How long did each stage take?", "context_window": 2})
+    assert response.status_code == 200
+    stages = [item.split(";")[0] for item in response.headers["Server-Timing"].split(", ")]
+    for stage in ("embed", "search", "postprocess", "prompt_build", "llm_total", "total"):
+        assert stage in stages
+    metadata = response.json()["metadata"]
+    assert metadata["timings_ms"]["llm_total"] >= 0
+    assert metadata["candidates"] == {"retrieved": 3, "returned": 2}
+    assert metadata["prompt_tokens"] > 0
+
+    # Opting out skips the recorder entirely
+    response = client.post(
+        "/api/v1/chat", json={"message": "And without timing?"}, headers={"X-Server-Timing": "off"}
+    )
+    assert "Server-Timing" not in response.headers
+    assert "timings_ms" not in response.json()["metadata"]
+
+@patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service.chat", new_callable=AsyncMock)
+def test_metrics_endpoint(mock_chat, mock_query):
+    mock_query.return_value = [{"text": "context", "metadata": {"file_name": "test.pdf"}, "score": 0.9}]
+    mock_chat.return_value = "Test response"
+    client.post("/api/v1/chat", json={"message": "Which stages are timed?"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    counted = {
+        line.split('stage="')[1].split('"')[0]
+        for line in body.splitlines() if line.startswith("vellum_stage_duration_seconds_count")
+    }
+    assert {"admission", "lookup", "embed", "retrieval", "prompt_build", "generation", "chat_total"} <= counted
+    assert 'provider="tei",stage="embed"' in body
+    # Service counters are exported at scrape time
+    assert "vellum_admission_in_flight 0.0" in body
+    assert 'vellum_cache_hits_total{cache="embedding"}' in body
+
+@patch("app.api.endpoints.chat.rag_service.query", new_callable=AsyncMock)
+@patch("app.api.endpoints.chat.llm_service.chat")
+def test_admin_profiles(mock_chat, mock_query):
+    import asyncio
+    mock_query.return_value = [{"text": "context", "metadata": {"file_name": "test.pdf"}, "score": 0.9}]
+
+    async def slow_chat(*args, **kwargs):
+        await asyncio.sleep(0.05)
+        return "Profiled response"
+    mock_chat.side_effect = slow_chat
+
+    assert client.post("/api/v1/admin/profiles/arm", json={}).status_code == 400
+    response = client.post("/api/v1/admin/profiles/arm", json={"requests": 1, "interval_ms": 2})
+    assert response.status_code == 200
+    assert response.json()["armed"] is True
+
+    client.post("/api/v1/chat", json={"message": "Where does the time go?"})
+    # The last counted request disarms the profiler; later requests are not captured
+    client.post("/api/v1/chat", json={"message": "Not profiled"})
+    listing = client.get("/api/v1/admin/profiles").json()
+    assert listing["armed"] is False
+    capture = listing["captures"][0]
+    assert capture["route"] == "/api/v1/chat"
+    assert capture["endpoint"] == "chat"
+    assert capture["status"] == 200
+    assert capture["model_id"]
+    assert capture["samples"] > 0
+    assert len([c for c in listing["captures"] if c["id"] >= capture["id"]]) == 1
+
+    collapsed = client.get(f"/api/v1/admin/profiles/{capture['id']}")
+    assert collapsed.headers["content-type"].startswith("text/plain")
+    assert any(line.startswith("wait;") for line in collapsed.text.splitlines())
+    speedscope = client.get(f"/api/v1/admin/profiles/{capture['id']}?format=speedscope").json()
+    assert speedscope["profiles"][0]["type"] == "sampled"
+    assert client.get("/api/v1/admin/profiles/999999").status_code == 404
+
+def test_admin_profiles_require_admin_role():
+    from app.core.auth import get_current_user
+    app.dependency_overrides[get_current_user] = lambda: {"user": "reader", "roles": []}
+    try:
+        assert client.get("/api/v1/admin/profiles").status_code == 403
+        assert client.post("/api/v1/admin/profiles/arm", json={"requests": 1}).status_code == 403
+    finally:
+        app.dependency_overrides.clear()
+
+def test_admin_profiles_reject_forged_token():
+    from jose import jwt
+    forged = {"Authorization": f"Bearer {jwt.encode({'roles': ['admin']}, 'my-secret')}"}
+    with patch("app.core.config.settings.BYPASS_AUTH", False), \
+         patch("app.core.config.settings.AUTH_ROLE_MAP", {"admin": "admin"}):
+        # No Entra ID tenant to verify against: the token is never trusted for roles
+        assert client.get("/api/v1/admin/profiles", headers=forged).status_code == 403
+        assert client.post("/api/v1/admin/profiles/arm", json={"requests": 1}, headers=forged).status_code == 403
 
 def test_chat_validation_error():
     # Missing message is 422
@@ -80,6 +352,33 @@ def test_admin_models_crud():
         # Cleanup: remove the added model
         MODEL_CONFIGS[:] = [m for m in MODEL_CONFIGS if m.id != "test-model-custom"]
 
+def test_admin_routing_policy():
+    response = client.get("/api/v1/admin/routing")
+    assert response.status_code == 200
+    default = response.json()
+
+    try:
+        policy = {**default, "primary_model_id": "gpt-4", "secondary_model_id": "gemini-1.5-flash", "max_hedge_rate": 0.2}
+        response = client.put("/api/v1/admin/routing", json=policy)
+        assert response.status_code == 200
+        assert client.get("/api/v1/admin/routing").json()["secondary_model_id"] == "gemini-1.5-flash"
+        assert client.get("/api/v1/admin/routing/stats").json()["policy"]["max_hedge_rate"] == 0.2
+
+        # Unknown models and out-of-range rates are rejected
+        assert client.put("/api/v1/admin/routing", json={**policy, "secondary_model_id": "nope"}).status_code == 400
+        assert client.put("/api/v1/admin/routing", json={**policy, "max_hedge_rate": 2}).status_code == 422
+
+        # Only admins may change the routing policy
+        from app.core.auth import get_current_user
+        app.dependency_overrides[get_current_user] = lambda: {"user": "reader", "roles": []}
+        try:
+            assert client.put("/api/v1/admin/routing", json=default).status_code == 403
+        finally:
+            app.dependency_overrides.clear()
+        assert client.get("/api/v1/admin/routing").json()["secondary_model_id"] == "gemini-1.5-flash"
+    finally:
+        client.put("/api/v1/admin/routing", json=default)
+
 @patch("app.services.history_service.history_service.get_recent_conversations")
 @patch("app.services.history_service.history_service.get_messages")
 def test_history_endpoints(mock_get_msgs, mock_get_recent):
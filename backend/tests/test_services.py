@@ -1,7 +1,7 @@
 
 import sys
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, AsyncMock, patch
 from importlib import reload
 
 # Helper to remove mocks if they exist from other tests
@@ -34,6 +34,45 @@ async def test_auth_validate_token_missing():
         with pytest.raises(HTTPException):
             await auth.get_current_user(None)
 
+@pytest.mark.asyncio
+async def test_auth_roles_from_verified_token():
+    import time
+    from app.core import auth
+    from fastapi import HTTPException
+    from jose import jwk, jwt
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    pem = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+    public = jwk.construct(pem, "RS256").public_key().to_dict()
+    keys = {"keys": [dict(public, kid="k1")]}
+    issuer = "https://login.microsoftonline.com/tenant/v2.0"
+    claims = {"aud": "client", "iss": issuer, "exp": time.time() + 60, "preferred_username": "ada",
+              "roles": ["Vellum.Admin", "admin"], "groups": ["group-batch", "group-other"]}
+    token = jwt.encode(claims, pem, algorithm="RS256", headers={"kid": "k1"})
+    forged = jwt.encode(dict(claims, roles=["admin"]), "my-secret", algorithm="HS256", headers={"kid": "k1"})
+
+    with patch("app.core.config.settings.BYPASS_AUTH", False), \
+         patch("app.core.config.settings.AZURE_TENANT_ID", "tenant"), \
+         patch("app.core.config.settings.AZURE_CLIENT_ID", "client"), \
+         patch("app.core.config.settings.AUTH_ROLE_MAP", {"Vellum.Admin": "admin", "group-batch": "batch"}), \
+         patch.dict(auth._jwks, {"keys": keys, "fetched_at": time.monotonic()}):
+        user = await auth.get_current_user(token)
+        # Only mapped values become roles
+        assert (user["user"], user["roles"]) == ("ada", ["admin", "batch"])
+        assert await auth.require_admin(user) is user
+
+        for bad in (forged, jwt.encode(dict(claims, aud="other"), pem, algorithm="RS256", headers={"kid": "k1"}), "opaque"):
+            with pytest.raises(HTTPException) as exc:
+                await auth.get_current_user(bad)
+            assert exc.value.status_code == 401
+
+        # A literal "admin" claim is not in the map and grants nothing
+        plain = jwt.encode(dict(claims, roles=["admin"], groups=[]), pem, algorithm="RS256", headers={"kid": "k1"})
+        assert (await auth.get_current_user(plain))["roles"] == []
+
 # --- History Service Tests ---
 def test_history_service_logic():
     clean_sys_modules()
@@ -93,3 +132,903 @@ async def test_llm_service_providers():
     # 4. Invalid
     with pytest.raises(ValueError):
         await service._get_llm(ModelConfig(id="bad", name="bad", provider="unknown"))
+
+@pytest.mark.asyncio
+async def test_llm_service_client_pool():
+    clean_sys_modules()
+    from app.services import llm_service as ls_module
+    from app.models.schemas import ModelConfig
+
+    service = ls_module.LLMService()
+    config = ModelConfig(id="gpt-4", name="GPT4", provider="openai", api_key="sk-test")
+
+    # Same config fields -> same pooled client
+    llm = await service._get_llm(config)
+    assert await service._get_llm(config.model_copy()) is llm
+
+    # A changed key field builds a separate client
+    other = await service._get_llm(config.model_copy(update={"api_key": "sk-other"}))
+    assert other is not llm
+
+    # Invalidation drops every client for that model
+    assert service.invalidate("gpt-4") == 2
+    assert await service._get_llm(config) is not llm
+
+@pytest.mark.asyncio
+async def test_llm_service_evicted_clients_close_http_pools():
+    clean_sys_modules()
+    import asyncio
+    from app.services import llm_service as ls_module
+    from app.models.schemas import ModelConfig
+
+    service = ls_module.LLMService()
+    config = ModelConfig(id="gpt-4", name="GPT4", provider="openai", api_key="sk-test")
+    other = config.model_copy(update={"api_key": "sk-other"})
+
+    with patch.object(ls_module.settings, "LLM_CLIENT_POOL_SIZE", 1):
+        await service._get_llm(config)
+        http_client, async_http_client = service._http[service._client_key(config)]
+        # LRU eviction past the pool size closes both HTTP clients
+        await service._get_llm(other)
+        await asyncio.sleep(0)
+        assert http_client.is_closed and async_http_client.is_closed
+
+        # A client evicted mid-request stays open until the request releases it
+        async with service._lease(other):
+            http_client, async_http_client = service._http[service._client_key(other)]
+            assert service.invalidate("gpt-4") == 1
+            await asyncio.sleep(0)
+            assert not async_http_client.is_closed
+        await asyncio.sleep(0)
+        assert http_client.is_closed and async_http_client.is_closed
+    assert not service._http and not service._retired and not service._leases
+
+@pytest.mark.asyncio
+async def test_llm_service_stream_chat_closes_upstream():
+    clean_sys_modules()
+    from app.services import llm_service as ls_module
+    from types import SimpleNamespace
+
+    closed = []
+
+    async def upstream():
+        try:
+            for delta in ["a", "b", "c"]:
+                yield SimpleNamespace(delta=delta)
+        finally:
+            closed.append(True)
+
+    fake_llm = MagicMock()
+    fake_llm.astream_chat = AsyncMock(return_value=upstream())
+
+    service = ls_module.LLMService()
+    with patch.object(service, "_get_llm", AsyncMock(return_value=fake_llm)):
+        stream = service.stream_chat([{"role": "user", "content": "hi"}])
+        assert await stream.__anext__() == "a"
+        # Simulate a client disconnect after the first token
+        await stream.aclose()
+
+    assert closed == [True]
+
+@pytest.mark.asyncio
+async def test_llm_router_hedges_slow_stream_and_cancels_loser():
+    clean_sys_modules()
+    import asyncio
+    from app.services import llm_service as ls_module
+    from app.models.schemas import RoutingPolicy
+
+    service = ls_module.LLMService()
+    service.router.set_policy(RoutingPolicy(
+        primary_model_id="gpt-4", secondary_model_id="gemini-1.5-flash",
+        default_hedge_delay_ms=20, min_hedge_delay_ms=0, max_hedge_rate=1.0
+    ))
+    closed = []
+
+    async def fake_stream(config, messages):
+        try:
+            if config.id == "gpt-4":
+                await asyncio.sleep(5)  # cold primary
+            for delta in [config.id, "!"]:
+                yield delta
+        finally:
+            closed.append(config.id)
+
+    with patch.object(service, "_stream_chat", fake_stream):
+        deltas = [d async for d in service.stream_chat([{"role": "user", "content": "hi"}])]
+
+    # The secondary answered first; the primary was closed instead of left generating
+    assert deltas == ["gemini-1.5-flash", "!"]
+    assert sorted(closed) == ["gemini-1.5-flash", "gpt-4"]
+    stats = service.router.stats()
+    assert (stats["hedged"], stats["secondary_wins"]) == (1, 1)
+    assert stats["models"]["gpt-4"]["cancelled"] == 1
+
+@pytest.mark.asyncio
+async def test_llm_router_falls_back_and_skips_unhealthy_primary():
+    clean_sys_modules()
+    from app.services import llm_service as ls_module
+    from app.models.schemas import RoutingPolicy
+
+    service = ls_module.LLMService()
+    service.router.set_policy(RoutingPolicy(
+        primary_model_id="gpt-4", secondary_model_id="gemini-1.5-flash", hedge_enabled=False, min_samples=3
+    ))
+    calls = []
+
+    async def fake_chat(config, messages):
+        calls.append(config.id)
+        if config.id == "gpt-4":
+            return f"{ls_module.LLM_ERROR_PREFIX} overloaded"
+        return "fallback answer"
+
+    with patch.object(service, "_chat", fake_chat):
+        for i in range(3):
+            assert await service.chat([{"role": "user", "content": f"q{i}"}]) == "fallback answer"
+        # After enough failures the primary is skipped without being called
+        assert service.resolve_model_id() == "gemini-1.5-flash"
+        await service.chat([{"role": "user", "content": "q3"}])
+
+    assert calls == ["gpt-4", "gemini-1.5-flash"] * 3 + ["gemini-1.5-flash"]
+    assert service.router.stats()["fallbacks"] == 3
+
+# --- Metrics Tests ---
+@pytest.mark.asyncio
+async def test_llm_service_records_stage_and_token_metrics():
+    clean_sys_modules()
+    from prometheus_client import REGISTRY
+    from app.services import llm_service as ls_module
+    from app.models.schemas import ModelConfig
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    service = ls_module.LLMService()
+    config = ModelConfig(id="metrics-model", name="M", provider="kubeflow")
+    llm = MagicMock()
+    # Server-reported usage wins; a zero count falls back on local tokenization
+    response = MagicMock(raw={"usage": {"prompt_tokens": 42, "completion_tokens": 0}})
+    response.__str__.return_value = "four tokens of text"
+    llm.achat = AsyncMock(return_value=response)
+
+    with patch.object(service, "_get_llm", AsyncMock(return_value=llm)):
+        assert await service._timed_chat(config, [{"role": "user", "content": "hi"}]) == "four tokens of text"
+
+    labels = {"model": "metrics-model", "provider": "kubeflow"}
+    assert sample("vellum_llm_tokens_total", kind="prompt", **labels) == 42
+    assert sample("vellum_llm_tokens_total", kind="completion", **labels) > 0
+    assert sample("vellum_stage_duration_seconds_count", stage="llm_total", **labels) == 1
+
+# --- Resilience Tests ---
+@pytest.mark.asyncio
+async def test_provider_guard_breaker_bulkhead_and_rate_limit():
+    import asyncio
+    from app.core.resilience import (
+        ProviderGuard, TokenBucket, CircuitOpenError, BulkheadFullError, RateLimitedError
+    )
+
+    loop = asyncio.get_running_loop()
+    guard = ProviderGuard(max_concurrent=1, max_queue=0, failure_threshold=2, recovery_seconds=0.05)
+
+    # Two consecutive failures open the circuit; calls then fail fast
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            async with guard.call(loop.time() + 1):
+                raise RuntimeError("503")
+    with pytest.raises(CircuitOpenError):
+        async with guard.call(loop.time() + 1):
+            pass
+
+    # After the recovery time one probe is let through; success closes the circuit
+    await asyncio.sleep(0.06)
+    async with guard.call(loop.time() + 1):
+        with pytest.raises(CircuitOpenError):
+            async with guard.call(loop.time() + 1):
+                pass
+    assert guard.stats()["circuit"]["state"] == "closed"
+
+    # Bulkhead: one slot, no queue
+    async with guard.call(loop.time() + 1):
+        with pytest.raises(BulkheadFullError):
+            async with guard.call(loop.time() + 1):
+                pass
+
+    # Token bucket: 60 rpm = 1/s; a second request cannot be served within 0.1s
+    bucket = TokenBucket(per_minute=60)
+    bucket.tokens = 1
+    await bucket.acquire(1, loop.time() + 0.1)
+    with pytest.raises(RateLimitedError):
+        await bucket.acquire(1, loop.time() + 0.1)
+    assert guard.stats()["circuit"]["opened"] == 1
+
+@pytest.mark.asyncio
+async def test_llm_service_timeout_isolated_per_provider():
+    clean_sys_modules()
+    import asyncio
+    from app.services import llm_service as ls_module
+    from app.models.schemas import ModelConfig
+
+    service = ls_module.LLMService()
+    slow = ModelConfig(id="slow", name="Slow", provider="openai", timeout_seconds=0.05)
+    fast = ModelConfig(id="fast", name="Fast", provider="kubeflow")
+
+    async def achat(messages):
+        await asyncio.sleep(1)
+
+    slow_llm, fast_llm = MagicMock(), MagicMock()
+    slow_llm.achat = achat
+    fast_llm.achat = AsyncMock(return_value="ok")
+
+    async def get_llm(config):
+        return slow_llm if config.id == "slow" else fast_llm
+
+    with patch.object(service, "_get_llm", get_llm), \
+         patch.object(ls_module.settings, "LLM_BREAKER_FAILURE_THRESHOLD", 2):
+        for _ in range(2):
+            result = await service._chat(slow, [{"role": "user", "content": "hi"}])
+            assert result.startswith(ls_module.LLM_ERROR_PREFIX) and "timed out" in result
+        # The openai circuit is open now; kubeflow is unaffected
+        assert "circuit open" in await service._chat(slow, [{"role": "user", "content": "hi"}])
+        assert await service._chat(fast, [{"role": "user", "content": "hi"}]) == "ok"
+
+    stats = service.provider_stats()["providers"]
+    assert stats["openai"]["timeouts"] == 2 and stats["openai"]["circuit"]["state"] == "open"
+    assert stats["kubeflow"]["circuit"]["state"] == "closed"
+
+# --- Admission Control Tests ---
+@pytest.mark.asyncio
+async def test_admission_controller_priorities_deadlines_and_shedding():
+    import asyncio
+    from app.core.admission import AdmissionController, AdmissionRejected, priority_for_roles
+
+    assert priority_for_roles(["batch", "admin"]) == "admin"
+    assert priority_for_roles(None) == "batch"
+
+    loop = asyncio.get_running_loop()
+    controller = AdmissionController(max_in_flight=1, max_queue=2)
+    running = await controller.acquire("batch", loop.time() + 1)
+
+    order = []
+
+    async def wait(priority, timeout=1.0):
+        ticket = await controller.acquire(priority, loop.time() + timeout)
+        order.append(priority)
+        ticket.release()
+
+    batch = asyncio.create_task(wait("batch"))
+    interactive = asyncio.create_task(wait("interactive"))
+    await asyncio.sleep(0)
+    assert controller.queued == 2
+
+    # Queue full: an admin request displaces the queued batch request
+    admin = asyncio.create_task(wait("admin"))
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected):
+        await batch
+    # ...but another batch request is turned away up front
+    with pytest.raises(AdmissionRejected) as rejected:
+        await controller.acquire("batch", loop.time() + 1)
+    assert rejected.value.retry_after >= 1 and not rejected.value.expired
+
+    running.release()
+    await asyncio.gather(admin, interactive)
+    assert order == ["admin", "interactive"]
+
+    # A request still queued at its deadline is dropped
+    running = await controller.acquire("interactive", loop.time() + 1)
+    with pytest.raises(AdmissionRejected) as expired:
+        await controller.acquire("interactive", loop.time() + 0.01)
+    assert expired.value.expired
+    running.release()
+
+    stats = controller.stats()
+    assert (stats["in_flight"], stats["queued"]) == (0, 0)
+    assert stats["rejected"] == {"queue_full": 1, "expired": 1, "shed": 1}
+
+# --- Cache Tests ---
+def test_lru_cache_eviction_and_ttl():
+    from app.core.cache import LRUCache
+
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recent
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.stats()["evictions"] == 1
+
+    cache = LRUCache(max_entries=10, max_bytes=10, sizeof=len)
+    cache.set("x", "12345")
+    cache.set("y", "123456")
+    assert len(cache) == 1 and cache.get("y") == "123456"
+
+    cache = LRUCache(max_entries=10, ttl_seconds=60)
+    cache.set("k", "v")
+    with patch("app.core.cache.time.monotonic", return_value=10**9):
+        assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_semantic_answer_cache():
+    from app.services.answer_cache import SemanticAnswerCache
+
+    cache = SemanticAnswerCache()
+    cache.threshold = 0.95
+    cache.store([1.0, 0.0], "m1", 5, "answer", [], generation=1)
+
+    assert cache.lookup([0.99, 0.05], "m1", 5, generation=1).response == "answer"
+    # Different model, context window or a dissimilar query -> miss
+    assert cache.lookup([1.0, 0.0], "m2", 5, generation=1) is None
+    assert cache.lookup([1.0, 0.0], "m1", 3, generation=1) is None
+    assert cache.lookup([0.0, 1.0], "m1", 5, generation=1) is None
+    # New generation drops everything
+    assert cache.lookup([1.0, 0.0], "m1", 5, generation=2) is None
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 4
+    assert stats["invalidations"] == 1 and stats["entries"] == 0
+
+def test_semantic_answer_cache_matrix_follows_evictions():
+    from app.services.answer_cache import SemanticAnswerCache
+
+    cache = SemanticAnswerCache()
+    cache.threshold = 0.95
+    cache.INITIAL_ROWS = 2
+    cache._entries.max_entries = 3
+    for i in range(4):
+        cache.store([1.0, float(i)], "m1", 5, f"answer {i}", [], generation=1)
+
+    # The oldest entry was evicted and its row reused; the matrix grew past its initial size
+    assert cache.lookup([1.0, 0.0], "m1", 5, generation=1) is None
+    assert cache.lookup([1.0, 3.0], "m1", 5, generation=1).response == "answer 3"
+    assert len(cache._rows) == 3 and cache._matrix.shape[0] == 4
+
+    # Expired matches are dropped (freeing their rows) and never served
+    with patch("app.core.cache.time.monotonic", return_value=10**9):
+        assert cache.lookup([1.0, 2.0], "m1", 5, generation=1) is None
+    assert list(cache._rows) == [1] and (cache._row_groups != -1).sum() == 1
+
+def test_semantic_answer_cache_drops_empty_groups():
+    from app.services.answer_cache import SemanticAnswerCache
+
+    cache = SemanticAnswerCache()
+    cache._entries.max_entries = 3
+    # Client-chosen context windows: only groups with live entries are kept
+    for window in range(100):
+        cache.store([1.0, 0.0], "m1", window, "answer", [], generation=1)
+    assert sorted(cache._groups) == [("m1", window, False) for window in (97, 98, 99)]
+    assert cache.lookup([1.0, 0.0], "m1", 99, generation=1).response == "answer"
+
+    cache.invalidate()
+    assert not cache._groups and not cache._group_sizes
+
+@pytest.mark.asyncio
+async def test_rag_service_query_caches():
+    from app.services import rag_service as rs_module
+
+    service = rs_module.RAGService()
+    fake_settings = MagicMock()
+    fake_settings.embed_model.aget_text_embedding_batch = AsyncMock(return_value=[[0.1, 0.2, 0.3]])
+    from llama_index.core.vector_stores.types import VectorStoreQueryResult
+    aquery = AsyncMock(return_value=VectorStoreQueryResult(nodes=[], similarities=[]))
+
+    with patch.object(rs_module, "Settings", fake_settings), \
+         patch.object(rs_module.QdrantVectorStore, "aquery", aquery), \
+         patch.object(service, "collection_generation", AsyncMock(return_value=(0, 10))) as generation:
+        await service.query("What is  RAG?", k=3)
+        await service.query("what is rag?", k=3)
+        # Same normalized query: one TEI call and one Qdrant search
+        assert fake_settings.embed_model.aget_text_embedding_batch.await_count == 1
+        assert aquery.await_count == 1
+
+        # Different k or a new collection generation misses tier two only
+        await service.query("what is rag?", k=5)
+        generation.return_value = (1, 12)
+        await service.query("what is rag?", k=3)
+        assert fake_settings.embed_model.aget_text_embedding_batch.await_count == 1
+        assert aquery.await_count == 3
+
+    stats = service.stats()
+    assert stats["embedding_cache"]["hits"] == 3
+    assert stats["retrieval_cache"]["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_rag_service_generation_follows_ingestion_marker():
+    from app.services import rag_service as rs_module
+    from types import SimpleNamespace
+
+    def info(metadata):
+        return SimpleNamespace(points_count=10, config=SimpleNamespace(
+            params=SimpleNamespace(sparse_vectors=None), metadata=metadata
+        ))
+
+    service = rs_module.RAGService()
+    with patch.object(service, "aclient") as aclient, \
+         patch.object(rs_module.settings, "COLLECTION_VERSION_CHECK_SECONDS", 0):
+        aclient.get_collection = AsyncMock(return_value=info(None))
+        before = await service.collection_generation()
+        # A finished re-ingest keeps the point count but writes a new completion marker
+        aclient.get_collection.return_value = info({"ingested_at": 1700000000.0})
+        after = await service.collection_generation()
+
+    assert before[:2] == after[:2] == (0, 10)
+    assert before != after
+
+@pytest.mark.asyncio
+async def test_rag_service_direct_retrieval():
+    from app.services import rag_service as rs_module
+    from types import SimpleNamespace
+    import json
+
+    service = rs_module.RAGService()
+    # Points 1 and 2 were ingested before the flat "text" payload
+    points = [
+        SimpleNamespace(id=1, score=0.9, payload={"file_name": "a.pdf", "page_label": "2"}),
+        SimpleNamespace(id=2, score=0.8, payload={"file_name": "a.pdf", "page_label": "3"}),
+        SimpleNamespace(id=3, score=0.7, payload={"file_name": "b.pdf", "text": "beta"}),
+    ]
+    legacy = [SimpleNamespace(id=1, payload={"_node_content": json.dumps({"text": "alpha"})})]
+    with patch.object(service, "aclient") as aclient:
+        aclient.query_points = AsyncMock(return_value=SimpleNamespace(points=points))
+        aclient.retrieve = AsyncMock(return_value=legacy)
+        context = await service._retrieve_direct([0.1, 0.2], k=2)
+
+    # One node per file, only the fields chat.py uses
+    assert context == [
+        {"id": "1", "text": "alpha", "metadata": {"file_name": "a.pdf", "page_label": "2"}, "score": 0.9},
+        {"id": "3", "text": "beta", "metadata": {"file_name": "b.pdf"}, "score": 0.7},
+    ]
+    assert aclient.query_points.await_args.kwargs["limit"] == 8
+    # The serialized node is never fetched with the search, only for the returned legacy hit
+    assert "_node_content" not in aclient.query_points.await_args.kwargs["with_payload"]
+    assert aclient.retrieve.await_args.kwargs["ids"] == [1]
+    # Quantization rescoring settings are sent with every dense search
+    params = aclient.query_points.await_args.kwargs["search_params"]
+    assert params.quantization.rescore is True and params.quantization.oversampling == 2.0
+
+@pytest.mark.asyncio
+async def test_embedding_batcher_coalesces_concurrent_calls():
+    import asyncio
+    from app.services.embedding_batcher import EmbeddingBatcher
+
+    calls = []
+
+    async def embed_batch(texts):
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    batcher = EmbeddingBatcher(embed_batch, window_ms=20, max_batch_size=3)
+    # 4 callers, one duplicate: the first 3 fill a batch, the 4th waits for the window
+    results = await asyncio.gather(*(batcher.embed(t) for t in ["a", "bb", "a", "cccc"]))
+
+    assert results == [[1.0], [2.0], [1.0], [4.0]]
+    assert calls == [["a", "bb"], ["cccc"]]
+    stats = batcher.stats()
+    assert stats["requests"] == 4 and stats["batches"] == 2
+    assert stats["batch_size_histogram"]["2"] == 1
+
+@pytest.mark.asyncio
+async def test_embedding_batcher_propagates_errors():
+    from app.services.embedding_batcher import EmbeddingBatcher
+
+    async def embed_batch(texts):
+        raise RuntimeError("TEI down")
+
+    batcher = EmbeddingBatcher(embed_batch, window_ms=1)
+    with pytest.raises(RuntimeError):
+        await batcher.embed("query")
+    assert batcher.stats()["errors"] == 1
+
+# --- Single-flight Tests ---
+@pytest.mark.asyncio
+async def test_singleflight_do_shares_result():
+    import asyncio
+    from app.core.singleflight import SingleFlight
+
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)))
+    assert results == ["answer"] * 5
+    assert len(runs) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "followers": 4}
+
+    # Finished keys are forgotten: the next call runs again
+    await flight.do("k", work)
+    assert len(runs) == 2
+
+@pytest.mark.asyncio
+async def test_singleflight_do_restarts_after_last_waiter_cancels():
+    import asyncio
+    from app.core.singleflight import SingleFlight
+
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    abandoned = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0)
+    abandoned.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await abandoned
+    # The cancelled call is unregistered at once: a caller arriving before it has
+    # finished cancelling starts a new run instead of inheriting the CancelledError
+    assert flight.stats()["in_flight"] == 0
+    assert await flight.do("k", work) == "answer"
+
+@pytest.mark.asyncio
+async def test_singleflight_stream_fans_out_and_cancels_when_unused():
+    import asyncio
+    from app.core.singleflight import SingleFlight
+
+    flight = SingleFlight()
+    produced = []
+    closed = []
+
+    async def tokens():
+        try:
+            for t in ["a", "b", "c"]:
+                produced.append(t)
+                yield t
+                await asyncio.sleep(0.005)
+        finally:
+            closed.append(True)
+
+    async def consume():
+        return [t async for t in flight.stream("k", tokens)]
+
+    assert await asyncio.gather(consume(), consume()) == [["a", "b", "c"]] * 2
+    assert produced == ["a", "b", "c"]
+
+    # A lone subscriber leaving early cancels the upstream producer
+    produced.clear()
+    closed.clear()
+    stream = flight.stream("k", tokens)
+    assert await stream.__anext__() == "a"
+    await stream.aclose()
+    assert closed == [True]
+    assert produced == ["a"]
+    assert flight.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_rag_service_grouped_retrieval_with_fallback():
+    from app.services import rag_service as rs_module
+    from types import SimpleNamespace
+
+    service = rs_module.RAGService()
+    groups = [
+        SimpleNamespace(id="a.pdf", hits=[SimpleNamespace(id=4, score=0.9, payload={"file_name": "a.pdf", "text": "alpha"})]),
+        SimpleNamespace(id="b.pdf", hits=[SimpleNamespace(id=5, score=0.8, payload={"file_name": "b.pdf", "text": "beta"})]),
+    ]
+    with patch.object(service, "aclient") as aclient, \
+         patch.object(rs_module.settings, "RAG_RETRIEVAL_MODE", "grouped"), \
+         patch.object(service, "collection_generation", AsyncMock(return_value=(0, 1))):
+        aclient.query_points_groups = AsyncMock(return_value=SimpleNamespace(groups=groups))
+        context = await service.query("q", k=2, embedding=[0.1, 0.2])
+        assert [c["metadata"]["file_name"] for c in context] == ["a.pdf", "b.pdf"]
+        kwargs = aclient.query_points_groups.await_args.kwargs
+        assert kwargs["group_by"] == "file_name" and kwargs["group_size"] == 1 and kwargs["limit"] == 2
+
+        # Grouping failure falls back to the LlamaIndex path
+        aclient.query_points_groups.side_effect = RuntimeError("no index")
+        with patch.object(service, "_retrieve", AsyncMock(return_value=[])) as fallback:
+            assert await service.query("q", k=3, embedding=[0.3, 0.4]) == []
+            fallback.assert_awaited_once()
+
+def test_mmr_select_diversity_and_unique_files():
+    from app.services.mmr import mmr_select
+
+    query = [1.0, 0.3, 0.0]
+    candidates = [[1.0, 0.25, 0.0], [1.0, 0.2, 0.0], [0.8, 0.0, 0.6], [0.0, 0.0, 1.0]]
+
+    # Pure relevance picks the near-duplicate second
+    assert mmr_select(query, candidates, 2, lambda_mult=1.0) == [0, 1]
+    # Diversity pressure skips the near-duplicate
+    assert mmr_select(query, candidates, 2, lambda_mult=0.5) == [0, 3]
+    # Unique-file constraint: candidates 0 and 1 share a file
+    assert mmr_select(query, candidates, 3, lambda_mult=1.0, groups=["a", "a", "b", "c"]) == [0, 2, 3]
+    assert mmr_select(query, [], 3) == []
+
+@pytest.mark.asyncio
+async def test_rag_service_mmr_retrieval():
+    from app.services import rag_service as rs_module
+    from types import SimpleNamespace
+
+    service = rs_module.RAGService()
+    points = [
+        SimpleNamespace(id=6, score=0.99, vector=[1.0, 0.0], payload={"file_name": "a.pdf", "text": "a1"}),
+        SimpleNamespace(id=7, score=0.98, vector=[0.99, 0.01], payload={"file_name": "a.pdf", "text": "a2"}),
+        SimpleNamespace(id=8, score=0.70, vector=[0.7, 0.7], payload={"file_name": "b.pdf", "text": "b1"}),
+    ]
+    with patch.object(service, "aclient") as aclient:
+        aclient.query_points = AsyncMock(return_value=SimpleNamespace(points=points))
+        context = await service._retrieve_mmr([1.0, 0.0], k=2)
+
+    assert [c["text"] for c in context] == ["a1", "b1"]
+    kwargs = aclient.query_points.await_args.kwargs
+    assert kwargs["with_vectors"] is True and kwargs["limit"] == 20
+
+# --- Hybrid Retrieval Tests ---
+def test_bm25_sparse_encoder():
+    from app.services.sparse_encoder import BM25SparseEncoder, tokenize, term_id
+
+    assert tokenize("What is COVLM-RL and SWEnergy?") == ["covlm-rl", "covlm", "rl", "swenergy"]
+    encoder = BM25SparseEncoder(avg_doc_length=8)
+    indices, values = encoder.encode_document("agents agents agents planning")
+    weights = dict(zip(indices, values))
+    # Term frequency saturates: 3x the occurrences is well under 3x the weight
+    assert weights[term_id("planning")] < weights[term_id("agents")] < 3 * weights[term_id("planning")]
+    assert indices == sorted(indices)
+    assert encoder.encode_query("agents Agents") == ([term_id("agents")], [1.0])
+
+@pytest.mark.asyncio
+async def test_rag_service_hybrid_retrieval_fuses_dense_and_sparse():
+    from app.services import rag_service as rs_module
+    from app.services.sparse_encoder import SPARSE_VECTOR_NAME
+    from types import SimpleNamespace
+
+    def point(pid, file_name):
+        return SimpleNamespace(id=pid, score=0.5, payload={"file_name": file_name, "text": f"chunk {pid}"})
+
+    dense = [point(1, "a.pdf"), point(2, "a.pdf"), point(3, "b.pdf"), point(4, "c.pdf")]
+    sparse = [point(4, "c.pdf"), point(3, "b.pdf")]
+    service = rs_module.RAGService()
+    with patch.object(service, "aclient") as aclient:
+        aclient.query_batch_points = AsyncMock(return_value=[SimpleNamespace(points=dense), SimpleNamespace(points=sparse)])
+        with patch.object(rs_module.settings, "RAG_HYBRID_SPARSE_WEIGHT", 2.0):
+            context = await service._retrieve_hybrid("SWEnergy paper", [0.1, 0.2], k=2)
+
+    # One batched request: dense + named sparse vector
+    requests = aclient.query_batch_points.await_args.kwargs["requests"]
+    assert len(requests) == 2 and requests[1].using == SPARSE_VECTOR_NAME
+    # The keyword hit ranked first by the (heavier) sparse search wins; one chunk per file
+    assert [c["id"] for c in context] == ["4", "3"]
+    assert context[0]["score"] == pytest.approx(1 / 64 + 2 / 61)
+
+@pytest.mark.asyncio
+async def test_rag_service_hybrid_skips_collections_without_sparse_vector():
+    from app.services import rag_service as rs_module
+    from app.services.sparse_encoder import SPARSE_VECTOR_NAME
+    from types import SimpleNamespace
+
+    def info(points, sparse_vectors):
+        return SimpleNamespace(points_count=points, config=SimpleNamespace(params=SimpleNamespace(sparse_vectors=sparse_vectors)))
+
+    service = rs_module.RAGService()
+    hybrid = AsyncMock(side_effect=RuntimeError("Not existing vector name"))
+    direct = AsyncMock(return_value=[])
+    with patch.object(service, "_retrieve_hybrid", hybrid), patch.object(service, "_retrieve_direct", direct), \
+         patch.object(rs_module.metrics, "dependency_error") as dependency_error:
+        # Unknown collection: the first failure is remembered for this generation
+        for _ in range(3):
+            await service._search("query", [0.1], 3, "hybrid")
+        assert hybrid.await_count == 1 and direct.await_count == 3
+        dependency_error.assert_called_once_with("qdrant", "hybrid")
+
+        # A new generation is tried again
+        service.bump_generation()
+        await service._search("query", [0.1], 3, "hybrid")
+        assert hybrid.await_count == 2
+
+        # Known from the collection info: no failing round trip at all
+        with patch.object(service, "aclient") as aclient:
+            aclient.get_collection = AsyncMock(return_value=info(10, None))
+            await service.connect()
+            await service._search("query", [0.1], 3, "hybrid")
+            assert hybrid.await_count == 2
+
+            aclient.get_collection = AsyncMock(return_value=info(12, {SPARSE_VECTOR_NAME: object()}))
+            await service.connect()
+            hybrid.side_effect = None
+            hybrid.return_value = [{"id": "1"}]
+            assert await service._search("query", [0.1], 3, "hybrid") == [{"id": "1"}]
+
+# --- Collection Storage Tests ---
+def test_qdrant_storage_params():
+    from app.services.qdrant_params import quantization_config, vector_params
+    from qdrant_client.http.models import BinaryQuantization, Datatype, ScalarQuantization, ScalarType
+
+    assert quantization_config("none") is None
+    int8 = quantization_config("int8")
+    assert isinstance(int8, ScalarQuantization) and int8.scalar.type == ScalarType.INT8 and int8.scalar.always_ram
+    assert isinstance(quantization_config("binary"), BinaryQuantization)
+    params = vector_params(384, datatype="float16", on_disk=True)
+    assert params.datatype == Datatype.FLOAT16 and params.on_disk
+    # Defaults leave Qdrant's own (float32, in RAM) untouched
+    assert vector_params(384).datatype is None and vector_params(384).on_disk is None
+    with pytest.raises(ValueError):
+        quantization_config("pq")
+
+def test_qdrant_hnsw_params():
+    from app.services import qdrant_params
+
+    assert qdrant_params.hnsw_config() is None
+    config = qdrant_params.hnsw_config(m=32, full_scan_threshold=5000)
+    assert (config.m, config.ef_construct, config.full_scan_threshold) == (32, None, 5000)
+    # hnsw_ef 0 leaves the beam width to Qdrant; explicit arguments override Settings
+    assert qdrant_params.search_params().hnsw_ef is None
+    with patch.object(qdrant_params.settings, "QDRANT_SEARCH_HNSW_EF", 128):
+        assert qdrant_params.search_params().hnsw_ef == 128
+        params = qdrant_params.search_params(hnsw_ef=32, exact=True)
+    assert (params.hnsw_ef, params.exact) == (32, True)
+
+# --- Rerank Tests ---
+@pytest.mark.asyncio
+async def test_reranker_batches_caches_and_respects_budget():
+    import asyncio
+    import json
+    import httpx
+    from app.services.reranker import Reranker
+
+    requests = []
+
+    async def handler(request):
+        body = json.loads(request.content)
+        requests.append(body)
+        if body["query"] == "slow":
+            await asyncio.sleep(1)
+        # Score = passage length, returned sorted by score like TEI
+        scores = [{"index": i, "score": float(len(t))} for i, t in enumerate(body["texts"])]
+        return httpx.Response(200, json=sorted(scores, key=lambda s: -s["score"]))
+
+    reranker = Reranker()
+    reranker.client = httpx.AsyncClient(base_url="http://rerank", transport=httpx.MockTransport(handler))
+    context = [
+        {"id": "p1", "text": "short", "metadata": {}, "score": 0.9},
+        {"id": "p2", "text": "the longest passage", "metadata": {}, "score": 0.8},
+        {"id": "p3", "text": "medium text", "metadata": {}, "score": 0.7},
+    ]
+
+    top = await reranker.rerank("What?", "what?", context, k=2)
+    assert [n["id"] for n in top] == ["p2", "p3"]
+    assert top[0]["retrieval_score"] == 0.8 and top[0]["score"] == float(len("the longest passage"))
+    # All candidates went out in one request
+    assert len(requests) == 1 and len(requests[0]["texts"]) == 3
+
+    # Cached scores: no new request for the same query and points
+    assert [n["id"] for n in await reranker.rerank("what?", "what?", context, k=2)] == ["p2", "p3"]
+    assert len(requests) == 1
+
+    # Over the latency budget: retrieval order is kept
+    with patch("app.services.reranker.settings.RERANK_LATENCY_BUDGET_MS", 20):
+        assert [n["id"] for n in await reranker.rerank("slow", "slow", context, k=2)] == ["p1", "p2"]
+    # Under load: skipped without a request
+    with patch("app.services.reranker.settings.RERANK_MAX_IN_FLIGHT", 0):
+        assert [n["id"] for n in await reranker.rerank("new", "new", context, k=2)] == ["p1", "p2"]
+    assert reranker.stats()["skipped"] == {"load": 1, "budget": 1, "error": 0}
+
+# --- Context Packing Tests ---
+def test_pack_context_dedupes_overlap_and_respects_budget():
+    from app.services.context_packer import pack_context, count_tokens
+    from app.models.schemas import Citation
+
+    shared = "The overlapping sentence that both chunks contain at their boundary. "
+    first = Citation(source="a.pdf", page=1, score=0.9, text="Intro text about agents. " + shared)
+    second = Citation(source="a.pdf", page=1, score=0.8, text=shared + "Continuation about memory.")
+    other = Citation(source="b.pdf", page=2, score=0.1, text="word " * 400)
+
+    packed = pack_context([other, second, first], token_budget=10_000)
+    # Best score first; the repeated span is removed from the lower-scored chunk only
+    assert [c.source for c in packed.citations] == ["a.pdf", "a.pdf", "b.pdf"]
+    assert packed.texts[1] == "Continuation about memory."
+    assert packed.citations[1].text == second.text
+    assert packed.overlap_chars_removed == len(shared.strip()) + 1
+
+    budget = count_tokens(first.text.strip()) + count_tokens("Continuation about memory.")
+    packed = pack_context([first, second, other], token_budget=budget)
+    assert [c.score for c in packed.citations] == [0.9, 0.8]
+    assert packed.dropped == 1
+    assert packed.context_tokens <= budget
+
+# --- Compression Tests ---
+def test_split_sentences_offsets():
+    from app.services.compressor import split_sentences
+
+    text = "Agents plan. They act!  Memory helps (a lot).\n\nHeading\nMore text"
+    spans = split_sentences(text)
+    assert [text[s:e] for s, e in spans] == [
+        "Agents plan.", "They act!", "Memory helps (a lot).", "Heading\nMore text"
+    ]
+
+@pytest.mark.asyncio
+async def test_compress_citations_keeps_relevant_sentences():
+    from app.services.compressor import compress_citations
+    from app.models.schemas import Citation
+
+    text = "Cats sleep a lot. Qdrant stores vectors. Dogs bark loudly. Vectors enable search."
+    citation = Citation(source="a.pdf", page=1, text=text, score=0.9)
+    calls = []
+
+    async def embed_batch(sentences):
+        calls.append(sentences)
+        return [[1.0, 0.0] if "ector" in s else [0.0, 1.0] for s in sentences]
+
+    result = await compress_citations([1.0, 0.0], [citation, citation], embed_batch, ratio=0.5)
+
+    # One batched embedding call for every sentence of every chunk
+    assert len(calls) == 1 and len(calls[0]) == 8
+    assert result.texts[0] == "Qdrant stores vectors. Vectors enable search."
+    assert result.sentences_total == 8 and result.sentences_kept == 4
+    # The citation still carries the full source text; spans point into it
+    kept = result.citations[0]
+    assert kept.text == text
+    assert [text[s:e] for s, e in kept.spans] == ["Qdrant stores vectors.", "Vectors enable search."]
+
+# --- Conversation Memory Tests ---
+@pytest.mark.asyncio
+async def test_conversation_memory_compacts_incrementally():
+    from app.services.memory_service import ConversationMemory
+    from app.services.history_service import CONVERSATIONS
+    from app.services.context_packer import count_tokens
+
+    memory = ConversationMemory()
+    turn = "word " * 40
+    budget = 3 * count_tokens(f"{turn}answer 0")
+    summaries = []
+
+    async def fake_chat(messages, model_id=None):
+        summaries.append(messages[1]["content"])
+        return f"summary {len(summaries)}"
+
+    with patch("app.services.memory_service.settings.HISTORY_TOKEN_BUDGET", budget), \
+         patch("app.services.memory_service.settings.MEMORY_COMPACTION_CHUNK_TOKENS", budget), \
+         patch("app.services.memory_service.llm_service.chat", side_effect=fake_chat):
+        for i in range(6):
+            memory.record("mem-session", f"{turn}{i}", f"{turn}answer {i}", [])
+            await memory.wait("mem-session")
+        context = memory.context("mem-session")
+
+    # 12 messages: the recent window holds 3, the other 9 are folded into the summary
+    assert context.summary == f"summary {len(summaries)}"
+    assert len(context.turns) == 3 and context.summarized_messages == 9
+    assert context.metadata()["history_tokens"] <= budget + count_tokens(context.summary)
+    # Every compaction saw only the previous summary plus a bounded chunk of new turns
+    assert "(empty)" in summaries[0]
+    assert all(f"summary {i}" in prompt for i, prompt in enumerate(summaries[1:], start=1))
+    assert all(prompt.count("\nuser:") + prompt.count("\nassistant:") <= 3 for prompt in summaries)
+    assert memory.stats()["compactions"] == len(summaries)
+    CONVERSATIONS.pop("mem-session", None)
+
+# --- Warm-up Tests ---
+@pytest.mark.asyncio
+async def test_warmup_retries_failed_steps_then_marks_ready():
+    from app.services.warmup import WarmUpService
+    from app.services.rag_service import rag_service
+    from app.services.llm_service import llm_service
+
+    warmup = WarmUpService()
+    # TEI is down for the first attempt; the search waits for it
+    embed = AsyncMock(side_effect=[ConnectionError("tei starting"), [[0.1, 0.2]]])
+    with patch("app.services.warmup.settings.WARMUP_RETRY_SECONDS", 0.01), \
+         patch("app.services.warmup.settings.RERANK_ENABLED", False), \
+         patch.object(rag_service, "connect", AsyncMock(return_value=10)), \
+         patch.object(rag_service, "embed_texts", embed), \
+         patch.object(rag_service, "warm_search", AsyncMock(return_value=1)) as search, \
+         patch.object(llm_service, "warm_up", AsyncMock(return_value="qwen")):
+        assert warmup.status()["ready"] is False
+        await warmup.run()
+
+    status = warmup.status()
+    assert status["ready"] is True
+    assert status["steps"]["tei"]["attempts"] == 2 and status["steps"]["tei"]["ok"] is True
+    assert status["steps"]["qdrant"]["detail"] == {"points": 10}
+    assert status["steps"]["llm"]["detail"] == {"model": "qwen"}
+    assert "reranker" not in status["steps"]
+    search.assert_awaited_once()
+
+    # A dependency that never comes up is reported, and the pod is marked ready at the timeout
+    warmup = WarmUpService()
+    with patch("app.services.warmup.settings.WARMUP_TIMEOUT_SECONDS", 0.05), \
+         patch("app.services.warmup.settings.WARMUP_RETRY_SECONDS", 0.01), \
+         patch("app.services.warmup.settings.WARMUP_LLM", False), \
+         patch.object(rag_service, "connect", AsyncMock(side_effect=ConnectionError("qdrant down"))), \
+         patch.object(rag_service, "embed_texts", AsyncMock(return_value=[[0.1]])):
+        await warmup.run()
+    assert warmup.ready is True
+    assert warmup.steps["qdrant"]["ok"] is False and "qdrant down" in warmup.steps["qdrant"]["error"]
+    assert "search" not in warmup.steps
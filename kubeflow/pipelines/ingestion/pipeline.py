@@ -1,5 +1,6 @@
 from kfp import dsl
 from kfp import compiler
+from kfp.dsl import Metrics, Output
 
 @dsl.component(
     base_image='vellum-ingest:local',
@@ -21,7 +22,14 @@ def ingest_documents_op(
     top_k: int = 2,
     model_name: str = "BAAI/bge-small-en-v1.5",
     embeddings_service_url: str = "http://embeddings-service.kubeflow-user-example-com/v1",
-    cleanup: bool = False
+    cleanup: bool = False,
+    quantization: str = "none",
+    vector_datatype: str = "float32",
+    on_disk_vectors: bool = False,
+    on_disk_payload: bool = False,
+    hnsw_m: int = 0,
+    hnsw_ef_construct: int = 0,
+    full_scan_threshold: int = 0
 ):
     import subprocess
     import sys
@@ -48,10 +56,21 @@ def ingest_documents_op(
         "--breakpoint_threshold", str(breakpoint_threshold),
         "--max_docs", str(max_docs),
         "--top_k", str(top_k),
-        "--model_name", model_name
+        "--model_name", model_name,
+        "--quantization", quantization,
+        "--vector_datatype", vector_datatype,
+        "--hnsw_m", str(hnsw_m),
+        "--hnsw_ef_construct", str(hnsw_ef_construct),
+        "--full_scan_threshold", str(full_scan_threshold),
+        # Evaluated by the separate evaluate_retrieval_op step
+        "--golden_set", ""
     ]
     if cleanup:
         cmd.append("--cleanup")
+    if on_disk_vectors:
+        cmd.append("--on_disk_vectors")
+    if on_disk_payload:
+        cmd.append("--on_disk_payload")
     
     result = subprocess.run(cmd, capture_output=True, text=True)
     
@@ -62,6 +81,51 @@ def ingest_documents_op(
     if result.returncode != 0:
         raise RuntimeError(f"Ingestion failed with code {result.returncode}")
 
+@dsl.component(
+    base_image='vellum-ingest:local',
+    packages_to_install=[]
+)
+def evaluate_retrieval_op(
+    metrics: Output[Metrics],
+    qdrant_host: str = "qdrant.qdrant.svc.cluster.local",
+    qdrant_port: int = 6333,
+    top_k: int = 2,
+    model_name: str = "BAAI/bge-small-en-v1.5",
+    embeddings_service_url: str = "http://embeddings-service.kubeflow-user-example-com/v1",
+    objective: str = "ndcg"
+):
+    import json
+    import os
+    import subprocess
+    import sys
+
+    os.environ["EMBEDDINGS_SERVICE_URL"] = embeddings_service_url
+
+    # Golden set evaluation script and data are baked into the image (see Dockerfile)
+    output_json = "/tmp/retrieval_metrics.json"
+    cmd = [
+        "python",
+        "/app/evaluate_retrieval.py",
+        "--qdrant_host", qdrant_host,
+        "--qdrant_port", str(qdrant_port),
+        "--top_k", str(top_k),
+        "--model_name", model_name,
+        "--objective", objective,
+        "--output_json", output_json
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+
+    print(result.stdout)
+    if result.stderr:
+        print("STDERR:", result.stderr, file=sys.stderr)
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Evaluation failed with code {result.returncode}")
+
+    with open(output_json) as f:
+        for name, value in json.load(f).items():
+            metrics.log_metric(name, value)
+
 @dsl.pipeline(
     name='vellum-ingestion-pipeline',
     description='Ingests documents from MinIO to Qdrant using LlamaIndex'
@@ -81,6 +145,13 @@ def ingestion_pipeline(
     model_name: str = "BAAI/bge-small-en-v1.5",
     embeddings_service_url: str = "http://embeddings-service.kubeflow-user-example-com/v1",
     cleanup: bool = False,
+    quantization: str = "none",
+    vector_datatype: str = "float32",
+    on_disk_vectors: bool = False,
+    on_disk_payload: bool = False,
+    hnsw_m: int = 0,
+    hnsw_ef_construct: int = 0,
+    full_scan_threshold: int = 0,
     enable_cache: bool = False
 ):
     # Create the task
@@ -98,10 +169,27 @@ def ingestion_pipeline(
         top_k=top_k,
         model_name=model_name,
         embeddings_service_url=embeddings_service_url,
-        cleanup=cleanup
+        cleanup=cleanup,
+        quantization=quantization,
+        vector_datatype=vector_datatype,
+        on_disk_vectors=on_disk_vectors,
+        on_disk_payload=on_disk_payload,
+        hnsw_m=hnsw_m,
+        hnsw_ef_construct=hnsw_ef_construct,
+        full_scan_threshold=full_scan_threshold
     )
     if not enable_cache:
         task.set_caching_options(False)
+
+    # Golden-set retrieval metrics (recall@k, MRR, nDCG, latency) as KFP Metrics
+    eval_task = evaluate_retrieval_op(
+        qdrant_host=qdrant_host,
+        qdrant_port=qdrant_port,
+        top_k=top_k,
+        model_name=model_name,
+        embeddings_service_url=embeddings_service_url
+    ).after(task)
+    eval_task.set_caching_options(False)
     
     # Force use of local image in Minikube
     # task.set_image_pull_policy("Never") # Not supported in V2 SDK directly on task
@@ -0,0 +1,191 @@
+import os
+import json
+import math
+import time
+import argparse
+from typing import Callable, Dict, List, Set
+
+import qdrant_client
+from qdrant_client.http.models import QueryRequest
+
+DEFAULT_GOLDEN_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_set.jsonl")
+METRIC_NAMES = ("recall_at_k", "mrr", "ndcg")
+# TEI accepts up to --max-client-batch-size (128) texts per request
+EMBED_BATCH_SIZE = 128
+
+
+def load_golden_set(path: str) -> List[Dict]:
+    """JSONL of {"query": str, "expected_files": [file_name, ...]}."""
+    golden = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                golden.append({"query": item["query"], "expected_files": set(item["expected_files"])})
+    return golden
+
+
+def embedding_model(model_name: str):
+    from llama_index.embeddings.openai import OpenAIEmbedding
+    return OpenAIEmbedding(
+        model_name=model_name,
+        api_base=os.getenv("EMBEDDINGS_SERVICE_URL", "http://embeddings-service.kubeflow-user-example-com/v1"),
+        api_key="EMPTY",
+        embed_batch_size=EMBED_BATCH_SIZE
+    )
+
+
+def indexed_files(client, collection_name: str) -> Set[str]:
+    """Distinct file_name values in the collection."""
+    files, offset = set(), None
+    while True:
+        points, offset = client.scroll(
+            collection_name, limit=1024, offset=offset, with_payload=["file_name"], with_vectors=False
+        )
+        files.update((p.payload or {}).get("file_name") for p in points)
+        if offset is None:
+            return files
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)] if values else 0.0
+
+
+def score_ranking(ranked: List[str], expected: Set[str], k: int) -> Dict[str, float]:
+    """File-level recall@k, reciprocal rank and nDCG@k (binary relevance)."""
+    top = ranked[:k]
+    hits = [1.0 if f in expected else 0.0 for f in top]
+    first = next((i for i, hit in enumerate(hits) if hit), None)
+    dcg = sum(hit / math.log2(i + 2) for i, hit in enumerate(hits))
+    ideal = sum(1.0 / math.log2(i + 2) for i in range(min(len(expected), k)))
+    return {
+        "recall_at_k": sum(hits) / len(expected),
+        "mrr": 0.0 if first is None else 1.0 / (first + 1),
+        "ndcg": dcg / ideal if ideal else 0.0
+    }
+
+
+def evaluate(
+    client,
+    collection_name: str,
+    golden: List[Dict],
+    embed_texts: Callable[[List[str]], List[List[float]]],
+    k: int,
+    latency_passes: int = 1
+) -> Dict[str, float]:
+    """
+    Golden-set retrieval metrics for the collection.
+
+    Queries whose expected files are not in the collection (e.g. runs with max_docs)
+    are skipped. All queries are embedded in one batched call and searched with one
+    Qdrant batch request; the relevance metrics come from that batch. Per-query
+    latency percentiles come from separate single-query searches.
+    """
+    available = indexed_files(client, collection_name)
+    golden = [
+        {**item, "expected_files": item["expected_files"] & available}
+        for item in golden if item["expected_files"] & available
+    ]
+    if not golden:
+        print(f"⚠️ No golden-set query has its expected file in '{collection_name}'.")
+        return {name: 0.0 for name in METRIC_NAMES}
+
+    queries = [item["query"] for item in golden]
+    embeddings = embed_texts(queries)
+
+    # Over-fetch chunks so that k distinct files remain after de-duplication
+    requests = [QueryRequest(query=e, limit=k * 4, with_payload=["file_name"]) for e in embeddings]
+    started = time.perf_counter()
+    responses = client.query_batch_points(collection_name, requests=requests)
+    batch_ms = (time.perf_counter() - started) * 1000.0
+
+    totals = {name: 0.0 for name in METRIC_NAMES}
+    for item, response in zip(golden, responses):
+        ranked = []
+        for point in response.points:
+            file_name = (point.payload or {}).get("file_name")
+            if file_name not in ranked:
+                ranked.append(file_name)
+        for name, value in score_ranking(ranked, item["expected_files"], k).items():
+            totals[name] += value
+
+    latencies = []
+    for _ in range(latency_passes):
+        for embedding in embeddings:
+            started = time.perf_counter()
+            client.query_points(collection_name, query=embedding, limit=k * 4, with_payload=["file_name"])
+            latencies.append((time.perf_counter() - started) * 1000.0)
+
+    metrics = {name: total / len(golden) for name, total in totals.items()}
+    metrics.update({
+        "queries": float(len(golden)),
+        "batch_ms": batch_ms,
+        "latency_p50_ms": _percentile(latencies, 0.50),
+        "latency_p95_ms": _percentile(latencies, 0.95),
+        "latency_p99_ms": _percentile(latencies, 0.99)
+    })
+    return metrics
+
+
+def report(metrics: Dict[str, float], objective: str = "ndcg", output_json: str = ""):
+    """name=value lines (Katib StdOut collector); `accuracy` is the tuning objective."""
+    for name, value in metrics.items():
+        print(f"{name}={value:.4f}")
+    print(f"accuracy={metrics[objective]:.4f}")
+    if output_json:
+        os.makedirs(os.path.dirname(output_json) or ".", exist_ok=True)
+        with open(output_json, "w") as f:
+            json.dump(metrics, f, indent=2)
+
+
+def ingest_local(docs_dir: str, chunk_size: int, chunk_overlap: int, splitter_mode: str,
+                 breakpoint_threshold: int, model_name: str):
+    """Ingest a local directory into an in-memory Qdrant ("vellum") with the regular ingestion path."""
+    from run_ingestion import ingest
+    client = qdrant_client.QdrantClient(location=":memory:")
+    ingest(
+        qdrant_host="", qdrant_port=0, minio_endpoint="", minio_access_key="", minio_secret_key="",
+        bucket="", prefix="", chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+        splitter_mode=splitter_mode, breakpoint_threshold=breakpoint_threshold, max_docs=0,
+        model_name=model_name, local_docs=docs_dir, client=client, golden_set=""
+    )
+    return client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Golden-set retrieval evaluation (recall@k, MRR, nDCG, latency)")
+    parser.add_argument("--golden_set", type=str, default=DEFAULT_GOLDEN_SET)
+    parser.add_argument("--qdrant_host", type=str, default="qdrant.qdrant.svc.cluster.local")
+    parser.add_argument("--qdrant_port", type=int, default=6333)
+    parser.add_argument("--collection", type=str, default="vellum")
+    parser.add_argument("--top_k", type=int, default=3)
+    parser.add_argument("--model_name", type=str, default="BAAI/bge-small-en-v1.5")
+    parser.add_argument("--objective", type=str, default="ndcg", choices=METRIC_NAMES)
+    parser.add_argument("--latency_passes", type=int, default=1)
+    parser.add_argument("--output_json", type=str, default="")
+    # Standalone mode: ingest a local directory into an in-memory Qdrant first
+    parser.add_argument("--local_docs", type=str, default="", help="Directory to ingest into an in-memory Qdrant")
+    parser.add_argument("--chunk_size", type=int, default=512)
+    parser.add_argument("--chunk_overlap", type=int, default=20)
+    parser.add_argument("--splitter_mode", type=str, default="fixed", choices=["fixed", "semantic"])
+    parser.add_argument("--breakpoint_threshold", type=int, default=95)
+    args = parser.parse_args()
+
+    if args.local_docs:
+        client = ingest_local(
+            args.local_docs, args.chunk_size, args.chunk_overlap, args.splitter_mode,
+            args.breakpoint_threshold, args.model_name
+        )
+        args.collection = "vellum"
+    else:
+        print(f"🔌 Connecting to Qdrant at {args.qdrant_host}:{args.qdrant_port}")
+        client = qdrant_client.QdrantClient(host=args.qdrant_host, port=args.qdrant_port)
+
+    print(f"⚖️ Evaluating '{args.collection}' on {args.golden_set} (k={args.top_k})...")
+    embed_model = embedding_model(args.model_name)
+    metrics = evaluate(
+        client, args.collection, load_golden_set(args.golden_set),
+        embed_model.get_text_embedding_batch, args.top_k, args.latency_passes
+    )
+    report(metrics, args.objective, args.output_json)
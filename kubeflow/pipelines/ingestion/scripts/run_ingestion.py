@@ -1,13 +1,28 @@
 import os
+import sys
+import time
 import argparse
 import qdrant_client
-from llama_index.core import VectorStoreIndex, StorageContext, Settings
+from qdrant_client.http.models import PayloadSchemaType, SparseVectorParams, Modifier
+from llama_index.core import SimpleDirectoryReader, Settings
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.readers.s3 import S3Reader
 from llama_index.core.node_parser import SentenceSplitter, SemanticSplitterNodeParser
 from llama_index.core.ingestion import IngestionPipeline
 
+from evaluate_retrieval import DEFAULT_GOLDEN_SET, METRIC_NAMES, embedding_model, evaluate, load_golden_set, report
+
+try:
+    # Ingestion image is built FROM vellum-backend, so the backend package is on the path
+    from app.services.sparse_encoder import BM25SparseEncoder, SPARSE_VECTOR_NAME
+    from app.services.qdrant_params import INGESTION_MARKER, QUANTIZATION_MODES, VECTOR_DATATYPES, hnsw_config, quantization_config, text_payload_updates, vector_params
+except ImportError:
+    # Local runs from the repo checkout
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "backend"))
+    from app.services.sparse_encoder import BM25SparseEncoder, SPARSE_VECTOR_NAME
+    from app.services.qdrant_params import INGESTION_MARKER, QUANTIZATION_MODES, VECTOR_DATATYPES, hnsw_config, quantization_config, text_payload_updates, vector_params
+
 def ingest(
     qdrant_host: str, 
     qdrant_port: int,
@@ -23,13 +38,25 @@ def ingest(
     max_docs: int = 15,
     top_k: int = 3,
     model_name: str = "BAAI/bge-small-en-v1.5",
-    cleanup: bool = False
+    cleanup: bool = False,
+    quantization: str = "none",
+    vector_datatype: str = "float32",
+    on_disk_vectors: bool = False,
+    on_disk_payload: bool = False,
+    hnsw_m: int = 0,
+    hnsw_ef_construct: int = 0,
+    full_scan_threshold: int = 0,
+    local_docs: str = "",
+    client=None,
+    golden_set: str = DEFAULT_GOLDEN_SET,
+    objective: str = "ndcg"
 ):
     print(f"🚀 Starting STREAMING ingestion logic (Max Docs: {max_docs})...")
     
-    # 1. Connect to Qdrant
-    print(f"🔌 Connecting to Qdrant at {qdrant_host}:{qdrant_port}")
-    client = qdrant_client.QdrantClient(host=qdrant_host, port=qdrant_port)
+    # 1. Connect to Qdrant (callers may pass a client, e.g. an in-memory one for tuning trials)
+    if client is None:
+        print(f"🔌 Connecting to Qdrant at {qdrant_host}:{qdrant_port}")
+        client = qdrant_client.QdrantClient(host=qdrant_host, port=qdrant_port)
     collection_name = "vellum"
     
     if cleanup:
@@ -37,14 +64,49 @@ def ingest(
         if client.collection_exists(collection_name):
             client.delete_collection(collection_name)
         
-        # We need to recreate it with correct parameters
-        from qdrant_client.http.models import VectorParams, Distance
+    if not client.collection_exists(collection_name):
+        # We need to (re)create it with correct parameters
+        print(f"🧱 Creating collection (datatype: {vector_datatype}, quantization: {quantization}, "
+              f"on-disk vectors: {on_disk_vectors}, on-disk payload: {on_disk_payload}, "
+              f"HNSW m: {hnsw_m or 'default'}, ef_construct: {hnsw_ef_construct or 'default'}, "
+              f"full_scan_threshold: {full_scan_threshold or 'default'})")
         client.create_collection(
             collection_name=collection_name,
-            vectors_config=VectorParams(size=384, distance=Distance.COSINE),
+            vectors_config=vector_params(384, datatype=vector_datatype, on_disk=on_disk_vectors),
+            # BM25 term weights per chunk; Qdrant applies IDF at query time
+            sparse_vectors_config={SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)},
+            quantization_config=quantization_config(quantization),
+            hnsw_config=hnsw_config(hnsw_m, hnsw_ef_construct, full_scan_threshold),
+            on_disk_payload=on_disk_payload,
         )
+    elif not cleanup:
+        print("ℹ️ Collection exists: storage and HNSW options only apply when it is created.")
+
+    sparse_vectors = client.get_collection(collection_name).config.params.sparse_vectors or {}
+    hybrid = SPARSE_VECTOR_NAME in sparse_vectors
+    if not hybrid:
+        print(f"⚠️ Collection has no '{SPARSE_VECTOR_NAME}' sparse vector (created before hybrid search). "
+              "Writing dense vectors only; re-run with --cleanup to enable hybrid retrieval.")
+
+    # Keyword index on file_name: lets the backend group hits by file server-side
+    # (query_points_groups). Creating an existing index is a no-op.
+    print("🗂️ Ensuring payload index on 'file_name'...")
+    client.create_payload_index(
+        collection_name=collection_name,
+        field_name="file_name",
+        field_schema=PayloadSchemaType.KEYWORD,
+    )
 
-    vector_store = QdrantVectorStore(client=client, collection_name=collection_name)
+    # Chunk size is in LLM tokens; BM25 length normalization counts words (~0.75 per token)
+    sparse_encoder = BM25SparseEncoder(avg_doc_length=chunk_size * 0.75)
+    vector_store = QdrantVectorStore(
+        client=client,
+        collection_name=collection_name,
+        enable_hybrid=hybrid,
+        sparse_doc_fn=sparse_encoder.encode_documents if hybrid else None,
+        sparse_query_fn=sparse_encoder.encode_queries if hybrid else None,
+        sparse_vector_name=SPARSE_VECTOR_NAME,
+    )
     
     # 2. Configure Embeddings (Remote TEI Service)
     print(f"⚙️ Connecting to Remote Embedding Service ({model_name})...")
@@ -78,25 +140,34 @@ def ingest(
         vector_store=vector_store,
     )
 
-    # 5. Connect to MinIO via S3Reader
-    # Ensure endpoint has http:// prefix for S3Reader if not present
-    s3_url = minio_endpoint
-    if not s3_url.startswith("http"):
-        s3_url = f"http://{s3_url}"
-
-    print(f"📡 Connecting to MinIO via S3Reader: {s3_url}/{bucket}")
-    loader = S3Reader(
-        bucket=bucket,
-        aws_access_id=minio_access_key,
-        aws_access_secret=minio_secret_key,
-        s3_endpoint_url=s3_url
-    )
+    # 5. Document source: a local directory (standalone runs) or MinIO via S3Reader
+    if local_docs:
+        print(f"📂 Listing documents in {local_docs}...")
+        files = sorted(
+            os.path.join(local_docs, name) for name in os.listdir(local_docs)
+            if os.path.isfile(os.path.join(local_docs, name))
+        )
+        load_resource = lambda path: SimpleDirectoryReader(input_files=[path]).load_data()
+    else:
+        # Ensure endpoint has http:// prefix for S3Reader if not present
+        s3_url = minio_endpoint
+        if not s3_url.startswith("http"):
+            s3_url = f"http://{s3_url}"
+
+        print(f"📡 Connecting to MinIO via S3Reader: {s3_url}/{bucket}")
+        loader = S3Reader(
+            bucket=bucket,
+            aws_access_id=minio_access_key,
+            aws_access_secret=minio_secret_key,
+            s3_endpoint_url=s3_url
+        )
+
+        print("📂 Listing documents in MinIO...")
+        files = loader.list_resources(prefix=prefix)
+        files.sort()
+        load_resource = loader.load_resource
 
     # 6. Iterative Processing (Streaming)
-    print("📂 Listing documents in MinIO...")
-    files = loader.list_resources(prefix=prefix)
-    files.sort()
-    
     if max_docs > 0 and len(files) > max_docs:
         print(f"📉 Limiting ingestion to first {max_docs} files (found {len(files)}).")
         files = files[:max_docs]
@@ -108,10 +179,13 @@ def ingest(
         print(f"🔄 Processing [{processed_count+1}/{len(files)}]: {file_key}...")
         try:
             # Load documents (returns a list)
-            documents = loader.load_resource(file_key)
+            documents = load_resource(file_key)
             
             # Run pipeline for these documents
-            pipeline.run(documents=documents)
+            nodes = pipeline.run(documents=documents)
+            # Flat chunk text next to the serialized node, so retrieval only fetches what it needs
+            if nodes:
+                client.batch_update_points(collection_name=collection_name, update_operations=text_payload_updates(nodes))
             
             processed_count += 1
             # In a real pro setup, we might clear doc from memory here
@@ -121,25 +195,21 @@ def ingest(
 
     print(f"✅ Ingestion Complete! Processed {processed_count} files.")
 
-    # 7. Evaluation (Simple Hit Rate Proxy)
-    print("⚖️ Running Evaluation...")
-    eval_index = VectorStoreIndex.from_vector_store(
-        vector_store,
-        embed_model=Settings.embed_model
-    )
-    retriever = eval_index.as_retriever(similarity_top_k=top_k)
-    
-    query = "agentic ai"
-    results = retriever.retrieve(query)
-    
-    avg_score = 0.0
-    if results:
-        for r in results:
-            print(f"   found: {r.node.metadata.get('file_name')} (Score: {r.score})")
-            avg_score += (r.score if r.score else 0.0)
-        avg_score = avg_score / len(results)
-    
-    print(f"accuracy={avg_score:.4f}")
+    # Completion marker: the backend folds it into its collection generation and drops its
+    # caches, even when a re-ingest leaves the point count unchanged
+    try:
+        client.update_collection(collection_name, metadata={INGESTION_MARKER: time.time()})
+    except Exception as e:
+        print(f"⚠️ Could not write the ingestion marker (collection metadata needs Qdrant 1.16+): {e}")
+
+    # 7. Evaluation: golden-set recall@k / MRR / nDCG; `accuracy` (the objective) drives Katib
+    if golden_set:
+        print(f"⚖️ Running golden-set evaluation ({golden_set}, k={top_k})...")
+        eval_model = embedding_model(model_name)
+        metrics = evaluate(
+            client, collection_name, load_golden_set(golden_set), eval_model.get_text_embedding_batch, top_k
+        )
+        report(metrics, objective)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ingest documents from MinIO to Qdrant via Streaming")
@@ -158,6 +228,17 @@ if __name__ == "__main__":
     parser.add_argument("--top_k", type=int, default=3)
     parser.add_argument("--model_name", type=str, default="BAAI/bge-small-en-v1.5")
     parser.add_argument("--cleanup", action="store_true", help="Delete and recreate collection before ingestion")
+    parser.add_argument("--quantization", type=str, default="none", choices=QUANTIZATION_MODES)
+    parser.add_argument("--vector_datatype", type=str, default="float32", choices=VECTOR_DATATYPES)
+    parser.add_argument("--on_disk_vectors", action="store_true", help="Keep original vectors on disk (mmap)")
+    parser.add_argument("--on_disk_payload", action="store_true", help="Keep payloads on disk")
+    parser.add_argument("--hnsw_m", type=int, default=0, help="HNSW edges per node (0 = Qdrant default, 16)")
+    parser.add_argument("--hnsw_ef_construct", type=int, default=0, help="HNSW build beam width (0 = Qdrant default, 100)")
+    parser.add_argument("--full_scan_threshold", type=int, default=0, help="KB; smaller result sets skip HNSW (0 = Qdrant default)")
+    parser.add_argument("--in_memory", action="store_true", help="Ingest into an in-memory Qdrant (tuning trials)")
+    parser.add_argument("--local_docs", type=str, default="", help="Read documents from a local directory instead of MinIO")
+    parser.add_argument("--golden_set", type=str, default=DEFAULT_GOLDEN_SET, help="Golden set for evaluation ('' to skip)")
+    parser.add_argument("--objective", type=str, default="ndcg", choices=METRIC_NAMES, help="Metric reported as accuracy")
 
     args = parser.parse_args()
     ingest(
@@ -175,5 +256,16 @@ if __name__ == "__main__":
         args.max_docs,
         args.top_k,
         args.model_name,
-        args.cleanup
+        args.cleanup,
+        args.quantization,
+        args.vector_datatype,
+        args.on_disk_vectors,
+        args.on_disk_payload,
+        args.hnsw_m,
+        args.hnsw_ef_construct,
+        args.full_scan_threshold,
+        args.local_docs,
+        qdrant_client.QdrantClient(location=":memory:") if args.in_memory else None,
+        args.golden_set,
+        args.objective
     )